@@ -0,0 +1,41 @@
+"""文档分类来源列
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+已有文档的分类都由LLM给出(或为用户指定,无法区分),统一回填为 llm,
+作为本地分类器的训练样本。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _columns(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column["name"] for column in inspector.get_columns(table)}
+
+
+def upgrade():
+    columns = _columns("documents")
+    if not columns:
+        return  # 新数据库,表由应用启动时创建
+    if "category_source" in columns:
+        return  # 列已由 create_all 创建,其中的空值是LLM不可用时的兜底分类,不回填
+    op.add_column("documents", sa.Column("category_source", sa.String(20), nullable=True))
+    op.execute(
+        "UPDATE documents SET category_source = 'llm' "
+        "WHERE category_source IS NULL AND category IS NOT NULL"
+    )
+
+
+def downgrade():
+    if "category_source" in _columns("documents"):
+        op.drop_column("documents", "category_source")
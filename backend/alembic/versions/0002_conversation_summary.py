@@ -0,0 +1,38 @@
+"""对话滚动摘要列
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _columns(table: str) -> set:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return set()
+    return {column["name"] for column in inspector.get_columns(table)}
+
+
+def upgrade():
+    columns = _columns("conversations")
+    if not columns:
+        return  # 新数据库,表由应用启动时创建
+    # 已有会话的 summary_message_id 为空,查询时按 0 处理(尚未折叠)
+    if "summary" not in columns:
+        op.add_column("conversations", sa.Column("summary", sa.Text(), nullable=True))
+    if "summary_message_id" not in columns:
+        op.add_column("conversations", sa.Column("summary_message_id", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    columns = _columns("conversations")
+    for name in ("summary_message_id", "summary"):
+        if name in columns:
+            op.drop_column("conversations", name)
@@ -0,0 +1,52 @@
+"""会话列表和消息分页的联合索引
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+单列索引 conversations.user_id、messages.conversation_id 是新联合索引的前缀,一并删除。
+"""
+from typing import Optional
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# (表, 联合索引名, 列, 被取代的单列索引名)
+_INDEXES = [
+    ("conversations", "ix_conversations_user_last_message", ["user_id", "last_message_at"], "ix_conversations_user_id"),
+    ("messages", "ix_messages_conversation_created", ["conversation_id", "created_at"], "ix_messages_conversation_id"),
+]
+
+
+def _indexes(table: str) -> Optional[set]:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(table):
+        return None
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    for table, name, columns, replaced in _INDEXES:
+        existing = _indexes(table)
+        if existing is None:
+            continue  # 新数据库,表和索引由应用启动时创建
+        if name not in existing:
+            op.create_index(name, table, columns)
+        if replaced in existing:
+            op.drop_index(replaced, table_name=table)
+
+
+def downgrade():
+    for table, name, columns, replaced in _INDEXES:
+        existing = _indexes(table)
+        if existing is None:
+            continue
+        if replaced not in existing:
+            op.create_index(replaced, table, columns[:1])
+        if name in existing:
+            op.drop_index(name, table_name=table)
@@ -1,17 +1,28 @@
 """
 AI聊天API路由
 """
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from starlette.websockets import WebSocketState
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import and_, delete, desc, or_, select, update
 from pydantic import BaseModel
+from loguru import logger
 
-from app.db.database import get_db
+from app.core.config import settings
+from app.core.deadline import reset_deadline, set_deadline
+from app.core.metrics import CHAT_WS_CONNECTIONS
+from app.db.database import AsyncSessionLocal, get_db
 from app.models.user import User
 from app.models.message import Conversation, Message, MessageRole, ConversationStatus
-from app.api.auth import get_current_user
-from app.services.ai_service import AIService
+from app.api.auth import decode_access_token, get_current_user
+from app.services.ai_service import BUSY_REPLY, AIService, stage_timer
+from app.services.history_buffer import recent_messages
+from app.services.llm_limiter import LLMOverloadedError
 
 router = APIRouter()
 
@@ -28,6 +39,7 @@ class MessageResponse(BaseModel):
     content: str
     sources: List[dict] = []
     created_at: str
+    timings: Dict[str, float] = {}  # 各阶段耗时(毫秒),仅发送消息时返回
 
 
 class ConversationResponse(BaseModel):
@@ -37,6 +49,130 @@ class ConversationResponse(BaseModel):
     message_count: int
     last_message_at: str
     messages: List[MessageResponse] = []
+    has_more: bool = False  # 是否还有更早的消息(仅会话详情)
+
+
+# 辅助函数
+async def _owns_conversation(conversation_id: int, user_id: int, db: AsyncSession) -> bool:
+    """会话是否属于该用户"""
+    result = await db.execute(
+        select(Conversation.id).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
+        )
+    )
+    return result.scalar_one_or_none() is not None
+
+
+async def _check_conversation(conversation_id: int, current_user: User, db: AsyncSession):
+    """验证会话是否属于当前用户"""
+    if not await _owns_conversation(conversation_id, current_user.id, db):
+        raise HTTPException(status_code=404, detail="会话不存在")
+
+
+def _new_conversation(content: str, current_user: User) -> Conversation:
+    return Conversation(
+        user_id=current_user.id,
+        property_id=current_user.property_id,
+        title=content[:50],  # 使用消息开头作为标题
+    )
+
+
+async def _resolve_conversation(
+    message_data: ChatMessage,
+    current_user: User,
+    db: AsyncSession,
+) -> int:
+    """获取消息所属会话ID,未指定会话时创建新会话"""
+    if message_data.conversation_id:
+        await _check_conversation(message_data.conversation_id, current_user, db)
+        return message_data.conversation_id
+    
+    conversation = _new_conversation(message_data.content, current_user)
+    db.add(conversation)
+    await db.commit()
+    return conversation.id
+
+
+async def _add_turn(session: AsyncSession, conversation_id: int, messages: List[Message]):
+    """
+    在当前事务中写入一轮对话的消息,并原子地更新会话的消息数和最后消息时间
+    
+    消息数用 UPDATE ... SET message_count = message_count + n 累加,不先读取会话行,
+    同一会话的并发请求也不会丢失计数。
+    """
+    for message in messages:
+        message.conversation_id = conversation_id
+    session.add_all(messages)
+    await session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(
+            message_count=Conversation.message_count + len(messages),
+            last_message_at=datetime.utcnow(),
+        )
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    """编码一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _save_turn(
+    conversation_id: int,
+    user_message: Message,
+    content: str,
+    model: Optional[str],
+    tokens: Optional[int],
+    sources: List[dict],
+    created: bool = False,
+) -> List[Message]:
+    """
+    保存流式对话的一轮(用户消息和已生成的回复在同一事务中写入)
+    
+    使用独立的数据库会话: 流式响应期间请求级会话可能已被释放。
+    
+    Args:
+        created: 会话是本次请求新建的(用于初始化最近消息缓存)
+    
+    Returns:
+        已保存的消息
+    """
+    messages = [user_message]
+    if content:
+        messages.append(Message(
+            role=MessageRole.ASSISTANT,
+            content=content,
+            model=model,
+            tokens=tokens,
+            sources=sources,
+        ))
+    with stage_timer("persist", {}):
+        async with AsyncSessionLocal() as session:
+            await _add_turn(session, conversation_id, messages)
+            await session.commit()
+        await recent_messages.append(conversation_id, messages, create=created)
+    return messages
+
+
+async def _discard_conversation(conversation_id: int):
+    """删除本次请求新建但没有保存任何消息的会话(排队已满时)"""
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                delete(Conversation).where(
+                    Conversation.id == conversation_id,
+                    Conversation.message_count == 0,
+                )
+            )
+            await session.commit()
+    except Exception as e:
+        logger.error(f"删除空会话错误: {str(e)}")
+
+
+# 正在执行的保存任务(持有引用,避免被垃圾回收)
+_pending_saves: Set[asyncio.Task] = set()
 
 
 # API 路由
@@ -46,68 +182,63 @@ async def send_message(
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """发送消息并获取AI回复"""
-    
-    # 如果没有指定会话,创建新会话
-    if not message_data.conversation_id:
-        new_conversation = Conversation(
-            user_id=current_user.id,
-            property_id=current_user.property_id,
-            title=message_data.content[:50],  # 使用消息开头作为标题
-        )
-        db.add(new_conversation)
-        await db.commit()
-        await db.refresh(new_conversation)
-        conversation_id = new_conversation.id
-    else:
-        conversation_id = message_data.conversation_id
-        # 验证会话是否属于当前用户
-        result = await db.execute(
-            select(Conversation).where(
-                Conversation.id == conversation_id,
-                Conversation.user_id == current_user.id
-            )
-        )
-        conversation = result.scalar_one_or_none()
-        if not conversation:
-            raise HTTPException(status_code=404, detail="会话不存在")
+    """
+    发送消息并获取AI回复
     
-    # 保存用户消息
+    用户消息、AI回复和会话统计在拿到回复后一次事务写入(新会话也在同一事务中创建),
+    AI回复失败时不留下没有回复的用户消息。
+    """
+    conversation_id = message_data.conversation_id
+    if conversation_id:
+        await _check_conversation(conversation_id, current_user, db)
+    
+    # 用户消息的时间为收到请求的时间
     user_message = Message(
-        conversation_id=conversation_id,
         role=MessageRole.USER,
         content=message_data.content,
+        created_at=datetime.utcnow(),
     )
-    db.add(user_message)
-    await db.commit()
     
     # 获取AI回复
     ai_service = AIService(db, current_user.property_id)
-    ai_response = await ai_service.chat(
-        conversation_id=conversation_id,
-        user_message=message_data.content
-    )
-    
-    # 保存AI消息
-    assistant_message = Message(
-        conversation_id=conversation_id,
-        role=MessageRole.ASSISTANT,
-        content=ai_response["content"],
-        model=ai_response.get("model"),
-        tokens=ai_response.get("tokens"),
-        sources=ai_response.get("sources", []),
-    )
-    db.add(assistant_message)
-    
-    # 更新会话统计
-    result = await db.execute(
-        select(Conversation).where(Conversation.id == conversation_id)
-    )
-    conversation = result.scalar_one()
-    conversation.message_count += 2
+    try:
+        ai_response = await ai_service.chat(
+            conversation_id=conversation_id,
+            user_message=message_data.content
+        )
+    except LLMOverloadedError:
+        # 高峰期排队已满,明确告知客户端稍后重试
+        raise HTTPException(status_code=503, detail=BUSY_REPLY, headers={"Retry-After": "5"})
     
-    await db.commit()
-    await db.refresh(assistant_message)
+    timings = ai_response.get("timings", {})
+    with stage_timer("persist", timings):
+        assistant_message = Message(
+            role=MessageRole.ASSISTANT,
+            content=ai_response["content"],
+            model=ai_response.get("model"),
+            tokens=ai_response.get("tokens"),
+            sources=ai_response.get("sources", []),
+        )
+        created = not conversation_id
+        if conversation_id:
+            await _add_turn(db, conversation_id, [user_message, assistant_message])
+        else:
+            # 新会话直接写入统计值,flush 取得会话ID后再写入消息
+            conversation = _new_conversation(message_data.content, current_user)
+            conversation.message_count = 2
+            conversation.last_message_at = datetime.utcnow()
+            db.add(conversation)
+            await db.flush()
+            conversation_id = conversation.id
+            for message in (user_message, assistant_message):
+                message.conversation_id = conversation_id
+            db.add_all([user_message, assistant_message])
+        
+        # expire_on_commit=False: 提交后ID和时间可直接读取,无需 refresh
+        await db.commit()
+        await recent_messages.append(
+            conversation_id, [user_message, assistant_message], create=created
+        )
     
     return MessageResponse(
         id=assistant_message.id,
@@ -115,71 +246,395 @@ async def send_message(
         content=assistant_message.content,
         sources=assistant_message.sources,
         created_at=assistant_message.created_at.isoformat(),
+        timings=timings,
     )
 
 
+@router.post("/stream")
+async def stream_message(
+    message_data: ChatMessage,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    发送消息并以 Server-Sent Events 流式返回AI回复
+    
+    事件依次为: conversation(会话ID) -> sources(引用文档) -> token(增量内容,多次) -> done/error。
+    用户消息和回复在流结束后一起保存;客户端中途断开时保存已生成的部分。
+    排队已满时返回 busy 的 error 事件,不保存任何内容(本次新建的会话也会删除)。
+    """
+    conversation_id = await _resolve_conversation(message_data, current_user, db)
+    user_message = Message(
+        role=MessageRole.USER,
+        content=message_data.content,
+        created_at=datetime.utcnow(),
+    )
+    
+    async def event_stream():
+        parts: List[str] = []
+        sources: List[dict] = []
+        model, tokens = None, None
+        busy = False
+        try:
+            yield _sse("conversation", {"conversation_id": conversation_id})
+            # 历史读取使用独立会话,不依赖流式期间可能已释放的请求级会话
+            ai_service = AIService(db, current_user.property_id)
+            async for event in ai_service.chat_stream(
+                conversation_id=conversation_id,
+                user_message=message_data.content
+            ):
+                if event["type"] == "sources":
+                    sources = event["sources"]
+                elif event["type"] == "token":
+                    parts.append(event["content"])
+                elif event["type"] == "done":
+                    model, tokens = event["model"], event["tokens"]
+                elif event["type"] == "error":
+                    busy = event.get("busy", False)
+                    if not parts:
+                        # 中途出错时保留已生成的部分,尚未生成内容时保存兜底回复
+                        parts = [event["content"]]
+                yield _sse(event["type"], event)
+        finally:
+            # 客户端断开时当前任务已被取消,在独立任务中完成保存;
+            # 排队已满时用户消息和繁忙提示都不保存,本次新建的空会话也删除
+            if not busy:
+                save = _save_turn(
+                    conversation_id, user_message, "".join(parts), model, tokens, sources,
+                    created=not message_data.conversation_id,
+                )
+            elif not message_data.conversation_id:
+                save = _discard_conversation(conversation_id)
+            else:
+                save = None
+            if save is not None:
+                task = asyncio.create_task(save)
+                _pending_saves.add(task)
+                task.add_done_callback(_pending_saves.discard)
+                try:
+                    await asyncio.shield(task)
+                except asyncio.CancelledError:
+                    pass
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _authenticate_websocket(token: str) -> Optional[User]:
+    """WebSocket连接认证(只在建立连接时执行一次)"""
+    user_id = decode_access_token(token)
+    if user_id is None:
+        return None
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
+    if user is None or not user.is_active or not user.property_id:
+        return None
+    return user
+
+
+async def _ws_turn(
+    websocket: WebSocket,
+    ai_service: AIService,
+    conversation_id: int,
+    content: str,
+    created: bool,
+) -> bool:
+    """
+    在WebSocket连接上处理一轮对话: 推送事件,结束后保存并追加到连接的历史窗口
+
+    Returns:
+        是否保存了这一轮(排队已满时不保存,本轮新建的空会话也删除)
+    """
+    user_message = Message(
+        role=MessageRole.USER,
+        content=content,
+        created_at=datetime.utcnow(),
+    )
+    parts: List[str] = []
+    sources: List[dict] = []
+    model, tokens = None, None
+    busy = False
+    # 每轮对话单独计算截止时间
+    deadline_token = set_deadline(settings.REQUEST_TIMEOUT)
+    try:
+        await websocket.send_json({"type": "conversation", "conversation_id": conversation_id})
+        async for event in ai_service.chat_stream(
+            conversation_id=conversation_id,
+            user_message=content
+        ):
+            if event["type"] == "sources":
+                sources = event["sources"]
+            elif event["type"] == "token":
+                parts.append(event["content"])
+            elif event["type"] == "done":
+                model, tokens = event["model"], event["tokens"]
+            elif event["type"] == "error":
+                busy = event.get("busy", False)
+                if not parts:
+                    # 中途出错时保留已生成的部分,尚未生成内容时保存兜底回复
+                    parts = [event["content"]]
+            await websocket.send_json(event)
+    finally:
+        reset_deadline(deadline_token)
+        if busy:
+            # 排队已满: 用户消息和繁忙提示都不保存
+            if created:
+                await _discard_conversation(conversation_id)
+        else:
+            # 客户端断开时也保存已生成的部分
+            task = asyncio.create_task(
+                _save_turn(
+                    conversation_id, user_message, "".join(parts), model, tokens, sources,
+                    created=created,
+                )
+            )
+            _pending_saves.add(task)
+            task.add_done_callback(_pending_saves.discard)
+            try:
+                messages = await asyncio.shield(task)
+            except Exception as e:
+                logger.error(f"保存WebSocket对话错误: {str(e)}")
+            else:
+                ai_service.remember_turn(conversation_id, messages)
+    return not busy
+
+
+# 当前进程的WebSocket连接数
+_ws_connections = 0
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, token: str = Query(...)):
+    """
+    WebSocket聊天
+    
+    建立连接时通过 token 查询参数认证一次,之后在同一连接上进行多轮对话。
+    客户端发送 {"content": "...", "conversation_id": 可选},未指定会话时沿用当前会话
+    (首条消息新建会话);服务端依次推送 conversation / sources / token / done / error
+    事件,格式同流式接口。排队已满时推送 busy 的 error 事件,这一轮不保存。
+    
+    连接内保存用户、当前会话、已验证的会话和 AIService(含对话历史窗口),
+    后续轮次不再认证、验证会话或读取历史。
+    """
+    global _ws_connections
+    # 检查和占用名额之间没有 await,认证期间的连接也计入上限
+    if _ws_connections >= settings.WS_MAX_CONNECTIONS:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    _ws_connections += 1
+    CHAT_WS_CONNECTIONS.set(_ws_connections)
+    try:
+        user = await _authenticate_websocket(token)
+        if user is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        await websocket.accept()
+        
+        # AIService 的历史读取和保存都使用独立会话,连接不长期占用数据库连接
+        ai_service = AIService(None, user.property_id, keep_history=True)
+        conversation_id: Optional[int] = None
+        owned: Set[int] = set()
+        
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), settings.WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await websocket.close(code=status.WS_1000_NORMAL_CLOSURE)
+                return
+            
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                data = None
+            content = data.get("content") if isinstance(data, dict) else None
+            if not isinstance(content, str) or not content.strip():
+                await websocket.send_json({"type": "error", "content": "消息格式错误"})
+                continue
+            if len(content) > settings.WS_MAX_MESSAGE_CHARS:
+                await websocket.send_json({"type": "error", "content": "消息过长"})
+                continue
+            
+            requested = data.get("conversation_id")
+            if requested and requested != conversation_id:
+                if isinstance(requested, bool) or not isinstance(requested, int):
+                    await websocket.send_json({"type": "error", "content": "消息格式错误"})
+                    continue
+                if requested not in owned:
+                    async with AsyncSessionLocal() as session:
+                        if not await _owns_conversation(requested, user.id, session):
+                            await websocket.send_json({"type": "error", "content": "会话不存在"})
+                            continue
+                    owned.add(requested)
+                conversation_id = requested
+            
+            created = conversation_id is None
+            if created:
+                async with AsyncSessionLocal() as session:
+                    conversation = _new_conversation(content, user)
+                    session.add(conversation)
+                    await session.commit()
+                conversation_id = conversation.id
+                owned.add(conversation_id)
+                # 新会话没有历史,无需读取
+                ai_service.remember_turn(conversation_id, [], new_conversation=True)
+            
+            saved = await _ws_turn(websocket, ai_service, conversation_id, content, created)
+            if not saved and created:
+                # 新会话已随繁忙的一轮删除,下一条消息重新创建
+                owned.discard(conversation_id)
+                conversation_id = None
+    
+    except WebSocketDisconnect:
+        pass
+    
+    except Exception as e:
+        # 传输层已关闭时发送会抛出 WebSocketDisconnect 以外的异常,与客户端断开同样处理
+        if (
+            websocket.client_state == WebSocketState.CONNECTED
+            and websocket.application_state == WebSocketState.CONNECTED
+        ):
+            logger.error(f"WebSocket聊天错误: {str(e)}")
+            try:
+                await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+            except Exception:
+                pass
+    
+    finally:
+        _ws_connections -= 1
+        CHAT_WS_CONNECTIONS.set(_ws_connections)
+
+
 @router.get("/conversations", response_model=List[ConversationResponse])
 async def get_conversations(
+    before_id: Optional[int] = Query(None, description="上一页最后一个会话的ID"),
+    limit: int = Query(20, ge=1, le=100),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """获取用户的所有会话"""
+    """
+    获取用户的会话(按最后消息时间倒序,游标分页)
+    
+    翻页时传入上一页最后一个会话的ID;返回条数少于 limit 表示没有更多。
+    """
+    query = select(
+        Conversation.id,
+        Conversation.title,
+        Conversation.status,
+        Conversation.message_count,
+        Conversation.last_message_at,
+    ).where(Conversation.user_id == current_user.id)
+    
+    if before_id is not None:
+        cursor = await db.execute(
+            select(Conversation.last_message_at).where(
+                Conversation.id == before_id,
+                Conversation.user_id == current_user.id
+            )
+        )
+        last_message_at = cursor.scalar_one_or_none()
+        if last_message_at is None:
+            raise HTTPException(status_code=404, detail="会话不存在")
+        query = query.where(or_(
+            Conversation.last_message_at < last_message_at,
+            and_(Conversation.last_message_at == last_message_at, Conversation.id < before_id),
+        ))
+    
     result = await db.execute(
-        select(Conversation)
-        .where(Conversation.user_id == current_user.id)
-        .order_by(desc(Conversation.last_message_at))
+        query
+        .order_by(desc(Conversation.last_message_at), desc(Conversation.id))
+        .limit(limit)
     )
-    conversations = result.scalars().all()
-    
-    response = []
-    for conv in conversations:
-        response.append(ConversationResponse(
-            id=conv.id,
-            title=conv.title,
-            status=conv.status,
-            message_count=conv.message_count,
-            last_message_at=conv.last_message_at.isoformat(),
-            messages=[],
-        ))
     
-    return response
+    return [
+        ConversationResponse(
+            id=row.id,
+            title=row.title,
+            status=row.status,
+            message_count=row.message_count,
+            last_message_at=row.last_message_at.isoformat(),
+            messages=[],
+        )
+        for row in result.all()
+    ]
 
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: int,
+    before_id: Optional[int] = Query(None, description="已加载的最早一条消息的ID"),
+    limit: int = Query(50, ge=1, le=200),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """获取会话详情和消息历史"""
+    """
+    获取会话详情和消息历史(游标分页)
+    
+    返回最近的 limit 条消息(按时间升序);加载更早的消息时传入已加载的最早一条消息的ID,
+    has_more 表示是否还有更早的消息。
+    """
     # 验证会话
     result = await db.execute(
-        select(Conversation).where(
+        select(
+            Conversation.id,
+            Conversation.title,
+            Conversation.status,
+            Conversation.message_count,
+            Conversation.last_message_at,
+        ).where(
             Conversation.id == conversation_id,
             Conversation.user_id == current_user.id
         )
     )
-    conversation = result.scalar_one_or_none()
+    conversation = result.first()
     if not conversation:
         raise HTTPException(status_code=404, detail="会话不存在")
     
-    # 获取消息
+    # 获取消息(只取需要的列,不构造ORM对象)
+    query = select(
+        Message.id,
+        Message.role,
+        Message.content,
+        Message.sources,
+        Message.created_at,
+    ).where(Message.conversation_id == conversation_id)
+    
+    if before_id is not None:
+        cursor = await db.execute(
+            select(Message.created_at).where(
+                Message.id == before_id,
+                Message.conversation_id == conversation_id
+            )
+        )
+        created_at = cursor.scalar_one_or_none()
+        if created_at is None:
+            raise HTTPException(status_code=404, detail="消息不存在")
+        query = query.where(or_(
+            Message.created_at < created_at,
+            and_(Message.created_at == created_at, Message.id < before_id),
+        ))
+    
+    # 多取一条判断是否还有更早的消息
     result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conversation_id)
-        .order_by(Message.created_at)
+        query
+        .order_by(desc(Message.created_at), desc(Message.id))
+        .limit(limit + 1)
     )
-    messages = result.scalars().all()
+    rows = result.all()
+    has_more = len(rows) > limit
     
     message_list = [
         MessageResponse(
-            id=msg.id,
-            role=msg.role,
-            content=msg.content,
-            sources=msg.sources,
-            created_at=msg.created_at.isoformat(),
+            id=row.id,
+            role=row.role,
+            content=row.content,
+            sources=row.sources or [],
+            created_at=row.created_at.isoformat(),
         )
-        for msg in messages
+        for row in reversed(rows[:limit])
     ]
     
     return ConversationResponse(
@@ -189,6 +644,7 @@ async def get_conversation(
         message_count=conversation.message_count,
         last_message_at=conversation.last_message_at.isoformat(),
         messages=message_list,
+        has_more=has_more,
     )
 
 
@@ -216,5 +672,6 @@ async def delete_conversation(
     
     await db.delete(conversation)
     await db.commit()
+    await recent_messages.invalidate(conversation_id)
     
     return {"message": "会话已删除"}
@@ -4,9 +4,11 @@
 from typing import List, Optional
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import desc, func, or_, select
 from pydantic import BaseModel
+from loguru import logger
 
+from app.core.config import settings
 from app.db.database import get_db
 from app.models.user import User
 from app.models.document import Document, DocumentCategory
@@ -92,20 +94,25 @@ async def upload_document(
         # AI处理
         ai_service = AIService(db, current_user.property_id)
         
-        # 自动分类
-        if not category:
-            detected_category = await ai_service.classify_document(
+        # 分类、摘要和标签(一次LLM调用,长文档分块并发摘要后合并)
+        if content:
+            enrichment = await ai_service.enrich_document(
                 title=document.title,
-                content=content[:1000]
+                content=content,
+                category=category or None,
             )
+            document.category = DocumentCategory(enrichment.category)
+            document.category_source = enrichment.category_source
+            document.summary = enrichment.summary
+            document.tags = enrichment.tags
+        elif not category:
+            # 无正文时只按标题分类
+            detected_category, source = await ai_service.classify_document(title=document.title, content="")
             document.category = DocumentCategory(detected_category)
+            document.category_source = source
         else:
             document.category = DocumentCategory(category)
-        
-        # 生成摘要
-        if content:
-            summary = await ai_service.generate_summary(content)
-            document.summary = summary
+            document.category_source = "user"
         
         # 向量化存储
         if content:
@@ -167,12 +174,19 @@ async def list_documents(
     if category:
         query = query.where(Document.category == DocumentCategory(category))
     
-    # 关键词搜索
+    # 关键词搜索(标题或正文包含检索词)
     if search:
-        query = query.where(
-            (Document.title.ilike(f"%{search}%")) |
-            (Document.content.ilike(f"%{search}%"))
-        )
+        pattern = f"%{search}%"
+        content_match = Document.content.ilike(pattern)
+        vector_store = VectorStoreService(current_user.property_id)
+        candidates = await vector_store.lexical_candidates(search)
+        if candidates is not None:
+            # 倒排索引预筛选: 只对包含全部检索词项的文档做子串匹配;未向量化的文档不在索引中,仍直接匹配
+            content_match = content_match & or_(
+                Document.id.in_(candidates),
+                func.coalesce(Document.embeddings_generated, 0) != 1,
+            )
+        query = query.where(Document.title.ilike(pattern) | content_match)
     
     query = query.order_by(desc(Document.created_at))
     
@@ -223,7 +237,62 @@ async def get_document(
         summary=document.summary,
         content=document.content,
         tags=document.tags,
-        metadata=document.metadata,
+        metadata=document.doc_metadata,
+        is_processed=bool(document.is_processed),
+        created_at=document.created_at.isoformat(),
+    )
+
+
+@router.post("/{document_id}/reindex", response_model=DocumentResponse)
+async def reindex_document(
+    document_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    重新索引文档
+    
+    重新提取文件文本并更新向量库,只有内容变化的分块会重新向量化。
+    """
+    result = await db.execute(
+        select(Document).where(
+            Document.id == document_id,
+            Document.property_id == current_user.property_id
+        )
+    )
+    document = result.scalar_one_or_none()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    
+    processor = DocumentProcessor()
+    content = processor.extract_text(document.file_path, document.file_type)
+    document.content = content[:10000]  # 限制长度
+    
+    if content:
+        vector_store = VectorStoreService(current_user.property_id)
+        await vector_store.add_document(
+            document_id=document.id,
+            title=document.title,
+            content=content,
+            metadata={
+                "category": document.category.value,
+                "file_type": document.file_type,
+            }
+        )
+        document.embeddings_generated = 1
+    
+    document.is_processed = 1
+    await db.commit()
+    
+    return DocumentResponse(
+        id=document.id,
+        title=document.title,
+        category=document.category.value,
+        file_name=document.file_name,
+        file_type=document.file_type,
+        file_size=document.file_size,
+        summary=document.summary,
         is_processed=bool(document.is_processed),
         created_at=document.created_at.isoformat(),
     )
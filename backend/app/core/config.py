@@ -35,6 +35,8 @@ class Settings(BaseSettings):
     
     # Redis配置
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_TIMEOUT: float = 0.5         # 连接和读写超时(秒),超时后降级读数据库
+    REDIS_MAX_CONNECTIONS: int = 50    # 连接池最大连接数
     
     # JWT配置
     SECRET_KEY: str = "your-secret-key-change-in-production-please"
@@ -45,12 +47,133 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = Field(default="", description="OpenAI API密钥")
     ANTHROPIC_API_KEY: str = Field(default="", description="Anthropic API密钥")
     DEFAULT_AI_MODEL: str = "gpt-4-turbo-preview"
+    OPENAI_BASE_URL: str = ""  # 留空使用官方地址;可指向兼容OpenAI的本地服务(如 scripts/llm_stub_server.py)
     EMBEDDING_MODEL: str = "text-embedding-3-small"
     
+    # LLM HTTP连接池配置(进程内共享一个客户端)
+    LLM_TIMEOUT: float = 60.0                # 读取超时(秒)
+    LLM_CONNECT_TIMEOUT: float = 5.0         # 建连超时(秒)
+    LLM_MAX_CONNECTIONS: int = 100           # 最大连接数
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20  # 保持的空闲连接数
+    LLM_KEEPALIVE_EXPIRY: float = 30.0       # 空闲连接保持时间(秒)
+    LLM_HTTP2: bool = True                   # 是否启用HTTP/2
+    
+    # LLM并发限制(进程内,按物业公平排队,AIMD自适应调整上限)
+    LLM_CONCURRENCY_INITIAL: int = 16        # 初始并发上限
+    LLM_CONCURRENCY_MIN: int = 2             # 并发上限下限
+    LLM_CONCURRENCY_MAX: int = 64            # 并发上限上限
+    LLM_QUEUE_MAX_DEPTH: int = 200           # 等待队列上限,超出时立即拒绝
+    LLM_QUEUE_TIMEOUT: float = 10.0          # 排队等待超时(秒)
+    LLM_LATENCY_TARGET: float = 20.0         # 非流式调用耗时超过此值视为过载(秒),0表示不使用
+    LLM_LIMIT_BACKOFF: float = 0.7           # 过载时并发上限的下调比例
+    
+    # 请求截止时间、重试和对冲配置
+    REQUEST_TIMEOUT: float = 60.0            # 每个API请求的总时间预算(秒),可用 X-Request-Timeout 头缩短
+    LLM_RETRY_ATTEMPTS: int = 3              # LLM调用最多尝试次数(含首次)
+    RETRY_BACKOFF: float = 0.5               # 抖动退避基数(秒)
+    RETRY_MAX_BACKOFF: float = 4.0           # 单次退避上限(秒)
+    RETRY_MIN_BUDGET: float = 1.0            # 剩余时间不足此值时不再重试(秒)
+    LLM_HEDGE_ENABLED: bool = False          # 非流式LLM调用是否发起对冲请求(会增加上游调用量)
+    LLM_HEDGE_PERCENTILE: float = 95.0       # 对冲延迟取最近调用耗时的分位数
+    
+    # LLM路由配置: 每种调用类型一组有序候选 "提供方:模型",逗号分隔,前面的优先;
+    # 未配置密钥的提供方自动跳过,如 "openai:gpt-4-turbo-preview,anthropic:claude-3-sonnet-20240229"
+    LLM_CHAT_ROUTE: str = ""  # 留空使用 openai:DEFAULT_AI_MODEL
+    LLM_SUMMARY_ROUTE: str = "openai:gpt-3.5-turbo,anthropic:claude-3-haiku-20240307"
+    LLM_CLASSIFY_ROUTE: str = "openai:gpt-3.5-turbo,anthropic:claude-3-haiku-20240307"
+    LLM_PROVIDER_ERROR_THRESHOLD: float = 0.5  # 最近调用错误率达到此值时暂停使用该提供方
+    LLM_PROVIDER_COOLDOWN: float = 30.0        # 暂停使用的时长(秒)
+    LLM_PROVIDER_MAX_LATENCY: float = 20.0     # 中位耗时超过此值(秒)时降低该提供方的优先级
+    
+    # 提示词token预算配置
+    PROMPT_TOKEN_BUDGET: int = 6000          # 发送给LLM的提示词总token上限(不含回复)
+    PROMPT_CONTEXT_TOKENS: int = 2500        # 检索上下文token上限
+    PROMPT_HISTORY_TOKENS: int = 2000        # 原文保留的对话历史token上限,更早的轮次折叠进摘要
+    HISTORY_FETCH_LIMIT: int = 20            # 每次读取的未摘要历史消息条数上限
+    HISTORY_SUMMARY_MAX_TOKENS: int = 400    # 对话摘要长度上限
+    HISTORY_FOLD_BATCH: int = 40             # 每次折叠进摘要的消息条数上限
+    HISTORY_BUFFER_ENABLED: bool = True      # 最近消息缓存在Redis中,读取历史时不查数据库
+    HISTORY_BUFFER_SIZE: int = 40            # 每个会话缓存的最近消息条数(不小于 HISTORY_FETCH_LIMIT)
+    HISTORY_BUFFER_TTL: int = 86400          # 缓存有效期(秒),每次追加时续期
+    
+    # 聊天流程各阶段超时(秒),超时后降级继续
+    CHAT_HISTORY_TIMEOUT: float = 2.0        # 读取历史超时,降级为无历史
+    CHAT_RETRIEVAL_TIMEOUT: float = 3.0      # 文档检索超时,降级为不带上下文
+    
+    # WebSocket聊天配置
+    WS_MAX_CONNECTIONS: int = 1000           # 每个进程的WebSocket连接上限
+    WS_IDLE_TIMEOUT: float = 600.0           # 连接空闲超过此时间(秒)后关闭
+    WS_MAX_MESSAGE_CHARS: int = 4000         # 单条消息的最大字符数
+    
+    # 本地向量化模型配置
+    LOCAL_EMBEDDING_MODEL: str = "paraphrase-multilingual-MiniLM-L12-v2"  # 支持中文的模型
+    LOCAL_EMBEDDING_DEVICE: str = ""  # 留空则自动选择(cuda/cpu)
+    LOCAL_EMBEDDING_DIM: int = 384    # MiniLM模型的向量维度
+    EMBEDDING_WARMUP_ON_STARTUP: bool = True
+    EMBEDDING_BATCH_SIZE: int = 32  # 文档分块批量向量化的批大小
+    
+    # 文档分块配置
+    CHUNK_SIZE: int = 400        # 目标块大小(字符数)
+    CHUNK_OVERLAP: int = 60      # 相邻块重叠字符数(按整句)
+    CHUNK_MAX_TOKENS: int = 256  # 单块token上限,0表示不限制
+    
+    # 查询向量化微批处理配置
+    EMBEDDING_BATCH_WINDOW_MS: float = 5.0   # 收集并发查询的时间窗口(毫秒)
+    EMBEDDING_MAX_BATCH_SIZE: int = 64       # 单批最多合并的查询数
+    EMBEDDING_QUEUE_MAX_DEPTH: int = 1000    # 等待队列上限,超出时拒绝请求
+    
     # 向量数据库配置
+    # 存储后端: qdrant / numpy(进程内暴力检索,无需外部服务)
+    VECTOR_BACKEND: str = "qdrant"
+    VECTOR_LOCAL_DIR: str = "./vector_data"   # numpy后端的数据目录
+    VECTOR_LOCAL_QUANTIZE: bool = False       # numpy后端是否以int8量化存储向量
     QDRANT_URL: str = "http://localhost:6333"
     QDRANT_API_KEY: str = ""
     VECTOR_COLLECTION_NAME: str = "property_documents"
+    # 存储模式: per_property(每个物业一个集合) / shared(所有物业共用一个集合,按property_id过滤)
+    VECTOR_STORAGE_MODE: str = "per_property"
+    QDRANT_UPSERT_BATCH_SIZE: int = 256  # 每次写入Qdrant的最大点数
+    QDRANT_TIMEOUT: int = 10                    # 请求超时(秒)
+    QDRANT_MAX_CONNECTIONS: int = 100           # 连接池最大连接数
+    QDRANT_MAX_KEEPALIVE_CONNECTIONS: int = 20  # 连接池保持的空闲连接数
+    
+    # 混合检索配置(关键词BM25 + 向量,倒数排名融合)
+    HYBRID_SEARCH_ENABLED: bool = True
+    LEXICAL_NGRAM: int = 2           # 中文字符n-gram长度
+    LEXICAL_INDEX_TTL: int = 600     # Redis不可用时倒排索引从向量库全量重建的间隔(秒),此时无法感知其他进程的写入
+    RRF_K: int = 60                  # 倒数排名融合平滑常数
+    LEXICAL_MIN_SCORE: float = 0.5   # 只被关键词命中的分块所需的最低归一化BM25得分(0-1)
+    
+    # 检索缓存配置
+    QUERY_EMBEDDING_CACHE_SIZE: int = 10000   # 查询向量缓存条目上限
+    QUERY_EMBEDDING_CACHE_TTL: int = 3600     # 查询向量缓存有效期(秒)
+    SEARCH_RESULT_CACHE_SIZE: int = 5000      # 检索结果缓存条目上限
+    SEARCH_RESULT_CACHE_TTL: int = 300        # 检索结果缓存有效期(秒)
+    CHUNK_EMBEDDING_CACHE_SIZE: int = 5000    # 只被关键词命中的分块的向量缓存条目上限
+    CHUNK_EMBEDDING_CACHE_TTL: int = 3600     # 分块向量缓存有效期(秒)
+    GENERATION_REDIS_BACKOFF: float = 5.0     # 读取Redis中的数据版本号失败后改用进程内版本号的时长(秒)
+    
+    # 语义答案缓存配置(仅首轮提问,按物业隔离)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_THRESHOLD: float = 0.92  # 问题向量余弦相似度阈值
+    ANSWER_CACHE_SIZE: int = 500          # 每个物业的条目上限
+    ANSWER_CACHE_TTL: int = 86400         # 条目有效期(秒)
+    
+    # 文档本地分类配置(关键词规则 + 向量质心,不置信时才调用LLM)
+    CLASSIFIER_LOCAL_ENABLED: bool = True
+    CLASSIFIER_RULE_MIN_SCORE: float = 4.0     # 关键词规则的最低置信得分
+    CLASSIFIER_MIN_SIMILARITY: float = 0.55    # 与最近质心的最低余弦相似度
+    CLASSIFIER_MIN_MARGIN: float = 0.05        # 领先第二名质心的最小差距
+    CLASSIFIER_MIN_SAMPLES: int = 3            # 分类参与质心比较所需的最少文档数
+    CLASSIFIER_TRAINING_LIMIT: int = 500       # 训练质心时读取的最近文档数
+    CLASSIFIER_RETRAIN_INTERVAL: int = 3600    # 重新训练质心的间隔(秒)
+    CLASSIFIER_AUDIT_RATE: float = 0.05        # 本地置信结果抽样交给LLM复核的比例
+    
+    # 文档信息提取配置(分类、摘要、标签一次调用完成)
+    ENRICH_SINGLE_CALL_TOKENS: int = 3000      # 不超过此token数的文档直接整体提取
+    ENRICH_CHUNK_TOKENS: int = 2000            # 长文档分块摘要(map)时每块的token数
+    ENRICH_MAP_CONCURRENCY: int = 4            # 单个文档并发摘要的分块数
+    ENRICH_CHUNK_SUMMARY_TOKENS: int = 200     # 每块摘要的长度上限
     
     # 文件存储配置
     UPLOAD_DIR: str = "./uploads"
@@ -72,6 +195,9 @@ class Settings(BaseSettings):
     CELERY_BROKER_URL: str = "redis://localhost:6379/1"
     CELERY_RESULT_BACKEND: str = "redis://localhost:6379/2"
     
+    # 监控配置
+    METRICS_ENABLED: bool = True  # 是否暴露 /metrics (Prometheus)
+    
     # 日志配置
     LOG_LEVEL: str = "INFO"
     LOG_FILE: str = "./logs/app.log"
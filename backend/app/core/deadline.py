@@ -0,0 +1,100 @@
+"""
+请求截止时间 - 从HTTP请求传递到下游调用的剩余时间预算
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from app.core.config import settings
+
+# 当前请求的截止时间(time.monotonic()),None 表示不限制
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceededError(Exception):
+    """请求的时间预算已用完"""
+
+
+def set_deadline(seconds: float):
+    """设置当前上下文的截止时间(已有更早的截止时间时保留),返回用于恢复的token"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    return _deadline.set(deadline)
+
+
+def clear_deadline():
+    """清除当前上下文的截止时间(后台任务不受发起请求的预算限制)"""
+    _deadline.set(None)
+
+
+def reset_deadline(token):
+    """恢复设置截止时间之前的状态"""
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """剩余时间(秒),未设置截止时间时返回 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def clamp(timeout: Optional[float] = None) -> Optional[float]:
+    """取 timeout 与剩余时间中较小者(不小于0),用于 asyncio.wait_for 等超时参数"""
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(0.0, left)
+    return left if timeout is None else min(timeout, left)
+
+
+def budget(timeout: Optional[float] = None) -> Optional[float]:
+    """
+    计算下游调用可用的超时时间: 取 timeout 与剩余时间中较小者
+
+    Raises:
+        DeadlineExceededError: 剩余时间已用完
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceededError("请求已超过截止时间")
+    return left if timeout is None else min(timeout, left)
+
+
+class DeadlineMiddleware:
+    """
+    为每个API请求设置截止时间
+
+    客户端可通过 X-Request-Timeout 头(秒)缩短预算,但不能超过 REQUEST_TIMEOUT。
+    使用纯ASGI中间件,流式响应的生成过程也在同一个上下文中执行。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        seconds = settings.REQUEST_TIMEOUT
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-timeout":
+                try:
+                    requested = float(value)
+                except ValueError:
+                    requested = 0
+                if requested > 0:
+                    seconds = min(seconds, requested)
+                break
+
+        token = set_deadline(seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_deadline(token)
@@ -0,0 +1,129 @@
+"""
+Prometheus 监控指标
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# 查询向量化微批处理
+EMBEDDING_QUEUE_DEPTH = Gauge(
+    "embedding_queue_depth",
+    "等待向量化的查询数量",
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "embedding_batch_size",
+    "每批合并向量化的查询数量",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBEDDING_QUEUE_WAIT_SECONDS = Histogram(
+    "embedding_queue_wait_seconds",
+    "查询在队列中等待向量化的时间",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+EMBEDDING_BATCH_SECONDS = Histogram(
+    "embedding_batch_seconds",
+    "单批查询向量化耗时",
+)
+EMBEDDING_REJECTED_TOTAL = Counter(
+    "embedding_rejected_total",
+    "因队列已满被拒绝的向量化请求数",
+)
+
+# 进程内缓存
+CACHE_REQUESTS_TOTAL = Counter(
+    "cache_requests_total",
+    "缓存读取次数",
+    ["cache", "result"],
+)
+CACHE_SIZE = Gauge(
+    "cache_size",
+    "缓存当前条目数",
+    ["cache"],
+)
+
+# LLM调用
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "流式聊天从收到请求到输出第一个token的时间",
+    buckets=(0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0),
+)
+CHAT_STAGE_SECONDS = Histogram(
+    "chat_stage_seconds",
+    "聊天流程各阶段耗时",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+SINGLEFLIGHT_REQUESTS_TOTAL = Counter(
+    "singleflight_requests_total",
+    "请求合并层的调用次数(leader: 发起上游请求, coalesced: 复用进行中的请求)",
+    ["group", "result"],
+)
+LLM_CONCURRENCY_LIMIT = Gauge(
+    "llm_concurrency_limit",
+    "当前LLM并发上限(AIMD自适应)",
+)
+LLM_IN_FLIGHT = Gauge(
+    "llm_in_flight",
+    "正在进行的LLM调用数",
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "等待LLM调用名额的请求数",
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "llm_queue_wait_seconds",
+    "请求排队等待LLM调用名额的时间",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+LLM_REJECTED_TOTAL = Counter(
+    "llm_rejected_total",
+    "因排队已满或等待超时被拒绝的LLM调用数",
+    ["reason"],
+)
+
+# 重试与对冲
+CALL_RETRIES_TOTAL = Counter(
+    "call_retries_total",
+    "下游调用的重试次数",
+    ["call"],
+)
+HEDGED_REQUESTS_TOTAL = Counter(
+    "hedged_requests_total",
+    "发起对冲请求的次数",
+    ["call"],
+)
+
+# LLM提供方路由
+LLM_PROVIDER_REQUESTS_TOTAL = Counter(
+    "llm_provider_requests_total",
+    "各LLM提供方的调用次数",
+    ["provider", "call_type", "result"],
+)
+LLM_PROVIDER_LATENCY_SECONDS = Histogram(
+    "llm_provider_latency_seconds",
+    "各LLM提供方成功调用的耗时",
+    ["provider"],
+    buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0),
+)
+LLM_FAILOVER_TOTAL = Counter(
+    "llm_failover_total",
+    "调用失败后切换到下一个提供方的次数",
+    ["call_type", "provider"],
+)
+
+# 文档分类
+DOC_CLASSIFICATIONS_TOTAL = Counter(
+    "doc_classifications_total",
+    "文档分类次数(按最终采用的来源)",
+    ["source"],
+)
+DOC_CLASSIFIER_AGREEMENT_TOTAL = Counter(
+    "doc_classifier_agreement_total",
+    "本地分类结果与LLM分类结果的比对次数",
+    ["source", "result"],
+)
+
+# WebSocket聊天
+CHAT_WS_CONNECTIONS = Gauge(
+    "chat_ws_connections",
+    "当前的WebSocket聊天连接数",
+)
@@ -0,0 +1,104 @@
+"""
+Qdrant 向量数据库连接管理
+"""
+from typing import Dict, Optional, Set
+
+import httpx
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.models import Distance, PayloadSchemaType, VectorParams
+from loguru import logger
+
+from app.core.config import settings
+
+# 进程级共享的客户端(内部复用 httpx 连接池)
+_client: Optional[AsyncQdrantClient] = None
+
+# 已确认存在的集合,避免每次写入都查询集合列表
+_known_collections: Set[str] = set()
+
+
+def get_qdrant_client() -> AsyncQdrantClient:
+    """获取共享的Qdrant客户端"""
+    global _client
+    if _client is None:
+        _client = AsyncQdrantClient(
+            url=settings.QDRANT_URL,
+            api_key=settings.QDRANT_API_KEY if settings.QDRANT_API_KEY else None,
+            timeout=settings.QDRANT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.QDRANT_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.QDRANT_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_qdrant_client():
+    """关闭共享的Qdrant客户端"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+    _known_collections.clear()
+
+
+async def ensure_collection(
+    collection_name: str,
+    payload_indexes: Optional[Dict[str, PayloadSchemaType]] = None
+) -> bool:
+    """
+    确保集合存在
+
+    仅在本地缓存未命中时访问服务端。
+
+    Args:
+        collection_name: 集合名称
+        payload_indexes: 需要建立索引的payload字段及其类型
+
+    Returns:
+        是否新建了集合
+    """
+    if collection_name in _known_collections:
+        return False
+
+    client = get_qdrant_client()
+    created = False
+    existing_indexes = set()
+    try:
+        info = await client.get_collection(collection_name)
+        existing_indexes = set((info.payload_schema or {}).keys())
+    except UnexpectedResponse as e:
+        if e.status_code != 404:
+            raise
+        try:
+            await client.create_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(
+                    size=settings.LOCAL_EMBEDDING_DIM,
+                    distance=Distance.COSINE
+                )
+            )
+            created = True
+            logger.info(f"创建向量集合: {collection_name}")
+        except UnexpectedResponse as e:
+            # 其他进程已并发创建
+            if e.status_code != 409:
+                raise
+
+    for field_name, field_schema in (payload_indexes or {}).items():
+        if field_name not in existing_indexes:
+            await client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+            )
+            logger.info(f"创建payload索引: {collection_name}.{field_name}")
+
+    _known_collections.add(collection_name)
+    return created
+
+
+def forget_collection(collection_name: str):
+    """从本地缓存中移除集合(集合被删除后调用)"""
+    _known_collections.discard(collection_name)
@@ -0,0 +1,35 @@
+"""
+Redis 连接管理
+"""
+from typing import Optional
+
+import redis.asyncio as redis
+from loguru import logger
+
+from app.core.config import settings
+
+# 进程级共享的客户端(内部维护连接池)
+_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    """获取共享的Redis客户端"""
+    global _client
+    if _client is None:
+        _client = redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=settings.REDIS_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_TIMEOUT,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+        )
+        logger.info(f"创建Redis客户端: max_connections={settings.REDIS_MAX_CONNECTIONS}")
+    return _client
+
+
+async def close_redis():
+    """关闭共享的Redis客户端"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -1,15 +1,22 @@
 """
 物业管理AI应用 - FastAPI 主应用入口
 """
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from app.api import auth, properties, documents, chat, payments, admin
 from app.core.config import settings
+from app.core.deadline import DeadlineMiddleware
 from app.db.database import init_db
+from app.db.qdrant import close_qdrant_client, get_qdrant_client
+from app.db.redis import close_redis, get_redis
+from app.services.embedding import embedding_batcher, encoder_registry
+from app.services.llm_client import close_llm_client, get_llm_client
 
 
 @asynccontextmanager
@@ -20,10 +27,24 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("✅ 数据库初始化完成")
     
+    if settings.EMBEDDING_WARMUP_ON_STARTUP:
+        # 在线程中加载模型,避免阻塞事件循环
+        await asyncio.to_thread(encoder_registry.warmup)
+        logger.info("✅ 向量化模型预热完成")
+    await embedding_batcher.start()
+    if settings.VECTOR_BACKEND == "qdrant":
+        get_qdrant_client()
+    get_llm_client()
+    get_redis()
+    
     yield
     
     # 关闭时执行
     logger.info("👋 关闭应用...")
+    await embedding_batcher.stop()
+    await close_qdrant_client()
+    await close_llm_client()
+    await close_redis()
 
 
 app = FastAPI(
@@ -44,6 +65,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求截止时间(传递给LLM、检索等下游调用)
+app.add_middleware(DeadlineMiddleware)
+
 
 # 健康检查
 @app.get("/health")
@@ -58,6 +82,14 @@ async def health_check():
     )
 
 
+# 监控指标
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus 指标"""
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # 注册路由
 app.include_router(auth.router, prefix="/api/auth", tags=["认证"])
 app.include_router(properties.router, prefix="/api/properties", tags=["物业项目"])
@@ -32,6 +32,7 @@ class Document(Base):
     # 文档基本信息
     title = Column(String(500), nullable=False)
     category = Column(SQLEnum(DocumentCategory), default=DocumentCategory.OTHER)
+    category_source = Column(String(20))  # 分类来源: user / llm / rules / centroid,只用 user 和 llm 训练本地分类器
     
     # 文件信息
     file_name = Column(String(500))
@@ -49,7 +50,7 @@ class Document(Base):
     
     # 标签和元数据
     tags = Column(JSON, default=[])
-    metadata = Column(JSON, default={})
+    doc_metadata = Column("metadata", JSON, default={})  # "metadata" 是声明式模型的保留属性名,列名不变
     
     # 上传者信息
     uploaded_by = Column(Integer)  # 用户ID
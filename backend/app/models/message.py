@@ -3,7 +3,7 @@
 """
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Column, Integer, String, Text, DateTime, Enum as SQLEnum, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Enum as SQLEnum, JSON, Index
 
 from app.db.database import Base
 
@@ -25,9 +25,13 @@ class ConversationStatus(str, Enum):
 class Conversation(Base):
     """对话会话表"""
     __tablename__ = "conversations"
+    __table_args__ = (
+        # 会话列表: 按用户筛选、按最后消息时间倒序分页
+        Index("ix_conversations_user_last_message", "user_id", "last_message_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
     property_id = Column(Integer, nullable=False, index=True)
     
     # 会话信息
@@ -37,6 +41,10 @@ class Conversation(Base):
     # 统计信息
     message_count = Column(Integer, default=0)
     
+    # 滚动摘要(较早的对话折叠为摘要,不再逐条发送给LLM)
+    summary = Column(Text)
+    summary_message_id = Column(Integer, default=0)  # 已折叠进摘要的最后一条消息ID
+    
     # 时间戳
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -49,9 +57,13 @@ class Conversation(Base):
 class Message(Base):
     """消息表"""
     __tablename__ = "messages"
+    __table_args__ = (
+        # 会话消息和对话历史: 按会话筛选、按时间排序分页
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(Integer, nullable=False, index=True)
+    conversation_id = Column(Integer, nullable=False)
     
     # 消息内容
     role = Column(SQLEnum(MessageRole), nullable=False)
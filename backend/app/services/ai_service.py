@@ -1,30 +1,187 @@
 """
 AI服务模块 - 集成LLM和RAG
 """
-from typing import List, Dict, Optional
+import asyncio
+import json
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, List, Dict, Hashable, Optional, Set, Tuple
+import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from openai import AsyncOpenAI
+from sqlalchemy import func, select, update
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from loguru import logger
 
 from app.core.config import settings
-from app.models.message import Message, MessageRole
-from app.services.vector_store import VectorStoreService
+from app.core.deadline import clamp, clear_deadline
+from app.core.metrics import (
+    CHAT_STAGE_SECONDS,
+    DOC_CLASSIFICATIONS_TOTAL,
+    DOC_CLASSIFIER_AGREEMENT_TOTAL,
+    LLM_TIME_TO_FIRST_TOKEN_SECONDS,
+)
+from app.db.database import AsyncSessionLocal
+from app.models.message import Conversation, Message, MessageRole
+from app.services import doc_classifier
+from app.services.answer_cache import get_answer_cache
+from app.services.history_buffer import recent_messages
+from app.services.llm_limiter import LLMOverloadedError, llm_limiter
+from app.services.llm_providers import Completion, llm_router
+from app.services.prompt_builder import PromptBuilder, count_tokens, truncate_to_tokens
+from app.services.singleflight import SingleFlight, make_key
+from app.services.vector_store import VectorStoreService, get_generation
+
+# LLM调用失败时的兜底回复
+FALLBACK_REPLY = "抱歉,我现在遇到了一些问题。请稍后再试。"
+
+# LLM调用排队已满时的回复
+BUSY_REPLY = "当前咨询人数较多,请稍后再试。"
+
+# 相同的并发LLM请求只调用一次上游
+_llm_flight = SingleFlight("llm")
+
+# 正在更新摘要的会话,避免同一会话并发折叠
+_summarizing: Set[int] = set()
+
+# 后台摘要任务(持有引用,防止任务被回收)
+_summary_tasks: Set[asyncio.Task] = set()
+
+# 后台分类复核任务
+_classify_audit_tasks: Set[asyncio.Task] = set()
+
+# 文档分类(代码 -> 名称)
+DOCUMENT_CATEGORIES = {
+    "regulation": "物业规章制度",
+    "notice": "通知公告",
+    "maintenance": "维修记录",
+    "meeting": "会议记录",
+    "contract": "合同协议",
+    "financial": "财务报表",
+    "complaint": "投诉记录",
+    "facility": "设施设备",
+    "safety": "安全管理",
+    "other": "其他"
+}
+
+
+@dataclass
+class HistoryWindow:
+    """保存在 AIService 实例中的对话历史(摘要 + 未折叠的最近消息)"""
+    conversation_id: int
+    summary: Optional[str]
+    summarized_until: int
+    history: List[Dict]
+    truncated: bool = False   # 窗口之前还有未折叠进摘要的消息
+
+
+@dataclass
+class DocumentEnrichment:
+    """文档信息提取结果"""
+    category: str
+    category_source: Optional[str]   # user / llm / rules / centroid;LLM不可用时的兜底为 None
+    summary: str
+    tags: List[str]
+
+
+def _parse_json_object(text: str) -> Optional[Dict]:
+    """从LLM回复中解析JSON对象(容忍代码块和前后说明文字)"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        result = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return result if isinstance(result, dict) else None
+
+
+@contextmanager
+def stage_timer(stage: str, timings: Dict[str, float]):
+    """记录聊天流程某一阶段的耗时(毫秒写入timings,秒写入指标)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        CHAT_STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        timings[stage] = round(elapsed * 1000, 1)
+
+
+async def _run_stage(
+    stage: str,
+    awaitable: Awaitable,
+    timeout: float,
+    fallback: Any,
+    timings: Dict[str, float],
+) -> Any:
+    """执行可降级的阶段: 超时(含请求截止时间)或出错时返回fallback,不影响整体回复"""
+    with stage_timer(stage, timings):
+        try:
+            return await asyncio.wait_for(awaitable, clamp(timeout))
+        except asyncio.TimeoutError:
+            logger.warning(f"聊天阶段超时,降级处理: {stage}")
+        except Exception as e:
+            logger.error(f"聊天阶段出错,降级处理: {stage}, {str(e)}")
+        return fallback
 
 
 class AIService:
     """AI服务类"""
     
-    def __init__(self, db: AsyncSession, property_id: int):
+    def __init__(self, db: Optional[AsyncSession], property_id: int, keep_history: bool = False):
+        """
+        Args:
+            db: 请求的数据库会话;历史读取和消息保存使用独立会话,长连接中传 None
+            keep_history: 在实例中保存对话历史窗口(长连接复用同一实例时使用,
+                后续轮次不再读取历史,新消息通过 remember_turn 追加)
+        """
         self.db = db
         self.property_id = property_id
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
         self.vector_store = VectorStoreService(property_id)
+        self.prompt_builder = PromptBuilder()
+        self.keep_history = keep_history
+        self._history_window: Optional[HistoryWindow] = None
+    
+    def remember_turn(self, conversation_id: int, messages: List[Message], new_conversation: bool = False):
+        """
+        把已保存的消息追加到历史窗口
+        
+        Args:
+            new_conversation: 会话是新建的(这些消息就是全部历史)
+        """
+        if not self.keep_history:
+            return
+        window = self._history_window
+        if window is None or window.conversation_id != conversation_id:
+            if not new_conversation:
+                return
+            window = self._history_window = HistoryWindow(conversation_id, None, 0, [])
+        window.history.extend(
+            {"id": msg.id, "role": msg.role.value, "content": msg.content}
+            for msg in messages if msg.role in [MessageRole.USER, MessageRole.ASSISTANT]
+        )
+        if len(window.history) > settings.HISTORY_FETCH_LIMIT:
+            # 移出窗口的消息尚未摘要,下一轮由 _build_messages 折叠
+            del window.history[:-settings.HISTORY_FETCH_LIMIT]
+            window.truncated = True
+    
+    async def _load_history(self, conversation_id: int) -> Tuple[Optional[str], int, List[Dict], bool]:
+        """读取历史(优先使用实例中的历史窗口)"""
+        window = self._history_window
+        if window is not None and window.conversation_id == conversation_id:
+            return window.summary, window.summarized_until, list(window.history), window.truncated
+        summary, summarized_until, history, truncated = await self._get_conversation_history(conversation_id)
+        if self.keep_history:
+            self._history_window = HistoryWindow(
+                conversation_id, summary, summarized_until, list(history), truncated
+            )
+        return summary, summarized_until, history, truncated
     
     async def chat(
         self,
-        conversation_id: int,
+        conversation_id: Optional[int],
         user_message: str,
         use_rag: bool = True
     ) -> Dict:
@@ -32,108 +189,448 @@ class AIService:
         处理聊天消息
         
         Args:
-            conversation_id: 会话ID
-            user_message: 用户消息
+            conversation_id: 会话ID(新会话为 None)
+            user_message: 用户消息(尚未保存,不会出现在读取的历史中)
             use_rag: 是否使用RAG检索
         
         Returns:
-            包含回复内容和元数据的字典
+            包含回复内容和元数据的字典(timings为各阶段耗时,毫秒)
+        
+        Raises:
+            LLMOverloadedError: LLM调用排队已满或等待超时
         """
+        timings: Dict[str, float] = {}
         try:
-            # 获取历史消息
-            history = await self._get_conversation_history(conversation_id, limit=10)
-            
-            # 构建消息列表
-            messages = [
-                {
-                    "role": "system",
-                    "content": self._get_system_prompt()
-                }
-            ]
-            
-            # 如果启用RAG,检索相关文档
-            sources = []
-            if use_rag:
-                retrieved_docs = await self.vector_store.search(
-                    query=user_message,
-                    limit=3
-                )
-                
-                if retrieved_docs:
-                    context = self._format_context(retrieved_docs)
-                    messages.append({
-                        "role": "system",
-                        "content": f"以下是相关的物业文档信息:\n\n{context}\n\n请基于这些信息回答用户的问题。"
-                    })
-                    sources = [
-                        {
-                            "document_id": doc["id"],
-                            "title": doc["title"],
-                            "score": doc["score"]
-                        }
-                        for doc in retrieved_docs
-                    ]
-            
-            # 添加历史消息
-            messages.extend(history)
+            generation = await get_generation(self.property_id)
+            messages, sources, first_turn = await self._build_messages(
+                conversation_id, user_message, use_rag, timings
+            )
             
-            # 添加当前用户消息
-            messages.append({
-                "role": "user",
-                "content": user_message
-            })
+            # 首轮提问先查语义答案缓存
+            query_vector = None
+            if use_rag and first_turn and settings.ANSWER_CACHE_ENABLED:
+                cached, query_vector = await self._lookup_answer(user_message, sources, generation, timings)
+                if cached:
+                    return {
+                        "content": cached["content"],
+                        "model": cached["model"],
+                        "tokens": 0,
+                        "sources": sources,
+                        "timings": timings,
+                    }
             
             # 调用LLM
-            response = await self.client.chat.completions.create(
-                model=settings.DEFAULT_AI_MODEL,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2000,
-            )
+            with stage_timer("llm", timings):
+                completion = await self._complete(
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=2000,
+                )
             
-            assistant_message = response.choices[0].message.content
-            tokens_used = response.usage.total_tokens
+            await self._store_answer(query_vector, generation, completion.content, completion.model, sources)
             
             return {
-                "content": assistant_message,
-                "model": settings.DEFAULT_AI_MODEL,
-                "tokens": tokens_used,
+                "content": completion.content,
+                "model": completion.model,
+                "tokens": completion.total_tokens,
                 "sources": sources,
+                "timings": timings,
             }
         
+        except LLMOverloadedError:
+            raise
+        
         except Exception as e:
             logger.error(f"AI聊天错误: {str(e)}")
             return {
-                "content": "抱歉,我现在遇到了一些问题。请稍后再试。",
+                "content": FALLBACK_REPLY,
                 "model": settings.DEFAULT_AI_MODEL,
                 "tokens": 0,
                 "sources": [],
+                "timings": timings,
+            }
+    
+    async def chat_stream(
+        self,
+        conversation_id: Optional[int],
+        user_message: str,
+        use_rag: bool = True
+    ) -> AsyncIterator[Dict]:
+        """
+        流式处理聊天消息
+        
+        依次产出事件:
+        - {"type": "sources", "sources": [...]}  检索到的文档(在第一个token之前)
+        - {"type": "token", "content": "..."}    增量内容
+        - {"type": "done", "content": 完整回复, "model": ..., "tokens": ..., "timings": {...}}
+        出错时产出 {"type": "error", "content": 兜底回复} 后结束;排队已满时产出
+        {"type": "error", "content": BUSY_REPLY, "busy": True},调用方不应保存这一轮对话。
+        """
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        try:
+            generation = await get_generation(self.property_id)
+            messages, sources, first_turn = await self._build_messages(
+                conversation_id, user_message, use_rag, timings
+            )
+            yield {"type": "sources", "sources": sources}
+            
+            # 首轮提问先查语义答案缓存,命中时一次性输出
+            query_vector = None
+            if use_rag and first_turn and settings.ANSWER_CACHE_ENABLED:
+                cached, query_vector = await self._lookup_answer(user_message, sources, generation, timings)
+                if cached:
+                    LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                    yield {"type": "token", "content": cached["content"]}
+                    yield {
+                        "type": "done",
+                        "content": cached["content"],
+                        "model": cached["model"],
+                        "tokens": 0,
+                        "timings": timings,
+                    }
+                    return
+            
+            parts = []
+            with stage_timer("llm", timings):
+                # 流式回复期间一直占用调用名额
+                async with llm_limiter.slot(self.property_id, latency_signal=False):
+                    model, deltas = await llm_router.open_stream(
+                        "chat",
+                        messages,
+                        temperature=0.7,
+                        max_tokens=2000,
+                    )
+                    async for delta in deltas:
+                        if not parts:
+                            LLM_TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                        parts.append(delta)
+                        yield {"type": "token", "content": delta}
+            
+            content = "".join(parts)
+            await self._store_answer(query_vector, generation, content, model, sources)
+            
+            yield {
+                "type": "done",
+                "content": content,
+                "model": model,
+                # 流式响应不返回用量,按回复内容计算
+                "tokens": count_tokens(content),
+                "timings": timings,
+            }
+        
+        except LLMOverloadedError as e:
+            logger.warning(f"AI流式聊天被限流: {str(e)}")
+            yield {"type": "error", "content": BUSY_REPLY, "busy": True}
+        
+        except Exception as e:
+            logger.error(f"AI流式聊天错误: {str(e)}")
+            yield {"type": "error", "content": FALLBACK_REPLY}
+    
+    async def _lookup_answer(
+        self,
+        user_message: str,
+        sources: List[Dict],
+        generation: Hashable,
+        timings: Dict[str, float]
+    ) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+        """
+        查询语义答案缓存(只匹配当前数据版本下写入的回复)
+        
+        Returns:
+            (命中的回复或None, 问题向量(供未命中时写入缓存))
+        """
+        with stage_timer("answer_cache", timings):
+            try:
+                vector = await self.vector_store.encode_query(user_message)
+            except Exception as e:
+                logger.warning(f"答案缓存查询失败: {str(e)}")
+                return None, None
+            cached = get_answer_cache(self.property_id).lookup(
+                vector, [source["document_id"] for source in sources], generation
+            )
+            return cached, vector
+    
+    async def _store_answer(
+        self,
+        query_vector: Optional[np.ndarray],
+        generation: Hashable,
+        content: str,
+        model: str,
+        sources: List[Dict]
+    ):
+        """写入语义答案缓存(生成期间文档有变化时不写入,避免缓存过期回复)"""
+        if query_vector is None or not content:
+            return
+        if await get_generation(self.property_id) != generation:
+            return
+        get_answer_cache(self.property_id).store(
+            query_vector, content, model, sources, generation
+        )
+    
+    async def _complete(
+        self,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+        call_type: str = "chat"
+    ) -> Completion:
+        """
+        调用LLM(非流式)
+        
+        按调用类型路由到配置的提供方和模型(见 LLMRouter),失败时自动切换提供方。
+        调用类型、消息和参数都相同的并发请求合并为一次上游调用,共享同一个结果。
+        
+        Raises:
+            LLMOverloadedError: LLM调用排队已满或等待超时
+        """
+        params = {
+            "call_type": call_type,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        return await _llm_flight.do(
+            make_key(**params),
+            lambda: llm_router.complete(**params, fairness_key=self.property_id)
+        )
+    
+    async def _build_messages(
+        self,
+        conversation_id: Optional[int],
+        user_message: str,
+        use_rag: bool = True,
+        timings: Optional[Dict[str, float]] = None
+    ) -> Tuple[List[Dict], List[Dict], bool]:
+        """
+        构建发送给LLM的消息列表
+        
+        读取历史和文档检索互不依赖,并发执行,各自超时后降级(无历史/无上下文)。
+        系统提示、摘要、检索上下文和历史按token预算组装,放不下的较早历史
+        在后台折叠进会话摘要。
+        
+        Args:
+            timings: 用于记录各阶段耗时(毫秒)
+        
+        Returns:
+            (消息列表, 引用的文档来源, 是否为会话首轮提问)
+        """
+        timings = {} if timings is None else timings
+        
+        async def no_history():
+            return None, 0, [], False
+        
+        async def no_documents():
+            return []
+        
+        # 获取历史消息和摘要 / 如果启用RAG,检索相关文档
+        (summary, summarized_until, history, truncated), retrieved_docs = await asyncio.gather(
+            _run_stage(
+                "history",
+                self._load_history(conversation_id) if conversation_id else no_history(),
+                settings.CHAT_HISTORY_TIMEOUT,
+                (None, 0, None, False),
+                timings,
+            ),
+            _run_stage(
+                "retrieval",
+                self.vector_store.search(query=user_message, limit=3) if use_rag else no_documents(),
+                settings.CHAT_RETRIEVAL_TIMEOUT,
+                [],
+                timings,
+            ),
+        )
+        
+        with stage_timer("prompt", timings):
+            messages, used_docs, overflow = self.prompt_builder.build(
+                system_prompt=self._get_system_prompt(),
+                user_message=user_message,
+                documents=retrieved_docs,
+                history=history or [],
+                summary=summary,
+            )
+        
+        # 超出预算的较早历史,以及读取窗口之前的消息,都折叠进摘要(不丢弃)
+        if overflow:
+            fold_until = overflow[-1]["id"]
+        elif truncated:
+            fold_until = history[0]["id"] - 1
+        else:
+            fold_until = None
+        if fold_until is not None:
+            self._schedule_summary(conversation_id, summary, summarized_until, fold_until)
+            # 摘要更新后历史窗口过期,下一轮重新读取
+            self._history_window = None
+        
+        sources = [
+            {
+                "document_id": doc["id"],
+                "title": doc["title"],
+                "score": doc["score"]
             }
+            for doc in used_docs
+        ]
+        
+        # 没有摘要也没有AI回复过,回答只取决于问题和检索到的文档(历史读取失败时不视为首轮)
+        first_turn = (
+            history is not None
+            and not summary
+            and not any(turn["role"] == "assistant" for turn in history)
+        )
+        
+        return messages, sources, first_turn
     
     async def _get_conversation_history(
         self,
         conversation_id: int,
-        limit: int = 10
-    ) -> List[Dict]:
-        """获取对话历史"""
-        result = await self.db.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation_id)
-            .order_by(Message.created_at.desc())
-            .limit(limit)
-        )
-        messages = result.scalars().all()
+        limit: Optional[int] = None
+    ) -> Tuple[Optional[str], int, List[Dict], bool]:
+        """
+        获取对话摘要和尚未折叠进摘要的最近 limit 条历史
+        
+        多读一条,用于判断更早的消息中是否还有未摘要的。
         
-        # 转换为API格式(注意要反转顺序)
+        Returns:
+            (摘要, 已摘要到的消息ID, 历史消息列表(按时间升序,含消息ID), 之前是否还有未摘要的消息)
+        """
+        limit = limit or settings.HISTORY_FETCH_LIMIT
+        fetch = limit + 1
+        
+        # 使用独立会话: 超时被取消时不会影响请求级会话的后续写入
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Conversation.summary, Conversation.summary_message_id)
+                .where(Conversation.id == conversation_id)
+            )
+            row = result.first()
+            summary, summarized_until = (row[0], row[1] or 0) if row else (None, 0)
+            
+            if recent_messages.enabled:
+                history = await recent_messages.read(conversation_id, summarized_until, fetch)
+                if history is not None:
+                    return summary, summarized_until, history[-limit:], len(history) > limit
+                # 未命中: 读取最近 HISTORY_BUFFER_SIZE 条(不按摘要过滤)重建缓存
+                query = select(Message).where(Message.conversation_id == conversation_id)
+                fetch_limit = max(fetch, settings.HISTORY_BUFFER_SIZE)
+            else:
+                query = select(Message).where(
+                    Message.conversation_id == conversation_id,
+                    Message.id > summarized_until
+                )
+                fetch_limit = fetch
+            
+            result = await session.execute(
+                query.order_by(Message.created_at.desc()).limit(fetch_limit)
+            )
+            messages = list(reversed(result.scalars().all()))
+        
+        if recent_messages.enabled:
+            await recent_messages.rebuild(conversation_id, messages)
+        
+        # 转换为API格式(按时间升序)
         history = []
-        for msg in reversed(messages):
-            if msg.role in [MessageRole.USER, MessageRole.ASSISTANT]:
+        for msg in messages:
+            if msg.id > summarized_until and msg.role in [MessageRole.USER, MessageRole.ASSISTANT]:
                 history.append({
+                    "id": msg.id,
                     "role": msg.role.value,
                     "content": msg.content
                 })
         
-        return history
+        return summary, summarized_until, history[-limit:], len(history) > limit
+    
+    def _schedule_summary(
+        self,
+        conversation_id: int,
+        summary: Optional[str],
+        summarized_until: int,
+        fold_until: int
+    ):
+        """在后台把消息ID不超过 fold_until 的未摘要历史折叠进摘要,不阻塞本次回复"""
+        if conversation_id in _summarizing:
+            return
+        _summarizing.add(conversation_id)
+        task = asyncio.create_task(
+            self._fold_history(conversation_id, summary, summarized_until, fold_until)
+        )
+        _summary_tasks.add(task)
+        task.add_done_callback(_summary_tasks.discard)
+    
+    async def _fold_history(
+        self,
+        conversation_id: int,
+        summary: Optional[str],
+        summarized_until: int,
+        fold_until: int
+    ):
+        """
+        增量更新会话摘要: 旧摘要 + 新折叠的轮次 -> 新摘要
+        
+        每次最多折叠 HISTORY_FOLD_BATCH 条(从最早的开始),剩余的在之后的轮次继续折叠。
+        """
+        # 后台任务继承了请求的上下文,不应受该请求截止时间的限制
+        clear_deadline()
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Message.id, Message.role, Message.content)
+                    .where(
+                        Message.conversation_id == conversation_id,
+                        Message.id > summarized_until,
+                        Message.id <= fold_until,
+                        Message.role.in_([MessageRole.USER, MessageRole.ASSISTANT]),
+                    )
+                    .order_by(Message.id)
+                    .limit(settings.HISTORY_FOLD_BATCH)
+                )
+                turns = [
+                    {"id": row.id, "role": row.role.value, "content": row.content}
+                    for row in result.all()
+                ]
+            if not turns:
+                return
+            
+            lines = "\n".join(
+                f"{'业主' if turn['role'] == 'user' else '小管家'}: {turn['content']}"
+                for turn in turns
+            )
+            response = await self._complete(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "你是一个对话摘要助手。请把已有摘要和新的对话内容合并为一份简洁的摘要,"
+                                   "保留业主身份、房号、诉求、已给出的答复和待办事项。"
+                    },
+                    {
+                        "role": "user",
+                        "content": f"已有摘要:\n{summary or '无'}\n\n新的对话:\n{lines}"
+                    }
+                ],
+                temperature=0.3,
+                max_tokens=settings.HISTORY_SUMMARY_MAX_TOKENS,
+                call_type="summary",
+            )
+            new_summary = response.content
+            if not new_summary:
+                return
+            
+            # 仅当摘要未被其他进程更新时写入
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(Conversation)
+                    .where(
+                        Conversation.id == conversation_id,
+                        func.coalesce(Conversation.summary_message_id, 0) == summarized_until
+                    )
+                    .values(summary=new_summary, summary_message_id=turns[-1]["id"])
+                )
+                await session.commit()
+        
+        except Exception as e:
+            logger.error(f"更新对话摘要错误: {str(e)}")
+        
+        finally:
+            _summarizing.discard(conversation_id)
     
     def _get_system_prompt(self) -> str:
         """获取系统提示词"""
@@ -151,21 +648,54 @@ class AIService:
 - 对于需要人工处理的事务,主动引导用户联系物业
 """
     
-    def _format_context(self, documents: List[Dict]) -> str:
-        """格式化检索到的文档上下文"""
-        context_parts = []
-        for i, doc in enumerate(documents, 1):
-            context_parts.append(
-                f"文档{i}: {doc['title']}\n"
-                f"内容: {doc['content']}\n"
-            )
-        return "\n".join(context_parts)
-    
+    async def enrich_document(
+        self,
+        title: str,
+        content: str,
+        category: Optional[str] = None
+    ) -> DocumentEnrichment:
+        """
+        提取文档的分类、摘要和标签
+
+        分类先走本地分类器,不置信时与摘要、标签在同一次LLM调用中返回(JSON)。
+        长文档先分块并发摘要(map),再对分块摘要做一次提取(reduce)。
+
+        Args:
+            category: 已指定的分类(此时不再分类)
+        """
+        prediction = None
+        source = "user" if category else None
+        if category is None and settings.CLASSIFIER_LOCAL_ENABLED:
+            prediction = await doc_classifier.classify_locally(self.property_id, title, content)
+            if prediction.confident:
+                category = self._accept_local_category(title, content, prediction)
+                source = prediction.source
+
+        text = await self._condense(content)
+        need_category = category is None
+        result = await self._extract(title, text, need_category)
+
+        if need_category:
+            llm_category = str(result.get("category") or "").strip().lower() if result else ""
+            if llm_category in DOCUMENT_CATEGORIES:
+                category = self._record_llm_category(llm_category, prediction)
+                source = "llm"
+            else:
+                category = (prediction.category if prediction else None) or "other"
+
+        tags = result.get("tags") if result else None
+        return DocumentEnrichment(
+            category=category,
+            category_source=source,
+            summary=str(result.get("summary") or "") if result else "",
+            tags=[str(tag) for tag in tags][:10] if isinstance(tags, list) else [],
+        )
+
     async def generate_summary(self, text: str) -> str:
-        """生成文本摘要"""
+        """生成文本摘要(长文本先分块摘要再合并)"""
+        text = await self._condense(text)
         try:
-            response = await self.client.chat.completions.create(
-                model=settings.DEFAULT_AI_MODEL,
+            response = await self._complete(
                 messages=[
                     {
                         "role": "system",
@@ -173,39 +703,184 @@ class AIService:
                     },
                     {
                         "role": "user",
-                        "content": text[:4000]  # 限制长度
+                        "content": text
                     }
                 ],
                 temperature=0.5,
                 max_tokens=300,
+                call_type="summary",
             )
             
-            return response.choices[0].message.content
+            return response.content
         
         except Exception as e:
             logger.error(f"生成摘要错误: {str(e)}")
             return ""
+
+    async def _extract(self, title: str, text: str, need_category: bool) -> Optional[Dict]:
+        """一次调用提取摘要、标签(以及分类),失败时返回 None"""
+        fields = '"summary": "摘要(200字以内,突出关键信息)", "tags": ["关键词", ...]'
+        instructions = "tags 为3-5个关键词。"
+        if need_category:
+            fields = '"category": "分类代码", ' + fields
+            categories_str = "\n".join(f"{k}: {v}" for k, v in DOCUMENT_CATEGORIES.items())
+            instructions = f"category 从以下分类中选择,只填英文代码:\n{categories_str}\n" + instructions
+
+        try:
+            response = await self._complete(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "你是一个物业文档处理助手。请阅读文档,只返回一个JSON对象,不要输出其他内容:\n"
+                            f"{{{fields}}}\n\n{instructions}"
+                        )
+                    },
+                    {
+                        "role": "user",
+                        "content": f"标题: {title}\n内容: {text}"
+                    }
+                ],
+                temperature=0.3,
+                max_tokens=500,
+                call_type="summary",
+            )
+        except Exception as e:
+            logger.error(f"提取文档信息错误: {str(e)}")
+            return None
+
+        result = _parse_json_object(response.content)
+        if result is None:
+            logger.warning(f"文档信息提取结果不是JSON,仅作为摘要使用: title={title!r}")
+            return {"summary": response.content.strip()}
+        return result
+
+    async def _condense(self, text: str) -> str:
+        """
+        压缩长文本(map-reduce)
+
+        不超过 ENRICH_SINGLE_CALL_TOKENS 时原样返回;否则按 ENRICH_CHUNK_TOKENS 分块,
+        在 ENRICH_MAP_CONCURRENCY 的并发上限内分别摘要,按原文顺序拼接。
+        拼接结果仍超出时对分块摘要再压缩一层,每一块都参与摘要,不截断。
+        每块摘要不超过 ENRICH_CHUNK_SUMMARY_TOKENS,每一层约缩小为原来的1/10,层数随文档长度对数增长。
+        """
+        if count_tokens(text) <= settings.ENRICH_SINGLE_CALL_TOKENS:
+            return text
+
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.ENRICH_CHUNK_TOKENS,
+            chunk_overlap=0,
+            length_function=count_tokens,
+            separators=["\n\n", "\n", "。", ";", " ", ""],
+        )
+        chunks = splitter.split_text(text)
+        semaphore = asyncio.Semaphore(settings.ENRICH_MAP_CONCURRENCY)
+
+        async def summarize(index: int, chunk: str) -> str:
+            async with semaphore:
+                try:
+                    response = await self._complete(
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": f"以下是一份长文档的第{index + 1}/{len(chunks)}部分。请概括这部分的关键信息(条款、金额、日期、责任方等),不要遗漏要点。"
+                            },
+                            {"role": "user", "content": chunk}
+                        ],
+                        temperature=0.3,
+                        max_tokens=settings.ENRICH_CHUNK_SUMMARY_TOKENS,
+                        call_type="summary",
+                    )
+                    summary = response.content.strip()
+                except Exception as e:
+                    logger.warning(f"分块摘要失败,使用第{index + 1}块开头代替: {str(e)}")
+                    summary = ""
+                # 失败或超长时用截断内容代替,保证每块都有贡献且每层都在缩小
+                return truncate_to_tokens(summary or chunk, settings.ENRICH_CHUNK_SUMMARY_TOKENS)
+
+        parts = await asyncio.gather(*(summarize(i, chunk) for i, chunk in enumerate(chunks)))
+        return await self._condense("\n".join(parts))
     
-    async def classify_document(self, title: str, content: str) -> str:
-        """智能分类文档"""
-        categories = {
-            "regulation": "物业规章制度",
-            "notice": "通知公告",
-            "maintenance": "维修记录",
-            "meeting": "会议记录",
-            "contract": "合同协议",
-            "financial": "财务报表",
-            "complaint": "投诉记录",
-            "facility": "设施设备",
-            "safety": "安全管理",
-            "other": "其他"
-        }
-        
-        categories_str = "\n".join([f"{k}: {v}" for k, v in categories.items()])
+    async def classify_document(self, title: str, content: str) -> Tuple[str, Optional[str]]:
+        """
+        智能分类文档
+
+        先用本地分类(关键词规则、向量质心),置信时直接采用并按比例抽样交给LLM复核;
+        不置信时调用LLM,并把结果加入本地质心。
+
+        Returns:
+            (分类, 分类来源),来源为 llm / rules / centroid,LLM不可用时的兜底为 None
+        """
+        if not settings.CLASSIFIER_LOCAL_ENABLED:
+            category = await self._classify_with_llm(title, content)
+            DOC_CLASSIFICATIONS_TOTAL.labels(source="llm").inc()
+            return (category, "llm") if category else ("other", None)
+
+        prediction = await doc_classifier.classify_locally(self.property_id, title, content)
+        if prediction.confident:
+            return self._accept_local_category(title, content, prediction), prediction.source
+
+        category = await self._classify_with_llm(title, content)
+        if category is None:
+            # LLM不可用时退回本地的最佳猜测
+            return prediction.category or "other", None
+        return self._record_llm_category(category, prediction), "llm"
+
+    def _accept_local_category(
+        self, title: str, content: str, prediction: doc_classifier.LocalPrediction
+    ) -> str:
+        """
+        采用本地置信的分类,并按比例抽样交给LLM复核
+
+        本地结果不加入质心(否则会强化自身的错误),只有LLM给出的分类才用于学习。
+        """
+        DOC_CLASSIFICATIONS_TOTAL.labels(source=prediction.source).inc()
+        if random.random() < settings.CLASSIFIER_AUDIT_RATE:
+            task = asyncio.create_task(self._audit_classification(title, content, prediction))
+            _classify_audit_tasks.add(task)
+            task.add_done_callback(_classify_audit_tasks.discard)
+        return prediction.category
+
+    def _record_llm_category(
+        self, category: str, prediction: Optional[doc_classifier.LocalPrediction]
+    ) -> str:
+        """记录LLM给出的分类: 统计与本地猜测的一致率,并加入本地质心"""
+        DOC_CLASSIFICATIONS_TOTAL.labels(source="llm").inc()
+        if prediction is None:
+            return category
+        if prediction.category:
+            DOC_CLASSIFIER_AGREEMENT_TOTAL.labels(
+                source="low_confidence",
+                result="agree" if prediction.category == category else "disagree",
+            ).inc()
+        doc_classifier.learn(self.property_id, category, prediction.vector)
+        return category
+
+    async def _audit_classification(
+        self, title: str, content: str, prediction: doc_classifier.LocalPrediction
+    ):
+        """后台用LLM复核本地置信的分类结果,只记录一致率"""
+        # 复核不受原请求截止时间约束
+        clear_deadline()
+        category = await self._classify_with_llm(title, content)
+        if category is None:
+            return
+        agree = category == prediction.category
+        DOC_CLASSIFIER_AGREEMENT_TOTAL.labels(
+            source=prediction.source, result="agree" if agree else "disagree"
+        ).inc()
+        doc_classifier.learn(self.property_id, category, prediction.vector)
+        if not agree:
+            logger.info(
+                f"本地分类与LLM不一致: title={title!r}, {prediction.source}={prediction.category}, llm={category}"
+            )
+
+    async def _classify_with_llm(self, title: str, content: str) -> Optional[str]:
+        """调用LLM分类,失败时返回 None"""
+        categories_str = "\n".join([f"{k}: {v}" for k, v in DOCUMENT_CATEGORIES.items()])
         
         try:
-            response = await self.client.chat.completions.create(
-                model=settings.DEFAULT_AI_MODEL,
+            response = await self._complete(
                 messages=[
                     {
                         "role": "system",
@@ -218,13 +893,14 @@ class AIService:
                 ],
                 temperature=0.3,
                 max_tokens=20,
+                call_type="classify",
             )
             
-            category = response.choices[0].message.content.strip().lower()
-            if category in categories:
+            category = response.content.strip().lower()
+            if category in DOCUMENT_CATEGORIES:
                 return category
             return "other"
         
         except Exception as e:
             logger.error(f"分类文档错误: {str(e)}")
-            return "other"
+            return None
@@ -0,0 +1,126 @@
+"""
+语义答案缓存 - 相似问题且引用相同文档时直接返回已有回复
+"""
+import time
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import CACHE_REQUESTS_TOTAL
+
+
+class SemanticAnswerCache:
+    """
+    单个物业的答案缓存
+
+    以问题向量(归一化后)做暴力余弦匹配,相似度达到阈值且本次检索到的文档
+    与缓存条目引用的文档完全一致时命中。条目记录写入时的数据版本号,只匹配当前版本的条目
+    (其他工作进程更新文档后本进程的旧回复也不会命中)。条目数超过上限时淘汰最久未命中的条目。
+    仅在事件循环线程中使用,无需加锁。
+    """
+
+    def __init__(self, maxsize: int, ttl: float, threshold: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: List[Dict] = []
+        self._matrix: Optional[np.ndarray] = None  # 条目变化后按需重建
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, vector: np.ndarray, document_ids: Iterable[int], generation: Hashable) -> Optional[Dict]:
+        """
+        查找缓存的回复
+
+        Args:
+            vector: 问题向量
+            document_ids: 本次检索到的文档ID
+            generation: 物业向量数据的当前版本号
+
+        Returns:
+            命中时返回 {"content", "model", "sources"},否则返回 None
+        """
+        entry = self._match(vector, frozenset(document_ids), generation)
+        CACHE_REQUESTS_TOTAL.labels(cache="answer", result="hit" if entry else "miss").inc()
+        if entry is None:
+            return None
+        entry["last_used"] = time.monotonic()
+        return {"content": entry["content"], "model": entry["model"], "sources": entry["sources"]}
+
+    def store(self, vector: np.ndarray, content: str, model: str, sources: List[Dict], generation: Hashable):
+        """写入回复(generation 为生成回复时的数据版本号)"""
+        now = time.monotonic()
+        self._entries = [entry for entry in self._entries if entry["expires_at"] > now]
+        if len(self._entries) >= self.maxsize:
+            self._entries.sort(key=lambda entry: entry["last_used"])
+            del self._entries[:len(self._entries) - self.maxsize + 1]
+
+        self._entries.append({
+            "vector": self._normalize(vector),
+            "document_ids": frozenset(source["document_id"] for source in sources),
+            "content": content,
+            "model": model,
+            "sources": sources,
+            "generation": generation,
+            "expires_at": now + self.ttl,
+            "last_used": now,
+        })
+        self._matrix = None
+
+    def invalidate_document(self, document_id: int):
+        """删除引用了该文档的条目(文档更新或删除时调用)"""
+        kept = [entry for entry in self._entries if document_id not in entry["document_ids"]]
+        if len(kept) != len(self._entries):
+            self._entries = kept
+            self._matrix = None
+
+    def _match(self, vector: np.ndarray, document_ids: FrozenSet[int], generation: Hashable) -> Optional[Dict]:
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._matrix = np.stack([entry["vector"] for entry in self._entries])
+
+        scores = self._matrix @ self._normalize(vector)
+        now = time.monotonic()
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for row in candidates[np.argsort(-scores[candidates])]:
+            entry = self._entries[row]
+            if (
+                entry["document_ids"] == document_ids
+                and entry["generation"] == generation
+                and entry["expires_at"] > now
+            ):
+                return entry
+        return None
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+# 每个物业的答案缓存(进程内)
+_answer_caches: Dict[int, SemanticAnswerCache] = {}
+
+
+def get_answer_cache(property_id: int) -> SemanticAnswerCache:
+    """获取物业的答案缓存"""
+    cache = _answer_caches.get(property_id)
+    if cache is None:
+        cache = SemanticAnswerCache(
+            maxsize=settings.ANSWER_CACHE_SIZE,
+            ttl=settings.ANSWER_CACHE_TTL,
+            threshold=settings.ANSWER_CACHE_THRESHOLD,
+        )
+        _answer_caches[property_id] = cache
+    return cache
+
+
+def invalidate_document_answers(property_id: int, document_id: int):
+    """文档变化时使引用它的缓存回复失效"""
+    cache = _answer_caches.get(property_id)
+    if cache is not None:
+        cache.invalidate_document(document_id)
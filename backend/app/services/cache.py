@@ -0,0 +1,72 @@
+"""
+进程内缓存 - 带过期时间的LRU缓存
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from app.core.metrics import CACHE_REQUESTS_TOTAL, CACHE_SIZE
+
+
+class TTLLRUCache:
+    """
+    LRU + TTL 缓存
+
+    条目数超过上限时淘汰最久未使用的条目,条目超过有效期后视为未命中。
+    仅在事件循环线程中使用,无需加锁。
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存,未命中或已过期时返回 None"""
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self._record(hit=True)
+                return value
+            del self._data[key]
+        self._record(hit=False)
+        return None
+
+    def set(self, key: Hashable, value: Any):
+        """写入缓存"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        CACHE_SIZE.labels(cache=self.name).set(len(self._data))
+
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+        CACHE_SIZE.labels(cache=self.name).set(0)
+
+    def stats(self) -> Dict:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS_TOTAL.labels(cache=self.name, result="hit" if hit else "miss").inc()
@@ -0,0 +1,221 @@
+"""
+文档本地分类 - 关键词规则 + 向量质心,置信度足够时不再调用LLM
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.database import AsyncSessionLocal
+from app.models.document import Document, DocumentCategory
+from app.services.embedding import embedding_batcher, get_encoder
+
+# 各分类的关键词(标题命中权重更高)
+KEYWORD_RULES: Dict[str, List[str]] = {
+    "regulation": ["规定", "管理办法", "制度", "守则", "条例", "公约", "细则", "规章"],
+    "notice": ["通知", "公告", "通告", "告知", "温馨提示", "告业主书"],
+    "maintenance": ["维修", "报修", "检修", "维保", "保养", "故障", "抢修"],
+    "meeting": ["会议", "纪要", "业主大会", "议程", "表决", "业委会"],
+    "contract": ["合同", "协议", "甲方", "乙方", "签订", "违约"],
+    "financial": ["财务", "报表", "收支", "预算", "决算", "账目", "审计"],
+    "complaint": ["投诉", "举报", "不满", "诉求"],
+    "facility": ["设施", "设备", "电梯", "水泵", "配电", "监控系统", "门禁"],
+    "safety": ["安全", "消防", "应急", "演练", "防汛", "隐患"],
+}
+
+TITLE_WEIGHT = 3.0
+MAX_HITS_PER_KEYWORD = 3
+
+
+@dataclass
+class LocalPrediction:
+    """本地分类结果"""
+    category: Optional[str]          # 最可能的分类(可能置信度不足)
+    source: str                      # rules / centroid / none
+    confident: bool                  # 是否可以直接采用,不再调用LLM
+    vector: Optional[np.ndarray]     # 文档向量(用于更新质心)
+
+
+def match_rules(title: str, content: str) -> Tuple[Optional[str], bool]:
+    """
+    关键词规则打分
+
+    Returns:
+        (得分最高的分类, 是否置信): 最高分达到 CLASSIFIER_RULE_MIN_SCORE 且至少为第二名的两倍时置信
+    """
+    content = content[:2000]
+    scores = {}
+    for category, keywords in KEYWORD_RULES.items():
+        score = 0.0
+        for keyword in keywords:
+            if keyword in title:
+                score += TITLE_WEIGHT
+            score += min(content.count(keyword), MAX_HITS_PER_KEYWORD)
+        if score:
+            scores[category] = score
+    if not scores:
+        return None, False
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best, best_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    return best, best_score >= settings.CLASSIFIER_RULE_MIN_SCORE and best_score >= 2 * runner_up
+
+
+class CentroidClassifier:
+    """
+    单个物业的最近质心分类器
+
+    每个分类维护归一化文档向量之和,预测时与各分类质心做余弦比较;
+    最高相似度和领先第二名的差距都达到阈值时置信。
+    """
+
+    def __init__(self):
+        self.trained_at = 0.0
+        self._sums: Dict[str, np.ndarray] = {}
+        self._counts: Dict[str, int] = {}
+
+    def add(self, category: str, vector: np.ndarray):
+        """加入一个已分类的文档("其他"不构成有意义的质心,忽略)"""
+        if category == DocumentCategory.OTHER.value:
+            return
+        vector = _normalize(vector)
+        if category in self._sums:
+            self._sums[category] += vector
+            self._counts[category] += 1
+        else:
+            self._sums[category] = vector.copy()
+            self._counts[category] = 1
+
+    def predict(self, vector: np.ndarray) -> Tuple[Optional[str], bool]:
+        """
+        Returns:
+            (最相似的分类, 是否置信)
+        """
+        categories = [
+            category for category, count in self._counts.items()
+            if count >= settings.CLASSIFIER_MIN_SAMPLES
+        ]
+        if not categories:
+            return None, False
+
+        centroids = np.stack([_normalize(self._sums[category]) for category in categories])
+        scores = centroids @ _normalize(vector)
+        order = np.argsort(-scores)
+        best = float(scores[order[0]])
+        margin = best - float(scores[order[1]]) if len(order) > 1 else best
+        confident = best >= settings.CLASSIFIER_MIN_SIMILARITY and margin >= settings.CLASSIFIER_MIN_MARGIN
+        return categories[order[0]], confident
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _document_text(title: str, content: str) -> str:
+    return f"{title}\n{content[:500]}"
+
+
+# 每个物业的质心分类器(进程内)
+_classifiers: Dict[int, CentroidClassifier] = {}
+
+# 后台训练任务(持有引用,防止任务被回收)
+_training_tasks: Dict[int, asyncio.Task] = {}
+
+
+async def _train(property_id: int):
+    """用物业中由LLM或用户确定分类的文档训练质心分类器(不用本地分类器自己的结果)"""
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Document.category, Document.title, Document.content)
+                .where(
+                    Document.property_id == property_id,
+                    Document.is_processed == 1,
+                    Document.category != DocumentCategory.OTHER,
+                    Document.category_source.in_(["llm", "user"]),
+                )
+                .order_by(Document.id.desc())
+                .limit(settings.CLASSIFIER_TRAINING_LIMIT)
+            )
+            rows = result.all()
+
+        classifier = CentroidClassifier()
+        if rows:
+            texts = [_document_text(title, content or "") for _, title, content in rows]
+            vectors = await asyncio.to_thread(
+                lambda: get_encoder().encode(
+                    texts,
+                    batch_size=settings.EMBEDDING_BATCH_SIZE,
+                    convert_to_numpy=True,
+                    show_progress_bar=False,
+                )
+            )
+            for (category, _, _), vector in zip(rows, vectors):
+                classifier.add(category.value, vector)
+        classifier.trained_at = time.monotonic()
+        _classifiers[property_id] = classifier
+        logger.info(
+            f"训练文档分类质心: property_id={property_id}, documents={len(rows)}, "
+            f"耗时={time.perf_counter() - started:.2f}s"
+        )
+
+    except Exception as e:
+        logger.error(f"训练文档分类质心错误: {str(e)}")
+
+    finally:
+        _training_tasks.pop(property_id, None)
+
+
+def _get_classifier(property_id: int) -> Optional[CentroidClassifier]:
+    """获取质心分类器;未训练或已过期时在后台(重新)训练,训练完成前返回旧的分类器"""
+    classifier = _classifiers.get(property_id)
+    stale = classifier is None or (
+        time.monotonic() - classifier.trained_at > settings.CLASSIFIER_RETRAIN_INTERVAL
+    )
+    if stale and property_id not in _training_tasks:
+        _training_tasks[property_id] = asyncio.create_task(_train(property_id))
+    return classifier
+
+
+async def classify_locally(property_id: int, title: str, content: str) -> LocalPrediction:
+    """
+    本地分类: 先用关键词规则,规则不置信时再用向量质心
+    """
+    category, confident = match_rules(title, content)
+    if confident:
+        return LocalPrediction(category, "rules", True, None)
+
+    vector = None
+    classifier = _get_classifier(property_id)
+    try:
+        vector = await embedding_batcher.encode(_document_text(title, content))
+    except Exception as e:
+        logger.warning(f"文档向量化失败,跳过质心分类: {str(e)}")
+
+    if classifier is not None and vector is not None:
+        centroid_category, centroid_confident = classifier.predict(vector)
+        if centroid_confident:
+            return LocalPrediction(centroid_category, "centroid", True, vector)
+        category = category or centroid_category
+
+    return LocalPrediction(category, "none", False, vector)
+
+
+def learn(property_id: int, category: str, vector: Optional[np.ndarray]):
+    """
+    把新确定分类的文档加入质心(无需等待下次重新训练)
+
+    只应传入LLM或用户确认的分类,不要传入本地分类器自己的预测。
+    """
+    classifier = _classifiers.get(property_id)
+    if classifier is not None and vector is not None:
+        classifier.add(category, vector)
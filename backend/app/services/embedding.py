@@ -0,0 +1,246 @@
+"""
+向量化模型服务 - 进程级共享的编码器注册表
+"""
+import asyncio
+import resource
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from loguru import logger
+
+from app.core.config import settings
+from app.core.deadline import clamp
+from app.core.metrics import (
+    EMBEDDING_BATCH_SECONDS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_QUEUE_DEPTH,
+    EMBEDDING_QUEUE_WAIT_SECONDS,
+    EMBEDDING_REJECTED_TOTAL,
+)
+
+
+def _get_rss_mb() -> float:
+    """获取当前进程的常驻内存(MB)"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # 非Linux平台退化为峰值常驻内存
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class EncoderRegistry:
+    """
+    编码器注册表
+
+    每个模型在进程内只加载一次,所有 VectorStoreService 实例共享同一个编码器。
+    """
+
+    def __init__(self):
+        self._encoders: Dict[str, SentenceTransformer] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: Optional[str] = None) -> SentenceTransformer:
+        """
+        获取编码器(首次调用时加载)
+
+        Args:
+            model_name: 模型名称,默认使用配置中的本地向量化模型
+
+        Returns:
+            SentenceTransformer 实例
+        """
+        model_name = model_name or settings.LOCAL_EMBEDDING_MODEL
+        encoder = self._encoders.get(model_name)
+        if encoder is not None:
+            return encoder
+
+        with self._lock:
+            # 双重检查,避免并发请求重复加载
+            encoder = self._encoders.get(model_name)
+            if encoder is None:
+                encoder = self._load(model_name)
+                self._encoders[model_name] = encoder
+        return encoder
+
+    def warmup(self, model_name: Optional[str] = None) -> SentenceTransformer:
+        """预热编码器: 加载模型并执行一次推理"""
+        encoder = self.get(model_name)
+        encoder.encode(["预热"])
+        return encoder
+
+    def is_loaded(self, model_name: Optional[str] = None) -> bool:
+        """模型是否已加载"""
+        return (model_name or settings.LOCAL_EMBEDDING_MODEL) in self._encoders
+
+    def _load(self, model_name: str) -> SentenceTransformer:
+        """加载模型并记录耗时与内存占用"""
+        rss_before = _get_rss_mb()
+        started = time.perf_counter()
+
+        encoder = SentenceTransformer(
+            model_name,
+            device=settings.LOCAL_EMBEDDING_DEVICE or None,
+        )
+
+        elapsed = time.perf_counter() - started
+        rss_after = _get_rss_mb()
+        logger.info(
+            f"加载向量化模型: {model_name}, 耗时={elapsed:.2f}s, "
+            f"常驻内存={rss_after:.0f}MB (+{rss_after - rss_before:.0f}MB)"
+        )
+        return encoder
+
+
+encoder_registry = EncoderRegistry()
+
+
+def get_encoder(model_name: Optional[str] = None) -> SentenceTransformer:
+    """获取进程级共享的编码器"""
+    return encoder_registry.get(model_name)
+
+
+def _encode_texts(texts: List[str]) -> np.ndarray:
+    """在工作线程中获取编码器并推理(模型未预热时加载也不会阻塞事件循环)"""
+    return get_encoder().encode(
+        texts,
+        batch_size=len(texts),
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+
+
+class EmbeddingQueueFullError(Exception):
+    """向量化队列已满"""
+
+
+class EmbeddingBatcher:
+    """
+    查询向量化微批处理调度器
+
+    在一个很短的时间窗口内收集并发的查询向量化请求,合并为一批在工作线程中推理,
+    再把结果分发给各个调用方,避免模型推理阻塞事件循环。
+    """
+
+    def __init__(
+        self,
+        window_ms: Optional[float] = None,
+        max_batch_size: Optional[int] = None,
+        max_queue_depth: Optional[int] = None,
+    ):
+        self.window = (window_ms if window_ms is not None else settings.EMBEDDING_BATCH_WINDOW_MS) / 1000
+        self.max_batch_size = max_batch_size or settings.EMBEDDING_MAX_BATCH_SIZE
+        self.max_queue_depth = max_queue_depth or settings.EMBEDDING_QUEUE_MAX_DEPTH
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动后台批处理任务"""
+        if self._worker is not None and not self._worker.done():
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务,并让未完成的请求失败"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("向量化服务已关闭"))
+        EMBEDDING_QUEUE_DEPTH.set(0)
+
+    async def encode(self, text: str) -> np.ndarray:
+        """
+        向量化单条查询(与其他并发请求合并推理)
+
+        Args:
+            text: 查询文本
+
+        Returns:
+            一维 float32 向量
+        """
+        if self._worker is None or self._worker.done():
+            await self.start()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self._queue.put_nowait((text, future, loop.time()))
+        except asyncio.QueueFull:
+            EMBEDDING_REJECTED_TOTAL.inc()
+            raise EmbeddingQueueFullError("向量化队列已满")
+        EMBEDDING_QUEUE_DEPTH.set(self._queue.qsize())
+
+        # 超过请求截止时间时放弃等待,批处理会跳过已取消的请求
+        return await asyncio.wait_for(future, clamp())
+
+    async def _run(self):
+        """后台批处理循环"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+
+            # 在时间窗口内继续收集请求,直到达到批大小上限
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            EMBEDDING_QUEUE_DEPTH.set(self._queue.qsize())
+            await self._encode_batch(batch, loop)
+
+    async def _encode_batch(
+        self,
+        batch: List[Tuple[str, asyncio.Future, float]],
+        loop: asyncio.AbstractEventLoop,
+    ):
+        """推理一批查询并分发结果"""
+        # 跳过调用方已经取消的请求
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+
+        now = loop.time()
+        for _, _, enqueued_at in batch:
+            EMBEDDING_QUEUE_WAIT_SECONDS.observe(now - enqueued_at)
+        EMBEDDING_BATCH_SIZE.observe(len(batch))
+
+        texts = [text for text, _, _ in batch]
+        started = time.perf_counter()
+        try:
+            vectors = await asyncio.to_thread(_encode_texts, texts)
+        except Exception as e:
+            logger.error(f"批量向量化错误: {str(e)}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            EMBEDDING_BATCH_SECONDS.observe(time.perf_counter() - started)
+
+        for i, (_, future, _) in enumerate(batch):
+            if not future.done():
+                future.set_result(vectors[i])
+
+
+embedding_batcher = EmbeddingBatcher()
@@ -0,0 +1,135 @@
+"""
+会话最近消息缓存 - Redis列表保存每个会话的最近N条消息,读取历史时不查数据库
+"""
+import json
+from typing import Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.metrics import CACHE_REQUESTS_TOTAL
+from app.db.redis import get_redis
+from app.models.message import Message, MessageRole
+
+# 紧凑格式中的角色代码
+_ROLE_CODES = {MessageRole.USER: "u", MessageRole.ASSISTANT: "a"}
+_ROLE_NAMES = {"u": "user", "a": "assistant"}
+
+
+def _key(conversation_id: int) -> str:
+    return f"conv:{conversation_id}:recent"
+
+
+def _encode(message_id: int, role: MessageRole, content: str) -> str:
+    return json.dumps(
+        {"i": message_id, "r": _ROLE_CODES[role], "c": content},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def _decode(entry: str) -> Dict:
+    item = json.loads(entry)
+    return {"id": item["i"], "role": _ROLE_NAMES[item["r"]], "content": item["c"]}
+
+
+class RecentMessagesBuffer:
+    """
+    每个会话一个Redis列表(环形缓冲): RPUSH 追加,LTRIM 只保留最近 HISTORY_BUFFER_SIZE 条
+
+    - 只有缓存存在时才追加(RPUSHX),不会从中途开始形成不完整的缓存
+    - 读取未命中或缓存不足以覆盖所需历史时由调用方查询数据库,再用 rebuild 重建
+    - Redis出错时一律视为未命中;追加失败时删除缓存,避免之后读到缺消息的历史
+    """
+
+    @property
+    def enabled(self) -> bool:
+        return settings.HISTORY_BUFFER_ENABLED
+
+    async def read(
+        self,
+        conversation_id: int,
+        after_id: int,
+        limit: int,
+    ) -> Optional[List[Dict]]:
+        """
+        读取消息ID大于 after_id 的最近 limit 条消息(按时间升序)
+
+        Returns:
+            消息列表;缓存未命中或不能确定覆盖了所需的全部历史时返回 None
+        """
+        try:
+            entries = await get_redis().lrange(_key(conversation_id), 0, -1)
+        except Exception as e:
+            logger.warning(f"读取最近消息缓存失败: {str(e)}")
+            entries = []
+
+        history = None
+        if entries:
+            messages = [_decode(entry) for entry in entries]
+            unsummarized = [msg for msg in messages if msg["id"] > after_id]
+            # 缓存未满说明保存了整个会话;有被过滤掉的消息说明已覆盖到摘要边界
+            if (
+                len(unsummarized) >= limit
+                or len(messages) < settings.HISTORY_BUFFER_SIZE
+                or len(unsummarized) < len(messages)
+            ):
+                history = unsummarized[-limit:]
+
+        CACHE_REQUESTS_TOTAL.labels(cache="history", result="hit" if history is not None else "miss").inc()
+        return history
+
+    async def rebuild(self, conversation_id: int, messages: Iterable[Message]):
+        """用数据库中的最近消息(按时间升序)重建缓存"""
+        entries = [
+            _encode(msg.id, msg.role, msg.content)
+            for msg in messages if msg.role in _ROLE_CODES
+        ][-settings.HISTORY_BUFFER_SIZE:]
+        if not entries:
+            return
+        key = _key(conversation_id)
+        try:
+            async with get_redis().pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                pipe.rpush(key, *entries)
+                pipe.expire(key, settings.HISTORY_BUFFER_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"重建最近消息缓存失败: {str(e)}")
+
+    async def append(self, conversation_id: int, messages: List[Message], create: bool = False):
+        """
+        追加已提交的消息
+
+        Args:
+            create: 会话是新建的(这些消息就是全部历史),缓存不存在时也创建
+        """
+        entries = [
+            _encode(msg.id, msg.role, msg.content)
+            for msg in messages if msg.role in _ROLE_CODES
+        ]
+        if not entries:
+            return
+        key = _key(conversation_id)
+        try:
+            async with get_redis().pipeline(transaction=True) as pipe:
+                if create:
+                    pipe.rpush(key, *entries)
+                else:
+                    pipe.rpushx(key, *entries)
+                pipe.ltrim(key, -settings.HISTORY_BUFFER_SIZE, -1)
+                pipe.expire(key, settings.HISTORY_BUFFER_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"追加最近消息缓存失败,删除缓存: {str(e)}")
+            await self.invalidate(conversation_id)
+
+    async def invalidate(self, conversation_id: int):
+        """删除会话的缓存"""
+        try:
+            await get_redis().delete(_key(conversation_id))
+        except Exception as e:
+            logger.warning(f"删除最近消息缓存失败: {str(e)}")
+
+
+recent_messages = RecentMessagesBuffer()
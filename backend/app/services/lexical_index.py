@@ -0,0 +1,272 @@
+"""
+关键词检索 - 基于字符n-gram的BM25倒排索引
+"""
+import math
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+# 英文单词/数字(保留房号、日期等,如 3-502、2024.01)
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-./:][a-z0-9]+)*")
+
+# 连续的中日韩字符
+_CJK_RUN_RE = re.compile(r"[㐀-鿿豈-﫿]+")
+
+
+def tokenize(text: str, ngram: Optional[int] = None) -> List[str]:
+    """
+    切分检索词项
+
+    中文按字符n-gram(默认二元),英文单词和数字整体作为一个词项。
+    """
+    ngram = ngram or settings.LEXICAL_NGRAM
+    text = unicodedata.normalize("NFKC", text).lower()
+
+    terms = _WORD_RE.findall(text)
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) < ngram:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + ngram] for i in range(len(run) - ngram + 1))
+    return terms
+
+
+class LexicalIndex:
+    """
+    单个物业的BM25倒排索引
+
+    每个分块占一行,删除时只标记,墓碑过多时整体压缩。词项的倒排表在查询时
+    编译为 NumPy 数组并缓存,写入只会使涉及的词项缓存失效。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.loaded_at = 0.0  # 从向量库全量加载的时间,0 表示尚未加载
+        self.generation: Optional[Hashable] = None  # 索引内容对应的向量数据版本号
+
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._compiled: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._row_of: Dict[Hashable, int] = {}
+        self._keys: List[Optional[Hashable]] = []
+        self._payloads: List[Optional[Dict]] = []
+        self._lengths = np.zeros(1024, dtype=np.float32)
+        self._total_length = 0.0
+        self._alive = 0
+
+    def __len__(self) -> int:
+        return self._alive
+
+    def add(self, key: Hashable, payload: Dict):
+        """加入(或替换)一个分块"""
+        if key in self._row_of:
+            self.remove([key])
+
+        terms = Counter(tokenize(self._index_text(payload)))
+        if not terms:
+            return
+
+        row = len(self._keys)
+        if row >= len(self._lengths):
+            self._lengths = np.concatenate([self._lengths, np.zeros(len(self._lengths), dtype=np.float32)])
+
+        length = float(sum(terms.values()))
+        self._row_of[key] = row
+        self._keys.append(key)
+        self._payloads.append(payload)
+        self._lengths[row] = length
+        self._total_length += length
+        self._alive += 1
+
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[row] = tf
+            self._compiled.pop(term, None)
+
+    def remove(self, keys: Iterable[Hashable]):
+        """删除分块"""
+        for key in keys:
+            row = self._row_of.pop(key, None)
+            if row is None:
+                continue
+            for term in set(tokenize(self._index_text(self._payloads[row]))):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(row, None)
+                    if not postings:
+                        del self._postings[term]
+                    self._compiled.pop(term, None)
+
+            self._total_length -= float(self._lengths[row])
+            self._lengths[row] = 0
+            self._keys[row] = None
+            self._payloads[row] = None
+            self._alive -= 1
+
+        # 墓碑超过一半时压缩
+        if len(self._keys) > 1024 and self._alive < len(self._keys) // 2:
+            self._compact()
+
+    def remove_document(self, document_id: int):
+        """删除文档的所有分块"""
+        self.remove([
+            key for key, payload in zip(self._keys, self._payloads)
+            if payload is not None and payload.get("document_id") == document_id
+        ])
+
+    def search(self, query: str, limit: int) -> List[Tuple[float, Dict]]:
+        """
+        BM25检索
+
+        得分按查询的最大可能得分(每个词项的词频饱和上限 idf * (k1 + 1) 之和)归一化到 [0, 1),
+        表示查询词项按权重被匹配的程度,可以跨查询设置阈值;排序与原始BM25一致。
+
+        Returns:
+            [(归一化得分, payload)] 按得分降序
+        """
+        terms = Counter(tokenize(query))
+        if not terms or not self._alive or limit <= 0:
+            return []
+
+        n_rows = len(self._keys)
+        scores = np.zeros(n_rows, dtype=np.float32)
+        avg_length = self._total_length / self._alive
+        lengths = self._lengths[:n_rows]
+        max_score = 0.0
+
+        for term, query_tf in terms.items():
+            # 未出现的词项按 df=0 计入上限,只匹配到部分词项的分块得分相应较低
+            compiled = self._compile(term)
+            df = len(compiled[0]) if compiled is not None else 0
+            idf = math.log(1 + (self._alive - df + 0.5) / (df + 0.5))
+            max_score += query_tf * idf * (self.k1 + 1)
+            if compiled is None:
+                continue
+            rows, tfs = compiled
+            norm = tfs + self.k1 * (1 - self.b + self.b * lengths[rows] / avg_length)
+            scores[rows] += query_tf * idf * tfs * (self.k1 + 1) / norm
+        scores /= max_score
+
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        k = min(limit, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[row]), self._payloads[row]) for row in top]
+
+    def documents_matching_all(self, query: str) -> Optional[Set[int]]:
+        """
+        包含查询全部词项的文档ID(按文档汇总各分块)
+
+        子串匹配的文档必然包含查询的全部词项,可作为精确匹配前的预筛选。
+
+        Returns:
+            文档ID集合;查询切分不出词项时返回 None(无法预筛选)
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return None
+        matched: Optional[Set[int]] = None
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                return set()
+            documents = {self._payloads[row].get("document_id") for row in postings}
+            matched = documents if matched is None else matched & documents
+            if not matched:
+                return set()
+        return matched
+
+    def _compile(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """把词项倒排表编译为数组(带缓存)"""
+        compiled = self._compiled.get(term)
+        if compiled is None:
+            postings = self._postings.get(term)
+            if not postings:
+                return None
+            compiled = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float32, count=len(postings)),
+            )
+            self._compiled[term] = compiled
+        return compiled
+
+    def _compact(self):
+        """丢弃墓碑行,重建索引"""
+        alive = [
+            (key, payload)
+            for key, payload in zip(self._keys, self._payloads)
+            if key is not None
+        ]
+        loaded_at, generation = self.loaded_at, self.generation
+        self.__init__(self.k1, self.b)
+        self.loaded_at, self.generation = loaded_at, generation
+        for key, payload in alive:
+            self.add(key, payload)
+
+    @staticmethod
+    def _index_text(payload: Dict) -> str:
+        return f"{payload.get('title', '')}\n{payload.get('content', '')}"
+
+
+# 每个物业的倒排索引(进程内)
+_lexical_indexes: Dict[int, LexicalIndex] = {}
+
+
+def get_lexical_index(property_id: int) -> LexicalIndex:
+    """获取物业的倒排索引"""
+    index = _lexical_indexes.get(property_id)
+    if index is None:
+        index = LexicalIndex()
+        _lexical_indexes[property_id] = index
+    return index
+
+
+def replace_lexical_index(property_id: int, index: LexicalIndex):
+    """整体替换物业的倒排索引(重建完成后调用)"""
+    _lexical_indexes[property_id] = index
+
+
+def is_index_fresh(index: LexicalIndex, generation: Hashable, check_ttl: bool = False) -> bool:
+    """
+    索引是否已加载且与向量数据版本号一致
+
+    check_ttl: 版本号无法反映其他进程的写入时(Redis不可用)同时检查有效期,定期从向量库重建
+    """
+    if index.loaded_at <= 0 or index.generation != generation:
+        return False
+    return not check_ttl or time.monotonic() - index.loaded_at < settings.LEXICAL_INDEX_TTL
+
+
+def reciprocal_rank_fusion(
+    result_lists: List[List[Tuple[Hashable, Dict]]],
+    limit: int,
+    k: Optional[int] = None,
+) -> List[Tuple[float, Dict]]:
+    """
+    倒数排名融合(RRF)
+
+    Args:
+        result_lists: 多路检索结果,每路为按相关性排序的 [(去重键, 结果)]
+        limit: 返回数量
+        k: RRF平滑常数
+
+    Returns:
+        [(融合得分, 结果)] 按得分降序
+    """
+    k = k or settings.RRF_K
+    fused: Dict[Hashable, float] = {}
+    items: Dict[Hashable, Dict] = {}
+    for results in result_lists:
+        for rank, (key, item) in enumerate(results, 1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(key, item)
+
+    ranked = sorted(fused.items(), key=lambda pair: pair[1], reverse=True)[:limit]
+    return [(score, items[key]) for key, score in ranked]
@@ -0,0 +1,73 @@
+"""
+LLM客户端 - 进程级共享的 AsyncOpenAI / AsyncAnthropic 客户端
+"""
+from typing import Optional
+
+import httpx
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+from loguru import logger
+
+from app.core.config import settings
+
+_client: Optional[AsyncOpenAI] = None
+_anthropic_client: Optional[AsyncAnthropic] = None
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """按配置创建带连接池的 httpx 客户端"""
+    return httpx.AsyncClient(
+        http2=settings.LLM_HTTP2,
+        timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_llm_client() -> AsyncOpenAI:
+    """
+    获取共享的LLM客户端
+
+    所有请求复用同一个 httpx 连接池,避免每次请求重新建连和TLS握手。
+    """
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL or None,
+            http_client=_build_http_client(),
+            # 重试由调用方在请求截止时间内完成(见 app/services/resilience.py)
+            max_retries=0,
+        )
+        logger.info(
+            f"创建LLM客户端: base_url={_client.base_url}, http2={settings.LLM_HTTP2}, "
+            f"max_connections={settings.LLM_MAX_CONNECTIONS}"
+        )
+    return _client
+
+
+def get_anthropic_client() -> AsyncAnthropic:
+    """获取共享的Anthropic客户端(首次使用时创建)"""
+    global _anthropic_client
+    if _anthropic_client is None:
+        _anthropic_client = AsyncAnthropic(
+            api_key=settings.ANTHROPIC_API_KEY,
+            http_client=_build_http_client(),
+            max_retries=0,
+        )
+        logger.info(f"创建Anthropic客户端: http2={settings.LLM_HTTP2}")
+    return _anthropic_client
+
+
+async def close_llm_client():
+    """关闭共享的LLM客户端"""
+    global _client, _anthropic_client
+    if _client is not None:
+        await _client.close()
+        _client = None
+    if _anthropic_client is not None:
+        await _anthropic_client.close()
+        _anthropic_client = None
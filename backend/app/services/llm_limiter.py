@@ -0,0 +1,193 @@
+"""
+LLM并发限制 - 按物业公平排队、AIMD自适应调整并发上限
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Hashable
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.deadline import budget
+from app.core.metrics import (
+    LLM_CONCURRENCY_LIMIT,
+    LLM_IN_FLIGHT,
+    LLM_QUEUE_DEPTH,
+    LLM_QUEUE_WAIT_SECONDS,
+    LLM_REJECTED_TOTAL,
+)
+
+# 两次下调并发上限的最小间隔(秒),避免同一批429把上限连续压到底
+_DECREASE_COOLDOWN = 1.0
+
+
+class LLMOverloadedError(Exception):
+    """LLM调用排队已满或等待超时"""
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    进程内的LLM并发限制器
+
+    - 并发数达到上限时进入等待队列,队列按物业轮转出队,单个物业的突发请求
+      不会占满所有名额
+    - 队列已满时立即拒绝,排队超时也拒绝,不再把请求压给上游
+    - AIMD: 调用成功且耗时正常时上限缓慢增加(每个上限周期约+1),
+      遇到429或耗时超过目标值时按比例下调
+
+    仅在事件循环线程中使用,无需加锁。
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        max_queue: int,
+        queue_timeout: float,
+        latency_target: float = 0.0,
+        backoff: float = 0.7,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.backoff = backoff
+
+        self.in_flight = 0
+        self._queued = 0
+        self._waiters: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._last_decrease = 0.0
+        LLM_CONCURRENCY_LIMIT.set(self.limit)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable, latency_signal: bool = True) -> AsyncIterator[None]:
+        """
+        占用一个调用名额
+
+        Args:
+            key: 公平排队的分组键(物业ID)
+            latency_signal: 是否把调用耗时作为过载信号(流式调用的耗时取决于回复长度,不适用)
+        """
+        await self._acquire(key)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.observe_error(e)
+            raise
+        else:
+            self._on_success(time.perf_counter() - started if latency_signal else None)
+        finally:
+            self._release()
+
+    def observe_error(self, exc: BaseException):
+        """上游返回429时下调并发上限(名额内自行重试的调用需主动上报)"""
+        if getattr(exc, "status_code", None) == 429:
+            self._decrease("rate_limited")
+
+    async def _acquire(self, key: Hashable):
+        if self.in_flight < int(self.limit) and not self._queued:
+            self._grant()
+            return
+
+        if self._queued >= self.max_queue:
+            LLM_REJECTED_TOTAL.labels(reason="queue_full").inc()
+            raise LLMOverloadedError("LLM调用排队已满")
+
+        # 排队时间同时受请求截止时间约束
+        timeout = budget(self.queue_timeout)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        self._set_queued(self._queued + 1)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 已分配到名额但等待者放弃了(如客户端断开),归还名额
+                self._release()
+            else:
+                self._remove_waiter(key, future)
+            if isinstance(e, asyncio.TimeoutError):
+                LLM_REJECTED_TOTAL.labels(reason="timeout").inc()
+                raise LLMOverloadedError("LLM调用排队超时") from None
+            raise
+        finally:
+            LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+    def _grant(self):
+        self.in_flight += 1
+        LLM_IN_FLIGHT.set(self.in_flight)
+
+    def _release(self):
+        self.in_flight -= 1
+        LLM_IN_FLIGHT.set(self.in_flight)
+        self._wake()
+
+    def _wake(self):
+        """按物业轮转把空出的名额分给等待者"""
+        while self._waiters and self.in_flight < int(self.limit):
+            key, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            self._set_queued(self._queued - 1)
+            if waiters:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if future.done():
+                continue
+            self._grant()
+            future.set_result(None)
+
+    def _remove_waiter(self, key: Hashable, future: asyncio.Future):
+        waiters = self._waiters.get(key)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        self._set_queued(self._queued - 1)
+        if not waiters:
+            del self._waiters[key]
+
+    def _set_queued(self, value: int):
+        self._queued = value
+        LLM_QUEUE_DEPTH.set(value)
+
+    def _on_success(self, latency):
+        if latency is not None and self.latency_target and latency > self.latency_target:
+            self._decrease("slow")
+            return
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            LLM_CONCURRENCY_LIMIT.set(self.limit)
+            self._wake()
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < _DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        LLM_CONCURRENCY_LIMIT.set(self.limit)
+        logger.warning(f"下调LLM并发上限: {previous:.1f} -> {self.limit:.1f} ({reason})")
+
+
+# 进程内共享的LLM并发限制器
+llm_limiter = AdaptiveConcurrencyLimiter(
+    initial=settings.LLM_CONCURRENCY_INITIAL,
+    min_limit=settings.LLM_CONCURRENCY_MIN,
+    max_limit=settings.LLM_CONCURRENCY_MAX,
+    max_queue=settings.LLM_QUEUE_MAX_DEPTH,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+    latency_target=settings.LLM_LATENCY_TARGET,
+    backoff=settings.LLM_LIMIT_BACKOFF,
+)
@@ -0,0 +1,409 @@
+"""
+LLM提供方路由 - 按调用类型选择模型,按健康状况自动切换提供方
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Deque, Dict, Hashable, List, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.deadline import DeadlineExceededError, budget
+from app.core.metrics import (
+    LLM_FAILOVER_TOTAL,
+    LLM_PROVIDER_LATENCY_SECONDS,
+    LLM_PROVIDER_REQUESTS_TOTAL,
+)
+from app.services.llm_client import get_anthropic_client, get_llm_client
+from app.services.llm_limiter import LLMOverloadedError, llm_limiter
+from app.services.resilience import LatencyTracker, hedged, with_retries
+
+@dataclass
+class Completion:
+    """非流式调用结果"""
+    content: str
+    model: str
+    provider: str
+    total_tokens: int
+
+
+class LLMProvider:
+    """提供方接口: 消息统一使用OpenAI格式 [{"role", "content"}]"""
+
+    name = ""
+
+    @property
+    def available(self) -> bool:
+        """是否已配置(未配置的提供方不参与路由)"""
+        raise NotImplementedError
+
+    async def complete(
+        self, model: str, messages: List[Dict], temperature: float, max_tokens: int
+    ) -> Completion:
+        raise NotImplementedError
+
+    async def open_stream(
+        self, model: str, messages: List[Dict], temperature: float, max_tokens: int
+    ) -> AsyncIterator[str]:
+        """建立流式请求,返回增量文本的迭代器"""
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    @property
+    def available(self) -> bool:
+        return bool(settings.OPENAI_API_KEY or settings.OPENAI_BASE_URL)
+
+    async def complete(self, model, messages, temperature, max_tokens) -> Completion:
+        response = await get_llm_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=budget(settings.LLM_TIMEOUT),
+        )
+        return Completion(
+            content=response.choices[0].message.content or "",
+            model=model,
+            provider=self.name,
+            total_tokens=response.usage.total_tokens if response.usage else 0,
+        )
+
+    async def open_stream(self, model, messages, temperature, max_tokens) -> AsyncIterator[str]:
+        stream = await get_llm_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=budget(settings.LLM_TIMEOUT),
+        )
+
+        async def deltas():
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        return deltas()
+
+
+class AnthropicProvider(LLMProvider):
+    name = "anthropic"
+
+    @property
+    def available(self) -> bool:
+        return bool(settings.ANTHROPIC_API_KEY)
+
+    async def complete(self, model, messages, temperature, max_tokens) -> Completion:
+        system, turns = self._convert(messages)
+        response = await get_anthropic_client().messages.create(
+            model=model,
+            system=system,
+            messages=turns,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=budget(settings.LLM_TIMEOUT),
+        )
+        return Completion(
+            content="".join(block.text for block in response.content if block.type == "text"),
+            model=model,
+            provider=self.name,
+            total_tokens=response.usage.input_tokens + response.usage.output_tokens,
+        )
+
+    async def open_stream(self, model, messages, temperature, max_tokens) -> AsyncIterator[str]:
+        system, turns = self._convert(messages)
+        stream = await get_anthropic_client().messages.create(
+            model=model,
+            system=system,
+            messages=turns,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=budget(settings.LLM_TIMEOUT),
+        )
+
+        async def deltas():
+            async for event in stream:
+                if event.type == "content_block_delta" and event.delta.text:
+                    yield event.delta.text
+
+        return deltas()
+
+    @staticmethod
+    def _convert(messages: List[Dict]) -> Tuple[str, List[Dict]]:
+        """
+        转换为Anthropic格式
+
+        系统消息合并为 system 参数;连续同角色的消息合并(要求用户/助手交替),
+        且第一条必须是用户消息。
+        """
+        system = "\n\n".join(msg["content"] for msg in messages if msg["role"] == "system")
+        turns: List[Dict] = []
+        for msg in messages:
+            if msg["role"] == "system":
+                continue
+            if turns and turns[-1]["role"] == msg["role"]:
+                turns[-1]["content"] += "\n\n" + msg["content"]
+            elif turns or msg["role"] == "user":
+                turns.append({"role": msg["role"], "content": msg["content"]})
+        return system, turns
+
+
+class ProviderHealth:
+    """
+    提供方的滚动健康状态
+
+    最近若干次调用的错误率超过阈值时熔断一段时间(按提供方统计);耗时按调用类型和模型
+    分别统计(摘要和对话的输出长度、不同模型的速度差别很大),某个调用类型+模型的中位
+    耗时超过上限时该候选视为降级。熔断或降级的候选排到路由候选的末尾,仍可作为最后的选择。
+    """
+
+    def __init__(self, name: str, window: int = 50, min_samples: int = 10):
+        self.name = name
+        self.window = window
+        self.min_samples = min_samples
+        self._latency: Dict[Tuple[str, str], LatencyTracker] = {}
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._open_until = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._open_until
+
+    def latency(self, call_type: str, model: str) -> LatencyTracker:
+        """调用类型+模型的成功调用耗时"""
+        tracker = self._latency.get((call_type, model))
+        if tracker is None:
+            tracker = LatencyTracker(window=self.window, min_samples=self.min_samples)
+            self._latency[(call_type, model)] = tracker
+        return tracker
+
+    def degraded(self, call_type: str, model: str) -> bool:
+        median = self.latency(call_type, model).percentile(50)
+        return median is not None and median > settings.LLM_PROVIDER_MAX_LATENCY
+
+    def record(self, ok: bool):
+        """记录一次调用结果(耗时由 latency() 的统计在成功时单独记录)"""
+        self._outcomes.append(ok)
+        if (
+            not ok
+            and len(self._outcomes) >= self.min_samples
+            and self.error_rate >= settings.LLM_PROVIDER_ERROR_THRESHOLD
+            and self.healthy
+        ):
+            self._open_until = time.monotonic() + settings.LLM_PROVIDER_COOLDOWN
+            # 熔断结束后重新统计
+            self._outcomes.clear()
+            logger.warning(
+                f"LLM提供方错误率过高,暂停使用{settings.LLM_PROVIDER_COOLDOWN}秒: {self.name}"
+            )
+
+
+def parse_route(route: str) -> List[Tuple[str, str]]:
+    """解析路由配置 "provider:model,provider:model" """
+    candidates = []
+    for item in route.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        provider, _, model = item.partition(":")
+        candidates.append((provider.strip(), model.strip()))
+    return candidates
+
+
+class LLMRouter:
+    """
+    按调用类型(chat对话 / summary摘要 / classify分类)路由LLM请求
+
+    每种调用类型配置一组有序的候选(提供方:模型)。健康的候选按配置顺序优先,
+    当前候选失败时立即切换到下一个;最后一个候选在截止时间内重试。
+    """
+
+    def __init__(self):
+        self.providers: Dict[str, LLMProvider] = {
+            provider.name: provider for provider in (OpenAIProvider(), AnthropicProvider())
+        }
+        self.health: Dict[str, ProviderHealth] = {
+            name: ProviderHealth(name) for name in self.providers
+        }
+
+    def routes(self, call_type: str) -> List[Tuple[str, str]]:
+        """调用类型的候选列表(已按健康状况排序)"""
+        route = {
+            "chat": settings.LLM_CHAT_ROUTE,
+            "summary": settings.LLM_SUMMARY_ROUTE,
+            "classify": settings.LLM_CLASSIFY_ROUTE,
+        }[call_type] or f"openai:{settings.DEFAULT_AI_MODEL}"
+
+        candidates = [
+            (provider, model) for provider, model in parse_route(route)
+            if provider in self.providers and self.providers[provider].available
+        ]
+        if not candidates:
+            # 都未配置时仍按配置调用,由上游返回错误
+            candidates = [
+                (provider, model) for provider, model in parse_route(route)
+                if provider in self.providers
+            ]
+        order = {candidate: i for i, candidate in enumerate(candidates)}
+        return sorted(
+            candidates,
+            key=lambda c: (
+                not self.health[c[0]].healthy,
+                self.health[c[0]].degraded(call_type, c[1]),
+                order[c],
+            ),
+        )
+
+    async def complete(
+        self,
+        call_type: str,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+        fairness_key: Hashable,
+    ) -> Completion:
+        """非流式调用(含并发限制、重试、对冲和提供方切换)"""
+        candidates = self.routes(call_type)
+        if not candidates:
+            raise RuntimeError(f"未配置可用的LLM路由: {call_type}")
+        for i, (provider_name, model) in enumerate(candidates):
+            provider = self.providers[provider_name]
+            health = self.health[provider_name]
+            last = i == len(candidates) - 1
+
+            async def attempt():
+                async with llm_limiter.slot(fairness_key):
+                    return await self._observed(
+                        call_type, provider_name,
+                        provider.complete(model, messages, temperature, max_tokens),
+                    )
+
+            # 已有请求在排队时不对冲,避免加重拥塞
+            hedge = settings.LLM_HEDGE_ENABLED and not llm_limiter.queued
+            try:
+                return await with_retries(
+                    lambda: hedged(
+                        attempt, health.latency(call_type, model), provider_name, enabled=hedge
+                    ),
+                    f"llm_{call_type}",
+                    attempts=None if last else 1,
+                )
+            except (LLMOverloadedError, DeadlineExceededError):
+                raise
+            except Exception as e:
+                if last:
+                    raise
+                LLM_FAILOVER_TOTAL.labels(call_type=call_type, provider=provider_name).inc()
+                logger.warning(f"LLM提供方调用失败,切换到下一个: {provider_name}/{model}, {e!r}")
+
+    async def open_stream(
+        self,
+        call_type: str,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+    ) -> Tuple[str, AsyncIterator[str]]:
+        """
+        建立流式调用(调用方负责占用并发名额)
+
+        只在建立连接阶段重试和切换提供方,开始输出后不再切换。
+
+        Returns:
+            (模型名称, 增量文本迭代器)
+        """
+        candidates = self.routes(call_type)
+        if not candidates:
+            raise RuntimeError(f"未配置可用的LLM路由: {call_type}")
+        for i, (provider_name, model) in enumerate(candidates):
+            provider = self.providers[provider_name]
+            last = i == len(candidates) - 1
+
+            async def attempt():
+                try:
+                    deltas = await self._observed(
+                        call_type, provider_name,
+                        provider.open_stream(model, messages, temperature, max_tokens),
+                        stream=True,
+                    )
+                    return self._observed_stream(call_type, provider_name, deltas)
+                except Exception as e:
+                    llm_limiter.observe_error(e)
+                    raise
+
+            try:
+                stream = await with_retries(
+                    attempt, f"llm_{call_type}_stream", attempts=None if last else 1
+                )
+                return model, stream
+            except DeadlineExceededError:
+                raise
+            except Exception as e:
+                if last:
+                    raise
+                LLM_FAILOVER_TOTAL.labels(call_type=call_type, provider=provider_name).inc()
+                logger.warning(f"LLM提供方建立流失败,切换到下一个: {provider_name}/{model}, {e!r}")
+
+    async def _observed(self, call_type: str, provider_name: str, awaitable, stream: bool = False):
+        """
+        记录单次调用的耗时和结果
+
+        Args:
+            stream: 建立流式请求,只记录建立连接的耗时和失败;成功与否在流结束时由 _observed_stream 记录
+        """
+        started = time.perf_counter()
+        try:
+            result = await awaitable
+        except asyncio.CancelledError:
+            # 对冲请求被取消不计为失败
+            raise
+        except Exception:
+            self.health[provider_name].record(False)
+            LLM_PROVIDER_REQUESTS_TOTAL.labels(
+                provider=provider_name, call_type=call_type, result="error"
+            ).inc()
+            raise
+        elapsed = time.perf_counter() - started
+        LLM_PROVIDER_LATENCY_SECONDS.labels(provider=provider_name).observe(elapsed)
+        if not stream:
+            self.health[provider_name].record(True)
+            LLM_PROVIDER_REQUESTS_TOTAL.labels(
+                provider=provider_name, call_type=call_type, result="ok"
+            ).inc()
+        return result
+
+    async def _observed_stream(
+        self, call_type: str, provider_name: str, deltas: AsyncIterator[str]
+    ) -> AsyncIterator[str]:
+        """
+        流结束时记录结果: 完整读完计为成功,中途出错计为失败;
+        调用方提前停止读取(客户端断开、请求被取消)不计入
+        """
+        try:
+            async for delta in deltas:
+                yield delta
+        except Exception as e:
+            llm_limiter.observe_error(e)
+            self.health[provider_name].record(False)
+            LLM_PROVIDER_REQUESTS_TOTAL.labels(
+                provider=provider_name, call_type=call_type, result="error"
+            ).inc()
+            raise
+        self.health[provider_name].record(True)
+        LLM_PROVIDER_REQUESTS_TOTAL.labels(
+            provider=provider_name, call_type=call_type, result="ok"
+        ).inc()
+
+
+llm_router = LLMRouter()
@@ -0,0 +1,160 @@
+"""
+提示词构建 - 按token预算组装系统提示、检索上下文和对话历史
+"""
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+from loguru import logger
+
+from app.core.config import settings
+from app.services.text_chunker import estimate_tokens
+
+# 每条消息的格式开销(role、分隔符等)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=8)
+def get_tokenizer(model: str) -> Optional[tiktoken.Encoding]:
+    """获取模型对应的分词器(进程内缓存)"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # 离线环境无法下载词表时退化为估算
+        logger.warning(f"加载分词器失败,使用估算token数: {str(e)}")
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """统计文本token数"""
+    tokenizer = get_tokenizer(model or settings.DEFAULT_AI_MODEL)
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """截断文本到指定token数"""
+    if max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer(model or settings.DEFAULT_AI_MODEL)
+    if tokenizer is None:
+        # 估算模式下按比例截断字符
+        total = estimate_tokens(text)
+        if total <= max_tokens:
+            return text
+        return text[:max(1, len(text) * max_tokens // total)]
+    tokens = tokenizer.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return tokenizer.decode(tokens[:max_tokens])
+
+
+class PromptBuilder:
+    """
+    按token预算组装提示词
+
+    预算分配顺序: 系统提示和当前问题必须保留 -> 历史摘要 -> 检索上下文(按相关性,
+    超出时截断) -> 最近的对话历史(从新到旧,放不下的更早轮次交给摘要)。
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        budget: Optional[int] = None,
+        context_budget: Optional[int] = None,
+        history_budget: Optional[int] = None,
+    ):
+        self.model = model or settings.DEFAULT_AI_MODEL
+        self.budget = budget or settings.PROMPT_TOKEN_BUDGET
+        self.context_budget = context_budget or settings.PROMPT_CONTEXT_TOKENS
+        self.history_budget = history_budget or settings.PROMPT_HISTORY_TOKENS
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model) + MESSAGE_OVERHEAD_TOKENS
+
+    def build(
+        self,
+        system_prompt: str,
+        user_message: str,
+        documents: List[Dict],
+        history: List[Dict],
+        summary: Optional[str] = None,
+    ) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """
+        组装消息列表
+
+        Args:
+            system_prompt: 系统提示词
+            user_message: 当前用户问题
+            documents: 检索到的文档(按相关性降序)
+            history: 对话历史(按时间升序)
+            summary: 更早对话的摘要
+
+        Returns:
+            (消息列表, 实际使用的文档, 因超出预算未放入的较早历史)
+        """
+        remaining = self.budget - self.count(system_prompt) - self.count(user_message)
+
+        summary_message = None
+        if summary:
+            summary_message = {
+                "role": "system",
+                "content": f"以下是此前对话的摘要:\n{summary}"
+            }
+            remaining -= self.count(summary_message["content"])
+
+        # 检索上下文
+        context_message = None
+        used_documents: List[Dict] = []
+        context_left = min(self.context_budget, remaining)
+        parts = []
+        for i, doc in enumerate(documents, 1):
+            header = f"文档{i}: {doc['title']}\n内容: "
+            cost = count_tokens(header + doc["content"], self.model)
+            if cost > context_left:
+                # 放不下完整内容时截断,剩余空间太少则停止
+                content = truncate_to_tokens(
+                    doc["content"],
+                    context_left - count_tokens(header, self.model),
+                    self.model
+                )
+                if len(content) < 50:
+                    break
+                cost = context_left
+            else:
+                content = doc["content"]
+            parts.append(f"{header}{content}\n")
+            used_documents.append(doc)
+            context_left -= cost
+        if parts:
+            context = "\n".join(parts)
+            context_message = {
+                "role": "system",
+                "content": f"以下是相关的物业文档信息:\n\n{context}\n\n请基于这些信息回答用户的问题。"
+            }
+            remaining -= self.count(context_message["content"])
+
+        # 对话历史: 从最新的开始放,直到超出预算
+        history_left = min(self.history_budget, remaining)
+        kept: List[Dict] = []
+        overflow: List[Dict] = []
+        for i in range(len(history) - 1, -1, -1):
+            cost = self.count(history[i]["content"])
+            if cost > history_left:
+                overflow = history[:i + 1]
+                break
+            kept.insert(0, history[i])
+            history_left -= cost
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary_message:
+            messages.append(summary_message)
+        if context_message:
+            messages.append(context_message)
+        messages.extend({"role": msg["role"], "content": msg["content"]} for msg in kept)
+        messages.append({"role": "user", "content": user_message})
+
+        return messages, used_documents, overflow
@@ -0,0 +1,152 @@
+"""
+调用容错 - 截止时间内的抖动重试和对冲请求
+"""
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, TypeVar
+
+import anthropic
+import httpx
+import openai
+from loguru import logger
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception,
+    stop_after_attempt,
+    stop_any,
+    wait_random_exponential,
+)
+
+from app.core import deadline
+from app.core.config import settings
+from app.core.metrics import CALL_RETRIES_TOTAL, HEDGED_REQUESTS_TOTAL
+from app.services.llm_limiter import LLMOverloadedError
+
+T = TypeVar("T")
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """是否为可重试的临时错误(超时、连接错误、429、5xx)"""
+    if isinstance(exc, (LLMOverloadedError, deadline.DeadlineExceededError)):
+        return False
+    if isinstance(exc, (
+        asyncio.TimeoutError,
+        httpx.TransportError,
+        openai.APIConnectionError,
+        anthropic.APIConnectionError,
+    )):
+        return True
+    status = getattr(exc, "status_code", None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+async def with_retries(
+    fn: Callable[[], Awaitable[T]],
+    name: str,
+    attempts: Optional[int] = None,
+) -> T:
+    """
+    在请求截止时间内重试
+
+    退避时间随机抖动,且不超过剩余时间;剩余时间不足 RETRY_MIN_BUDGET 时不再重试。
+
+    Args:
+        fn: 每次尝试调用的函数
+        name: 调用类型(用于日志和指标)
+        attempts: 最多尝试次数(含首次)
+    """
+    base_wait = wait_random_exponential(
+        multiplier=settings.RETRY_BACKOFF,
+        max=settings.RETRY_MAX_BACKOFF,
+    )
+
+    def wait_within_deadline(retry_state) -> float:
+        delay = base_wait(retry_state)
+        left = deadline.remaining()
+        if left is not None:
+            delay = max(0.0, min(delay, left - settings.RETRY_MIN_BUDGET))
+        return delay
+
+    def stop_on_deadline(retry_state) -> bool:
+        left = deadline.remaining()
+        return left is not None and left < settings.RETRY_MIN_BUDGET
+
+    def before_sleep(retry_state):
+        CALL_RETRIES_TOTAL.labels(call=name).inc()
+        logger.warning(
+            f"{name}调用失败,准备重试(第{retry_state.attempt_number}次): "
+            f"{retry_state.outcome.exception()!r}"
+        )
+
+    async for attempt in AsyncRetrying(
+        stop=stop_any(stop_after_attempt(attempts or settings.LLM_RETRY_ATTEMPTS), stop_on_deadline),
+        wait=wait_within_deadline,
+        retry=retry_if_exception(is_retryable),
+        before_sleep=before_sleep,
+        reraise=True,
+    ):
+        with attempt:
+            return await fn()
+
+
+class LatencyTracker:
+    """最近若干次成功调用的耗时,用于计算对冲延迟"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """耗时分位数(秒),样本不足时返回 None"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    async def timed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await fn()
+        self.record(loop.time() - started)
+        return result
+
+
+async def hedged(
+    fn: Callable[[], Awaitable[T]],
+    tracker: LatencyTracker,
+    name: str,
+    enabled: bool = True,
+) -> T:
+    """
+    对冲请求
+
+    首个请求超过历史耗时分位数(LLM_HEDGE_PERCENTILE)仍未返回时,再发起一个
+    相同的请求,取先成功的结果并取消另一个。样本不足或剩余时间不够时不对冲。
+    """
+    delay = tracker.percentile(settings.LLM_HEDGE_PERCENTILE) if enabled else None
+    left = deadline.remaining()
+    if delay is None or (left is not None and left <= delay):
+        return await tracker.timed(fn)
+
+    tasks = [asyncio.ensure_future(tracker.timed(fn))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            HEDGED_REQUESTS_TOTAL.labels(call=name).inc()
+            tasks.append(asyncio.ensure_future(tracker.timed(fn)))
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+        # 全部失败时抛出首个请求的错误
+        return tasks[0].result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
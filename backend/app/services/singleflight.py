@@ -0,0 +1,53 @@
+"""
+请求合并 - 相同参数的并发调用共享一次上游请求
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from app.core.metrics import SINGLEFLIGHT_REQUESTS_TOTAL
+
+T = TypeVar("T")
+
+
+def make_key(**parts: Any) -> str:
+    """根据调用参数生成合并键"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    进程内请求合并
+
+    同一个键在执行期间的后续调用不再发起请求,而是等待第一个调用的结果
+    (包括异常)。上游调用在独立任务中执行,发起者被取消(如客户端断开)时
+    不影响其他等待者。仅在事件循环线程中使用。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """执行fn,若相同键的调用正在进行则共享其结果"""
+        task = self._calls.get(key)
+        if task is None:
+            SINGLEFLIGHT_REQUESTS_TOTAL.labels(group=self.name, result="leader").inc()
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            SINGLEFLIGHT_REQUESTS_TOTAL.labels(group=self.name, result="coalesced").inc()
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已取消时,避免"异常未被获取"的警告
+        if not task.cancelled():
+            task.exception()
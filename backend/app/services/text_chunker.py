@@ -0,0 +1,146 @@
+"""
+文本分块 - 按句子和段落边界切分,支持重叠和token预算
+"""
+import re
+from typing import Iterable, Iterator, List, Optional, Union
+
+from app.core.config import settings
+
+# 句子边界: 中英文句末标点(含其后的引号/括号)、英文句点后接空白、换行,连同其后的空白
+_BOUNDARY_RE = re.compile(r"(?:[。！？!?；;…]+[”’」』）)\"']*|\.(?=\s))\s*|\n\s*")
+
+# 段落结束: 句子以两个及以上换行结尾
+_PARAGRAPH_END_RE = re.compile(r"\n\s*\n\s*$")
+
+# CJK字符(每个字约计1个token)
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿　-〿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数: CJK字符按1个计,其余字符按每4个计1个"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _iter_sentences(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    从文本片段流中逐句产出
+
+    句末的空白保留在句子中,段落结束的句子以两个换行结尾。
+    """
+    pending = ""
+    for piece in pieces:
+        pending += piece
+        start = 0
+        for match in _BOUNDARY_RE.finditer(pending):
+            # 边界位于片段末尾时可能尚未完整(如空白或省略号被截断),留到下一片段
+            if match.end() == len(pending):
+                break
+            sentence = pending[start:match.end()]
+            start = match.end()
+            if sentence.strip():
+                yield sentence
+        pending = pending[start:]
+
+    if pending.strip():
+        yield pending
+
+
+def _hard_split(sentence: str, chunk_size: int, max_tokens: int = 0) -> List[str]:
+    """超长句子切开: 每段不超过 chunk_size 个字符,且估算token数不超过 max_tokens(0表示不限制)"""
+    if len(sentence) <= chunk_size and (not max_tokens or estimate_tokens(sentence) <= max_tokens):
+        return [sentence]
+
+    parts = []
+    start = cjk = other = 0
+    for i, char in enumerate(sentence):
+        is_cjk = bool(_CJK_RE.match(char))
+        # 与 estimate_tokens 的计算方式一致: CJK字符各计1个,其余字符每4个计1个
+        tokens = cjk + is_cjk + (other + (not is_cjk) + 3) // 4
+        if i > start and (i - start >= chunk_size or (max_tokens and tokens > max_tokens)):
+            parts.append(sentence[start:i])
+            start, cjk, other = i, 0, 0
+        if is_cjk:
+            cjk += 1
+        else:
+            other += 1
+    parts.append(sentence[start:])
+    return parts
+
+
+def iter_chunks(
+    text: Union[str, Iterable[str]],
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    按句子边界惰性切分文本
+
+    Args:
+        text: 文本,或文本片段的迭代器(如逐页提取的PDF文本)
+        chunk_size: 目标块大小(字符数)
+        overlap: 相邻块之间重叠的字符数(以整句为单位,不超过该值)
+        max_tokens: 单块token上限,0表示不限制
+
+    Yields:
+        文本块
+    """
+    chunk_size = chunk_size or settings.CHUNK_SIZE
+    overlap = settings.CHUNK_OVERLAP if overlap is None else overlap
+    max_tokens = settings.CHUNK_MAX_TOKENS if max_tokens is None else max_tokens
+    pieces = [text] if isinstance(text, str) else text
+
+    buffer: List[str] = []
+    buffer_chars = 0
+    buffer_tokens = 0
+
+    def flush() -> Optional[str]:
+        chunk = "".join(buffer).strip()
+        return chunk or None
+
+    def carry_overlap():
+        """保留末尾若干整句作为下一块的开头"""
+        nonlocal buffer, buffer_chars, buffer_tokens
+        kept: List[str] = []
+        kept_chars = 0
+        for sentence in reversed(buffer):
+            if kept_chars + len(sentence) > overlap:
+                break
+            kept.insert(0, sentence)
+            kept_chars += len(sentence)
+        buffer = kept
+        buffer_chars = kept_chars
+        buffer_tokens = sum(estimate_tokens(sentence) for sentence in kept)
+
+    for sentence in _iter_sentences(pieces):
+        for part in _hard_split(sentence, chunk_size, max_tokens):
+            part_tokens = estimate_tokens(part)
+            over_size = buffer_chars + len(part) > chunk_size
+            over_tokens = max_tokens and buffer_tokens + part_tokens > max_tokens
+            if buffer and (over_size or over_tokens):
+                chunk = flush()
+                if chunk:
+                    yield chunk
+                carry_overlap()
+                # 重叠部分加上新句子仍超限时放弃重叠
+                if buffer and (
+                    buffer_chars + len(part) > chunk_size
+                    or (max_tokens and buffer_tokens + part_tokens > max_tokens)
+                ):
+                    buffer, buffer_chars, buffer_tokens = [], 0, 0
+
+            buffer.append(part)
+            buffer_chars += len(part)
+            buffer_tokens += part_tokens
+
+        # 段落结束且当前块已过半时提前断开,不跨段落拼接
+        if buffer_chars >= chunk_size // 2 and _PARAGRAPH_END_RE.search(sentence):
+            chunk = flush()
+            if chunk:
+                yield chunk
+            buffer, buffer_chars, buffer_tokens = [], 0, 0
+
+    chunk = flush()
+    if chunk:
+        yield chunk
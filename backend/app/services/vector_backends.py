@@ -0,0 +1,539 @@
+"""
+向量存储后端 - Qdrant / 进程内NumPy索引
+"""
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from qdrant_client.models import (
+    Batch,
+    FieldCondition,
+    Filter,
+    FilterSelector,
+    MatchValue,
+    OverwritePayloadOperation,
+    PayloadSchemaType,
+    PointIdsList,
+    SetPayload,
+)
+from qdrant_client.http.exceptions import UnexpectedResponse
+from loguru import logger
+
+from app.core.config import settings
+from app.db.qdrant import ensure_collection, get_qdrant_client
+
+PointId = Union[int, str]
+
+# 共享集合中用于租户隔离和按文档删除的payload索引
+SHARED_COLLECTION_INDEXES = {
+    "property_id": PayloadSchemaType.INTEGER,
+    "document_id": PayloadSchemaType.INTEGER,
+}
+
+
+class VectorBackend:
+    """向量存储后端接口"""
+
+    def __init__(self, property_id: int):
+        self.property_id = property_id
+
+    async def init(self):
+        """初始化存储(创建集合、目录等)"""
+
+    async def upsert(self, ids: List[PointId], vectors: np.ndarray, payloads: List[Dict]):
+        """写入向量点,已存在的同ID点会被覆盖"""
+        raise NotImplementedError
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        limit: int,
+        score_threshold: float
+    ) -> List[Tuple[float, Dict]]:
+        """相似度检索,返回 [(得分, payload)] 按得分降序"""
+        raise NotImplementedError
+
+    async def delete_document(self, document_id: int):
+        """删除文档的所有向量点"""
+        raise NotImplementedError
+
+    async def get_document_manifest(self, document_id: int) -> Dict[PointId, Dict]:
+        """获取文档已存储的分块清单: {点ID: payload}(不含向量)"""
+        raise NotImplementedError
+
+    async def update_payloads(self, payloads: Dict[PointId, Dict]):
+        """覆盖已存在点的payload(向量不变)"""
+        raise NotImplementedError
+
+    async def delete_points(self, ids: List[PointId]):
+        """按ID删除向量点"""
+        raise NotImplementedError
+
+    async def list_points(self) -> Dict[PointId, Dict]:
+        """获取当前物业的全部点: {点ID: payload}(不含向量)"""
+        raise NotImplementedError
+
+
+class QdrantVectorBackend(VectorBackend):
+    """Qdrant 后端"""
+
+    def __init__(self, property_id: int):
+        super().__init__(property_id)
+        # shared模式下所有物业共用一个集合,通过property_id过滤实现租户隔离
+        self.shared_collection = settings.VECTOR_STORAGE_MODE == "shared"
+        if self.shared_collection:
+            self.collection_name = settings.VECTOR_COLLECTION_NAME
+        else:
+            self.collection_name = f"{settings.VECTOR_COLLECTION_NAME}_{property_id}"
+        # 使用进程级共享的Qdrant客户端
+        self.client = get_qdrant_client()
+
+    async def init(self):
+        if self.shared_collection:
+            await ensure_collection(
+                self.collection_name,
+                payload_indexes=SHARED_COLLECTION_INDEXES
+            )
+        else:
+            await ensure_collection(self.collection_name)
+
+    async def upsert(self, ids: List[PointId], vectors: np.ndarray, payloads: List[Dict]):
+        # 分批写入,限制单次请求体大小
+        batch_size = settings.QDRANT_UPSERT_BATCH_SIZE
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            await self.client.upsert(
+                collection_name=self.collection_name,
+                points=Batch(
+                    ids=ids[start:end],
+                    # 整个切片一次性转换,避免逐行 tolist()
+                    vectors=vectors[start:end].tolist(),
+                    payloads=payloads[start:end],
+                )
+            )
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        limit: int,
+        score_threshold: float
+    ) -> List[Tuple[float, Dict]]:
+        results = await self.client.search(
+            collection_name=self.collection_name,
+            query_vector=vector.tolist(),
+            query_filter=self._tenant_filter() if self.shared_collection else None,
+            limit=limit,
+            score_threshold=score_threshold
+        )
+        return [(result.score, result.payload) for result in results]
+
+    async def delete_document(self, document_id: int):
+        await self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=FilterSelector(
+                filter=self._tenant_filter(
+                    FieldCondition(key="document_id", match=MatchValue(value=document_id))
+                )
+            )
+        )
+
+    async def get_document_manifest(self, document_id: int) -> Dict[PointId, Dict]:
+        return await self._scroll_payloads(
+            self._tenant_filter(
+                FieldCondition(key="document_id", match=MatchValue(value=document_id))
+            )
+        )
+
+    async def list_points(self) -> Dict[PointId, Dict]:
+        try:
+            return await self._scroll_payloads(self._tenant_filter())
+        except UnexpectedResponse as e:
+            # 物业尚未上传过文档,集合不存在
+            if e.status_code == 404:
+                return {}
+            raise
+
+    async def _scroll_payloads(self, scroll_filter: Filter) -> Dict[PointId, Dict]:
+        """分页读取满足条件的点的payload"""
+        points = {}
+        offset = None
+        while True:
+            records, offset = await self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=settings.QDRANT_UPSERT_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            for record in records:
+                points[str(record.id)] = record.payload or {}
+            if offset is None:
+                return points
+
+    async def update_payloads(self, payloads: Dict[PointId, Dict]):
+        # 每个点的payload不同,用批量操作合并为少量请求,而不是每个点一次请求
+        operations = [
+            OverwritePayloadOperation(overwrite_payload=SetPayload(payload=payload, points=[point_id]))
+            for point_id, payload in payloads.items()
+        ]
+        batch_size = settings.QDRANT_UPSERT_BATCH_SIZE
+        for start in range(0, len(operations), batch_size):
+            await self.client.batch_update_points(
+                collection_name=self.collection_name,
+                update_operations=operations[start:start + batch_size],
+            )
+
+    async def delete_points(self, ids: List[PointId]):
+        batch_size = settings.QDRANT_UPSERT_BATCH_SIZE
+        for start in range(0, len(ids), batch_size):
+            await self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=ids[start:start + batch_size])
+            )
+
+    def _tenant_filter(self, *conditions: FieldCondition) -> Filter:
+        """构建限定当前物业的过滤条件"""
+        return Filter(
+            must=[
+                FieldCondition(key="property_id", match=MatchValue(value=self.property_id)),
+                *conditions,
+            ]
+        )
+
+
+class LocalVectorIndex:
+    """
+    单个物业的本地向量索引
+
+    向量以归一化 float32(或 int8 量化)追加写入内存映射文件,payload 逐行写入
+    points.jsonl,两者按行对齐。检索时用一次矩阵乘法计算全部余弦相似度。
+    写入时持有文件排他锁,读取时持有共享锁,支持同机多进程。
+
+    删除和覆盖时把两个文件完整写入新的版本目录,再原子替换 CURRENT 指向它,
+    中途崩溃时仍使用旧版本,不会出现两个文件行数不一致。
+    """
+
+    QUANT_SCALE = 127.0
+
+    def __init__(self, directory: Path, dim: int, quantize: bool):
+        self.directory = directory
+        self.dim = dim
+        self.quantize = quantize
+        self.dtype = np.int8 if quantize else np.float32
+        self.vectors_name = "vectors.i8" if quantize else "vectors.f32"
+        self.current_path = directory / "CURRENT"
+        self.lock_path = directory / ".lock"
+        self._version = ""  # 当前版本目录名,空表示数据文件直接位于索引目录(尚未重写过)
+
+        self.ids: List[PointId] = []
+        self.payloads: List[Dict] = []
+        self.matrix: np.ndarray = np.empty((0, dim), dtype=self.dtype)
+        self._signature: Optional[Tuple[str, int, int]] = None
+        self._points_size = 0  # points.jsonl 中完整行的字节数
+        self._mutex = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def data_dir(self) -> Path:
+        return self.directory / self._version if self._version else self.directory
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.data_dir / self.vectors_name
+
+    @property
+    def points_path(self) -> Path:
+        return self.data_dir / "points.jsonl"
+
+    def signature(self) -> Tuple[str, int, int]:
+        """数据文件的当前状态(版本、大小、修改时间),本机任何进程写入后都会变化;不加锁"""
+        version = self._read_version()
+        points_path = (self.directory / version if version else self.directory) / "points.jsonl"
+        try:
+            stat = os.stat(points_path)
+        except FileNotFoundError:
+            return version, 0, 0
+        return version, stat.st_size, stat.st_mtime_ns
+
+    def upsert(self, ids: List[PointId], vectors: np.ndarray, payloads: List[Dict]):
+        with self._mutex, self._file_lock(fcntl.LOCK_EX):
+            self._refresh()
+            # 覆盖已存在的点: 先移除旧行再追加
+            replaced = set(ids)
+            if any(point_id in replaced for point_id in self.ids):
+                self._rewrite([point_id not in replaced for point_id in self.ids])
+                self._refresh()
+
+            # 先序列化全部payload,序列化失败时不会留下没有对应行的向量
+            lines = "".join(
+                json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False) + "\n"
+                for point_id, payload in zip(ids, payloads)
+            ).encode("utf-8")
+            data = self._encode(vectors).tobytes()
+
+            # 截掉上次写入中断留下的尾部数据(多出的向量、不完整的payload行),保证追加后仍按行对齐
+            self._truncate(self.vectors_path, len(self.ids) * self.dim * np.dtype(self.dtype).itemsize)
+            self._truncate(self.points_path, self._points_size)
+
+            # 向量先于payload写入: payload行是提交标记,读取时只按payload行数映射向量
+            with open(self.vectors_path, "ab") as f:
+                f.write(data)
+            with open(self.points_path, "ab") as f:
+                f.write(lines)
+            self._refresh()
+
+    def search(self, vector: np.ndarray, limit: int, score_threshold: float) -> List[Tuple[float, Dict]]:
+        with self._mutex:
+            with self._file_lock(fcntl.LOCK_SH):
+                self._refresh()
+            matrix, payloads = self.matrix, self.payloads
+
+        if not payloads or limit <= 0:
+            return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query
+        if self.quantize:
+            scores = scores / self.QUANT_SCALE
+
+        k = min(limit, len(payloads))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (float(scores[i]), payloads[i])
+            for i in top
+            if scores[i] >= score_threshold
+        ]
+
+    def delete_where(self, key: str, value) -> int:
+        """删除 payload[key] == value 的点,返回删除数量"""
+        with self._mutex, self._file_lock(fcntl.LOCK_EX):
+            self._refresh()
+            keep = [payload.get(key) != value for payload in self.payloads]
+            removed = keep.count(False)
+            if removed:
+                self._rewrite(keep)
+                self._refresh()
+            return removed
+
+    def manifest_where(self, key: str, value) -> Dict[PointId, Dict]:
+        """返回 payload[key] == value 的 {点ID: payload}"""
+        with self._mutex:
+            with self._file_lock(fcntl.LOCK_SH):
+                self._refresh()
+            return {
+                point_id: payload
+                for point_id, payload in zip(self.ids, self.payloads)
+                if payload.get(key) == value
+            }
+
+    def all_points(self) -> Dict[PointId, Dict]:
+        """返回全部 {点ID: payload}"""
+        with self._mutex:
+            with self._file_lock(fcntl.LOCK_SH):
+                self._refresh()
+            return dict(zip(self.ids, self.payloads))
+
+    def update_payloads(self, payloads: Dict[PointId, Dict]):
+        """覆盖指定点的payload"""
+        with self._mutex, self._file_lock(fcntl.LOCK_EX):
+            self._refresh()
+            self.payloads = [
+                payloads.get(point_id, payload)
+                for point_id, payload in zip(self.ids, self.payloads)
+            ]
+            self._rewrite([True] * len(self.ids))
+            self._refresh()
+
+    def delete_ids(self, ids: List[PointId]) -> int:
+        """按ID删除点,返回删除数量"""
+        with self._mutex, self._file_lock(fcntl.LOCK_EX):
+            self._refresh()
+            removed_ids = set(ids)
+            keep = [point_id not in removed_ids for point_id in self.ids]
+            removed = keep.count(False)
+            if removed:
+                self._rewrite(keep)
+                self._refresh()
+            return removed
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """归一化并按存储格式编码"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        if self.quantize:
+            return np.clip(np.rint(vectors * self.QUANT_SCALE), -127, 127).astype(np.int8)
+        return vectors
+
+    def _rewrite(self, keep: List[bool]):
+        """压缩重写到新的版本目录,只保留 keep 为 True 的行,写完后原子切换 CURRENT"""
+        mask = np.array(keep, dtype=bool)
+        kept_vectors = np.ascontiguousarray(self.matrix[mask])
+
+        version = f"v{time.time_ns()}"
+        version_dir = self.directory / version
+        version_dir.mkdir()
+        with open(version_dir / self.vectors_name, "wb") as f:
+            f.write(kept_vectors.tobytes())
+            os.fsync(f.fileno())
+        with open(version_dir / "points.jsonl", "w", encoding="utf-8") as f:
+            for point_id, payload, kept in zip(self.ids, self.payloads, keep):
+                if kept:
+                    f.write(json.dumps({"id": point_id, "payload": payload}, ensure_ascii=False))
+                    f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        tmp_current = self.current_path.with_suffix(".tmp")
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        # 释放旧的内存映射后再切换版本;切换失败时下次访问重新加载旧版本
+        self._signature = None
+        self.matrix = np.empty((0, self.dim), dtype=self.dtype)
+        os.replace(tmp_current, self.current_path)
+        self._version = version
+        self._remove_stale_versions()
+
+    def _remove_stale_versions(self):
+        """删除当前版本以外的数据(旧版本、未完成切换的版本、重写前的根目录文件)"""
+        for entry in self.directory.iterdir():
+            if entry.is_dir() and entry.name.startswith("v") and entry.name != self._version:
+                shutil.rmtree(entry, ignore_errors=True)
+        for name in (self.vectors_name, "points.jsonl"):
+            (self.directory / name).unlink(missing_ok=True)
+
+    def _read_version(self) -> str:
+        try:
+            return self.current_path.read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return ""
+
+    def _refresh(self):
+        """文件被修改或切换了版本(本进程或其他进程)时重新加载"""
+        self._version = self._read_version()
+        try:
+            stat = os.stat(self.points_path)
+            signature = (self._version, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature:
+            return
+
+        ids, payloads = [], []
+        points_size = 0
+        if signature is not None:
+            with open(self.points_path, "rb") as f:
+                for line in f:
+                    # 没有换行符的尾行是尚未写完(或写入中断)的数据,忽略
+                    if not line.endswith(b"\n"):
+                        break
+                    points_size += len(line)
+                    if line.strip():
+                        record = json.loads(line)
+                        ids.append(record["id"])
+                        payloads.append(record["payload"])
+
+        if ids:
+            # 按行数映射,忽略尚未写完的尾部数据
+            matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(len(ids), self.dim))
+        else:
+            matrix = np.empty((0, self.dim), dtype=self.dtype)
+
+        self.ids, self.payloads, self.matrix = ids, payloads, matrix
+        self._points_size = points_size
+        self._signature = signature
+
+    @staticmethod
+    def _truncate(path: Path, size: int):
+        """文件超过 size 字节时截断(只在持有排他锁时调用)"""
+        try:
+            if os.path.getsize(path) > size:
+                os.truncate(path, size)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _file_lock(self, operation: int):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# 每个物业的本地索引(进程内共享)
+_local_indexes: Dict[int, LocalVectorIndex] = {}
+
+
+def get_local_index(property_id: int) -> LocalVectorIndex:
+    """获取物业的本地向量索引"""
+    index = _local_indexes.get(property_id)
+    if index is None:
+        index = LocalVectorIndex(
+            directory=Path(settings.VECTOR_LOCAL_DIR) / str(property_id),
+            dim=settings.LOCAL_EMBEDDING_DIM,
+            quantize=settings.VECTOR_LOCAL_QUANTIZE,
+        )
+        _local_indexes[property_id] = index
+    return index
+
+
+class NumpyVectorBackend(VectorBackend):
+    """
+    进程内NumPy后端
+
+    适用于分块数量较少的物业和离线部署,不依赖外部向量数据库。
+    """
+
+    def __init__(self, property_id: int):
+        super().__init__(property_id)
+        self.index = get_local_index(property_id)
+
+    async def upsert(self, ids: List[PointId], vectors: np.ndarray, payloads: List[Dict]):
+        await asyncio.to_thread(self.index.upsert, ids, vectors, payloads)
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        limit: int,
+        score_threshold: float
+    ) -> List[Tuple[float, Dict]]:
+        return await asyncio.to_thread(self.index.search, vector, limit, score_threshold)
+
+    async def delete_document(self, document_id: int):
+        removed = await asyncio.to_thread(self.index.delete_where, "document_id", document_id)
+        logger.debug(f"本地向量索引删除: property_id={self.property_id}, points={removed}")
+
+    async def get_document_manifest(self, document_id: int) -> Dict[PointId, Dict]:
+        return await asyncio.to_thread(self.index.manifest_where, "document_id", document_id)
+
+    async def update_payloads(self, payloads: Dict[PointId, Dict]):
+        await asyncio.to_thread(self.index.update_payloads, payloads)
+
+    async def delete_points(self, ids: List[PointId]):
+        await asyncio.to_thread(self.index.delete_ids, ids)
+
+    async def list_points(self) -> Dict[PointId, Dict]:
+        return await asyncio.to_thread(self.index.all_points)
+
+
+def get_vector_backend(property_id: int) -> VectorBackend:
+    """根据配置创建向量存储后端"""
+    if settings.VECTOR_BACKEND == "numpy":
+        return NumpyVectorBackend(property_id)
+    return QdrantVectorBackend(property_id)
@@ -1,44 +1,150 @@
 """
 向量存储服务 - 用于RAG检索
 """
-from typing import List, Dict, Optional
-from qdrant_client import AsyncQdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+import asyncio
+import hashlib
+import re
+import time
+import unicodedata
+import uuid
+from typing import List, Dict, Hashable, Optional, Set
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from loguru import logger
 
 from app.core.config import settings
+from app.db.redis import get_redis
+from app.services.answer_cache import invalidate_document_answers
+from app.services.cache import TTLLRUCache
+from app.services.embedding import embedding_batcher, get_encoder
+from app.services.lexical_index import (
+    LexicalIndex,
+    get_lexical_index,
+    is_index_fresh,
+    reciprocal_rank_fusion,
+    replace_lexical_index,
+)
+from app.services.text_chunker import iter_chunks
+from app.services.vector_backends import get_local_index, get_vector_backend
+
+# 点ID命名空间(uuid5)
+POINT_ID_NAMESPACE = uuid.UUID("6f1c1b52-4c1e-5a8e-9d2b-7a0f3e9c2d41")
+
+# 查询向量缓存: 规范化后的查询文本 -> 向量
+query_embedding_cache = TTLLRUCache(
+    "query_embedding",
+    maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE,
+    ttl=settings.QUERY_EMBEDDING_CACHE_TTL,
+)
+
+# 分块向量缓存: 分块内容哈希(已包含模型名和标题) -> 向量,供只被关键词命中的分块计算余弦相似度
+chunk_embedding_cache = TTLLRUCache(
+    "chunk_embedding",
+    maxsize=settings.CHUNK_EMBEDDING_CACHE_SIZE,
+    ttl=settings.CHUNK_EMBEDDING_CACHE_TTL,
+)
+
+# 检索结果缓存: (物业ID, 数据版本, 向量哈希, limit, 阈值) -> 结果列表
+search_result_cache = TTLLRUCache(
+    "search_result",
+    maxsize=settings.SEARCH_RESULT_CACHE_SIZE,
+    ttl=settings.SEARCH_RESULT_CACHE_TTL,
+)
+
+# 倒排索引全量加载锁,避免并发请求重复加载
+_lexical_load_locks: Dict[int, asyncio.Lock] = {}
+
+
+# 每个物业的进程内数据版本号,文档增删时与Redis中的版本号一起递增
+_local_generations: Dict[int, int] = {}
+
+# Redis不可用时退回的进程内版本号的标记,这种版本号感知不到其他进程的写入
+_PROCESS_GENERATION = "process"
+
+# 访问Redis失败后,在此时间点之前直接使用进程内版本号,不再逐次等待超时
+_redis_retry_at = 0.0
+
+
+def _generation_key(property_id: int) -> str:
+    return f"vector:{property_id}:generation"
+
+
+def _redis_failed(e: Exception):
+    global _redis_retry_at
+    logger.warning(f"访问Redis中的向量数据版本号失败,暂时使用进程内版本号: {str(e)}")
+    _redis_retry_at = time.monotonic() + settings.GENERATION_REDIS_BACKOFF
+
+
+async def get_generation(property_id: int) -> Hashable:
+    """
+    获取物业向量数据的版本号(只用于比较是否变化),使旧的检索结果缓存和答案缓存失效
+    
+    - 本地向量后端: 由进程内版本号和索引文件状态得出,不访问Redis,同机其他进程的写入也能感知
+    - Qdrant后端: 使用Redis中的版本号,所有工作进程共享;Redis不可用时退回进程内版本号
+      (只感知本进程的写入),并在 GENERATION_REDIS_BACKOFF 秒内不再访问Redis
+    """
+    local = _local_generations.get(property_id, 0)
+    if settings.VECTOR_BACKEND == "numpy":
+        return ("local", local) + get_local_index(property_id).signature()
+    if time.monotonic() < _redis_retry_at:
+        return (_PROCESS_GENERATION, local)
+    try:
+        value = await get_redis().get(_generation_key(property_id))
+    except Exception as e:
+        _redis_failed(e)
+        return (_PROCESS_GENERATION, local)
+    return int(value or 0)
+
+
+async def bump_generation(property_id: int) -> Hashable:
+    """递增物业向量数据的版本号,返回递增后的版本号"""
+    local = _local_generations[property_id] = _local_generations.get(property_id, 0) + 1
+    if settings.VECTOR_BACKEND == "numpy":
+        return await get_generation(property_id)
+    try:
+        return await get_redis().incr(_generation_key(property_id))
+    except Exception as e:
+        # Redis中的版本号未变,本进程按该版本号缓存的检索结果需要直接清除
+        _redis_failed(e)
+        search_result_cache.clear()
+        return (_PROCESS_GENERATION, local)
+
+
+def is_process_generation(generation: Hashable) -> bool:
+    """是否为Redis不可用时退回的进程内版本号"""
+    return isinstance(generation, tuple) and generation[0] == _PROCESS_GENERATION
+
+
+def _is_next_generation(before: Hashable, after: Hashable) -> bool:
+    """after 是否紧接在 before 之后(期间没有其他写入);本地后端无法判断,返回 False"""
+    if isinstance(before, int) and isinstance(after, int):
+        return after == before + 1
+    if is_process_generation(before) and is_process_generation(after):
+        return after[1] == before[1] + 1
+    return False
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询文本(全角转半角、去除多余空白、小写)"""
+    query = unicodedata.normalize("NFKC", query)
+    return re.sub(r"\s+", " ", query).strip().lower()
 
 
 class VectorStoreService:
     """向量存储服务类"""
     
-    def __init__(self, property_id: int):
+    def __init__(self, property_id: int, encoder: Optional[SentenceTransformer] = None):
         self.property_id = property_id
-        self.collection_name = f"{settings.VECTOR_COLLECTION_NAME}_{property_id}"
-        self.client = AsyncQdrantClient(
-            url=settings.QDRANT_URL,
-            api_key=settings.QDRANT_API_KEY if settings.QDRANT_API_KEY else None
-        )
-        self.encoder = SentenceTransformer(
-            'paraphrase-multilingual-MiniLM-L12-v2'  # 支持中文的模型
-        )
+        # 存储后端由 VECTOR_BACKEND 配置决定(qdrant/numpy)
+        self.backend = get_vector_backend(property_id)
+        # 未指定编码器时使用进程级共享的编码器,在工作线程中按需获取:
+        # 模型未预热时首次加载也不会阻塞事件循环
+        self.encoder = encoder
     
     async def init_collection(self):
         """初始化集合"""
         try:
-            collections = await self.client.get_collections()
-            collection_names = [col.name for col in collections.collections]
-            
-            if self.collection_name not in collection_names:
-                await self.client.create_collection(
-                    collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=384,  # MiniLM模型的向量维度
-                        distance=Distance.COSINE
-                    )
-                )
-                logger.info(f"创建向量集合: {self.collection_name}")
+            await self.backend.init()
         
         except Exception as e:
             logger.error(f"初始化集合错误: {str(e)}")
@@ -59,52 +165,121 @@ class VectorStoreService:
             content: 文档内容
             metadata: 额外的元数据
         """
+        lexical_index = None  # 已增量更新的倒排索引
         try:
             await self.init_collection()
+            generation = await get_generation(self.property_id)
             
-            # 分块处理长文档
-            chunks = self._split_text(content)
-            
-            points = []
-            for i, chunk in enumerate(chunks):
-                # 生成向量
+            # 按句子边界分块,以 (文档ID, 分块内容哈希) 生成确定性的点ID,内容不变的分块ID也不变
+            entries: Dict[str, tuple] = {}
+            for i, chunk in enumerate(iter_chunks(content)):
                 text = f"{title}\n\n{chunk}"
-                vector = self.encoder.encode(text).tolist()
+                chunk_hash = self._chunk_hash(text)
+                point_id = self._point_id(document_id, chunk_hash)
+                if point_id in entries:
+                    continue  # 文档内完全重复的分块只存一份
                 
-                # 创建点
-                point_id = f"{document_id}_{i}"
-                payload = {
+                # 元数据在前,保证 property_id 等关键字段不会被覆盖
+                payload = dict(metadata or {})
+                payload.update({
                     "document_id": document_id,
                     "title": title,
                     "content": chunk,
                     "chunk_index": i,
+                    "chunk_hash": chunk_hash,
                     "property_id": self.property_id,
-                }
-                if metadata:
-                    payload.update(metadata)
-                
-                points.append(PointStruct(
-                    id=point_id,
-                    vector=vector,
-                    payload=payload
-                ))
+                })
+                entries[point_id] = (text, payload)
             
-            # 批量插入
-            await self.client.upsert(
-                collection_name=self.collection_name,
-                points=points
-            )
+            # 对比已存储的分块清单,只处理变化的部分
+            manifest = await self.backend.get_document_manifest(document_id)
+            new_ids = [point_id for point_id in entries if point_id not in manifest]
+            stale_ids = [point_id for point_id in manifest if point_id not in entries]
+            changed_payloads = {
+                point_id: entry[1]
+                for point_id, entry in entries.items()
+                if point_id in manifest and manifest[point_id] != entry[1]
+            }
+            
+            if new_ids:
+                # 批量生成向量(一次前向计算处理多个分块)
+                vectors = await self.encode_batch([entries[point_id][0] for point_id in new_ids])
+                await self.backend.upsert(
+                    new_ids,
+                    vectors,
+                    [entries[point_id][1] for point_id in new_ids]
+                )
+            if changed_payloads:
+                await self.backend.update_payloads(changed_payloads)
+            # 先写入新分块再删除旧分块,避免检索出现空窗
+            if stale_ids:
+                await self.backend.delete_points(stale_ids)
+            
+            # 倒排索引与写入前的数据一致时增量更新,否则在下次检索时从向量库全量重建
+            index = get_lexical_index(self.property_id)
+            if index.loaded_at and index.generation == generation:
+                for point_id in new_ids + list(changed_payloads):
+                    index.add(point_id, entries[point_id][1])
+                index.remove(stale_ids)
+                lexical_index = index
             
-            logger.info(f"添加文档到向量库: document_id={document_id}, chunks={len(chunks)}")
+            logger.info(
+                f"添加文档到向量库: document_id={document_id}, chunks={len(entries)}, "
+                f"embedded={len(new_ids)}, removed={len(stale_ids)}"
+            )
         
         except Exception as e:
             logger.error(f"添加文档到向量库错误: {str(e)}")
+        
+        finally:
+            new_generation = await bump_generation(self.property_id)
+            if lexical_index is not None and _is_next_generation(generation, new_generation):
+                lexical_index.generation = new_generation
+            invalidate_document_answers(self.property_id, document_id)
+    
+    async def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        批量生成向量
+        
+        Args:
+            texts: 文本列表
+        
+        Returns:
+            形状为 (len(texts), dim) 的 float32 矩阵
+        """
+        # 模型推理是CPU密集型操作,放到线程中执行以免阻塞事件循环
+        return await asyncio.to_thread(
+            lambda: (self.encoder or get_encoder()).encode(
+                texts,
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        )
+    
+    async def encode_query(self, query: str) -> np.ndarray:
+        """
+        生成查询向量
+        
+        使用共享编码器时先查缓存,未命中再通过微批处理调度器与其他并发查询合并推理。
+        """
+        if self.encoder is None:
+            cache_key = (settings.LOCAL_EMBEDDING_MODEL, normalize_query(query))
+            vector = query_embedding_cache.get(cache_key)
+            if vector is None:
+                vector = await embedding_batcher.encode(query)
+                query_embedding_cache.set(cache_key, vector)
+            return vector
+        return await asyncio.to_thread(
+            self.encoder.encode, query, convert_to_numpy=True, show_progress_bar=False
+        )
     
     async def search(
         self,
         query: str,
         limit: int = 5,
-        score_threshold: float = 0.5
+        score_threshold: float = 0.5,
+        hybrid: Optional[bool] = None
     ) -> List[Dict]:
         """
         搜索相关文档
@@ -112,76 +287,207 @@ class VectorStoreService:
         Args:
             query: 查询文本
             limit: 返回结果数量
-            score_threshold: 相似度阈值
+            score_threshold: 相似度阈值(仅作用于向量检索)
+            hybrid: 是否融合关键词检索结果,默认取 HYBRID_SEARCH_ENABLED
         
         Returns:
             相关文档列表
         """
+        if hybrid is None:
+            hybrid = settings.HYBRID_SEARCH_ENABLED
+        
         try:
             # 生成查询向量
-            query_vector = self.encoder.encode(query).tolist()
+            query_vector = await self.encode_query(query)
             
-            # 搜索
-            results = await self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_vector,
-                limit=limit,
-                score_threshold=score_threshold
+            # 命中检索结果缓存时直接返回
+            generation = await get_generation(self.property_id)
+            cache_key = (
+                self.property_id,
+                generation,
+                hashlib.blake2b(query_vector.tobytes(), digest_size=16).digest(),
+                limit,
+                score_threshold,
+                hybrid,
             )
+            cached = search_result_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+            
+            if hybrid:
+                results = await self._hybrid_search(query, query_vector, limit, score_threshold)
+            else:
+                results = await self.backend.search(
+                    query_vector,
+                    limit=limit,
+                    score_threshold=score_threshold
+                )
             
             # 格式化结果
             documents = []
-            for result in results:
+            for score, payload in results:
                 documents.append({
-                    "id": result.payload["document_id"],
-                    "title": result.payload["title"],
-                    "content": result.payload["content"],
-                    "score": result.score,
+                    "id": payload["document_id"],
+                    "title": payload["title"],
+                    "content": payload["content"],
+                    "score": score,
                 })
             
-            return documents
+            search_result_cache.set(cache_key, documents)
+            return list(documents)
         
         except Exception as e:
             logger.error(f"搜索向量库错误: {str(e)}")
             return []
     
-    async def delete_document(self, document_id: int):
-        """删除文档"""
-        try:
-            await self.client.delete(
-                collection_name=self.collection_name,
-                points_selector={
-                    "filter": {
-                        "must": [
-                            {
-                                "key": "document_id",
-                                "match": {"value": document_id}
-                            }
-                        ]
-                    }
-                }
-            )
-            logger.info(f"从向量库删除文档: document_id={document_id}")
+    async def _hybrid_search(
+        self,
+        query: str,
+        query_vector: np.ndarray,
+        limit: int,
+        score_threshold: float
+    ) -> List[tuple]:
+        """
+        混合检索: 向量检索和关键词检索并行,各取两倍候选后做倒数排名融合
         
-        except Exception as e:
-            logger.error(f"删除向量库文档错误: {str(e)}")
-    
-    def _split_text(self, text: str, chunk_size: int = 500) -> List[str]:
+        融合得分只用于排序,返回的得分仍为余弦相似度。只被关键词检索命中的分块
+        需要归一化BM25得分达到 LEXICAL_MIN_SCORE(避免只共享"物业"等常见词的分块进入上下文),
+        其余弦相似度单独计算,同样需要达到 score_threshold。
+        
+        Returns:
+            [(余弦相似度, payload)] 按融合得分降序
         """
-        分割文本为块
+        vector_results, lexical_results = await asyncio.gather(
+            self.backend.search(
+                query_vector,
+                limit=limit * 2,
+                score_threshold=score_threshold
+            ),
+            self.lexical_search(query, limit=limit * 2),
+        )
+        cosine = {self._result_key(payload): score for score, payload in vector_results}
+        fused = reciprocal_rank_fusion(
+            [
+                [(self._result_key(payload), (score, payload)) for score, payload in vector_results],
+                [(self._result_key(payload), (score, payload)) for score, payload in lexical_results],
+            ],
+            limit=limit * 4,
+        )
         
-        Args:
-            text: 原始文本
-            chunk_size: 每块的大小(字符数)
+        results = []
+        lexical_only = []
+        for _, (score, payload) in fused:
+            key = self._result_key(payload)
+            if key in cosine:
+                results.append([cosine[key], payload])
+            elif score >= settings.LEXICAL_MIN_SCORE:
+                results.append([None, payload])
+                lexical_only.append(results[-1])
+        
+        if lexical_only:
+            vectors = await self._chunk_vectors([payload for _, payload in lexical_only])
+            query_norm = query_vector / (np.linalg.norm(query_vector) or 1.0)
+            for item, vector in zip(lexical_only, vectors):
+                item[0] = float(np.dot(vector, query_norm) / (np.linalg.norm(vector) or 1.0))
+        return [tuple(item) for item in results if item[0] >= score_threshold][:limit]
+    
+    async def _chunk_vectors(self, payloads: List[Dict]) -> List[np.ndarray]:
+        """分块向量(与入库时相同的"标题+分块"文本),共享编码器时按分块内容哈希缓存"""
+        cacheable = self.encoder is None
+        vectors = [
+            chunk_embedding_cache.get(payload.get("chunk_hash")) if cacheable and payload.get("chunk_hash") else None
+            for payload in payloads
+        ]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = await self.encode_batch(
+                [f"{payloads[i].get('title', '')}\n\n{payloads[i]['content']}" for i in missing]
+            )
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                if cacheable and payloads[i].get("chunk_hash"):
+                    chunk_embedding_cache.set(payloads[i]["chunk_hash"], vector)
+        return vectors
+    
+    async def lexical_search(self, query: str, limit: int = 5) -> List[tuple]:
+        """
+        关键词检索(BM25)
         
         Returns:
-            文本块列表
+            [(归一化得分, payload)] 按得分降序
         """
-        if len(text) <= chunk_size:
-            return [text]
+        index = await self._get_lexical_index()
+        return index.search(query, limit)
+    
+    async def lexical_candidates(self, query: str) -> Optional[Set[int]]:
+        """包含查询全部词项的文档ID(子串匹配的预筛选),无法预筛选时返回 None"""
+        index = await self._get_lexical_index()
+        return index.documents_matching_all(query)
+    
+    async def _get_lexical_index(self) -> LexicalIndex:
+        """获取倒排索引,未加载或向量数据版本号已变化时从向量库全量重建"""
+        generation = await get_generation(self.property_id)
+        check_ttl = is_process_generation(generation)
+        index = get_lexical_index(self.property_id)
+        if is_index_fresh(index, generation, check_ttl):
+            return index
         
-        chunks = []
-        for i in range(0, len(text), chunk_size):
-            chunks.append(text[i:i + chunk_size])
+        lock = _lexical_load_locks.setdefault(self.property_id, asyncio.Lock())
+        async with lock:
+            index = get_lexical_index(self.property_id)
+            if is_index_fresh(index, generation, check_ttl):
+                return index
+            
+            started = time.perf_counter()
+            points = await self.backend.list_points()
+            rebuilt = LexicalIndex()
+            for point_id, payload in points.items():
+                rebuilt.add(point_id, payload)
+            # 记录加载前读取的版本号,加载期间发生的写入会在下次检索时触发重建
+            rebuilt.loaded_at = time.monotonic()
+            rebuilt.generation = generation
+            # 整体替换,检索过程中不会看到半成品索引
+            replace_lexical_index(self.property_id, rebuilt)
+            logger.info(
+                f"加载倒排索引: property_id={self.property_id}, chunks={len(rebuilt)}, "
+                f"耗时={time.perf_counter() - started:.2f}s"
+            )
+            return rebuilt
+    
+    async def delete_document(self, document_id: int):
+        """删除文档"""
+        lexical_index = None  # 已增量更新的倒排索引
+        try:
+            generation = await get_generation(self.property_id)
+            await self.backend.delete_document(document_id)
+            index = get_lexical_index(self.property_id)
+            index.remove_document(document_id)
+            if index.loaded_at and index.generation == generation:
+                lexical_index = index
+            logger.info(f"从向量库删除文档: document_id={document_id}")
         
-        return chunks
+        except Exception as e:
+            logger.error(f"删除向量库文档错误: {str(e)}")
+        
+        finally:
+            new_generation = await bump_generation(self.property_id)
+            if lexical_index is not None and _is_next_generation(generation, new_generation):
+                lexical_index.generation = new_generation
+            invalidate_document_answers(self.property_id, document_id)
+    
+    @staticmethod
+    def _result_key(payload: Dict) -> tuple:
+        """检索结果去重键"""
+        return (payload.get("document_id"), payload.get("chunk_hash") or payload.get("chunk_index"))
+    
+    @staticmethod
+    def _chunk_hash(text: str) -> str:
+        """分块内容哈希(包含模型名,更换模型后会全部重新向量化)"""
+        digest = hashlib.sha256(settings.LOCAL_EMBEDDING_MODEL.encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()[:32]
+    
+    @staticmethod
+    def _point_id(document_id: int, chunk_hash: str) -> str:
+        """由文档ID和分块哈希生成确定性的UUID点ID"""
+        return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{document_id}:{chunk_hash}"))
@@ -0,0 +1,127 @@
+"""
+基准测试: 句子感知分块 vs 旧的固定500字符切分
+
+对比分块数量、平均长度,以及在样例问答上的检索命中率(hit@k)。
+
+用法(在 backend 目录下执行):
+    python -m benchmarks.bench_chunker [--corpus-dir ./samples] [--k 3]
+
+不指定 --corpus-dir 时使用内置的样例文档;指定时读取目录下所有 .txt 文件,
+问答对需放在同目录的 questions.tsv 中(每行: 问题<TAB>答案中必须出现的关键词)。
+"""
+import argparse
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.services.embedding import get_encoder
+from app.services.text_chunker import estimate_tokens, iter_chunks
+
+SAMPLE_DOCS = {
+    "物业服务收费管理办法": (
+        "第一章 总则\n\n"
+        "第一条 为规范本小区物业服务收费行为,保障业主和物业服务企业的合法权益,制定本办法。"
+        "第二条 物业服务费按房屋建筑面积计收,住宅每月每平方米2.5元,商铺每月每平方米4元。\n\n"
+        "第二章 缴费方式\n\n"
+        "第三条 业主可通过微信、支付宝或物业服务中心前台缴纳物业费。物业费按季度预交,每季度首月15日前缴清。"
+        "第四条 逾期未缴纳的,自逾期之日起按日加收应缴金额万分之五的滞纳金。"
+        "连续六个月未缴纳的,物业服务企业可依法申请支付令。\n\n"
+        "第三章 停车管理\n\n"
+        "第五条 地下车位月租费300元,地面车位月租费200元。临时停车前两小时免费,超过两小时每小时收费5元,"
+        "二十四小时内最高收费30元。第六条 新能源车辆充电桩电费按0.8元每度另行收取。\n\n"
+    ),
+    "装修管理规定": (
+        "业主装修前须到物业服务中心办理装修登记手续,提交装修方案并缴纳装修押金2000元。"
+        "装修施工时间为工作日上午8:00至12:00、下午14:00至18:00,节假日禁止进行产生噪音的施工。"
+        "装修垃圾须袋装后运至指定地点,清运费每户500元。严禁拆改承重墙、梁、柱及改变外立面。\n\n"
+        "装修完成后,经物业验收合格,押金在30日内无息退还。"
+    ),
+    "电梯与消防安全须知": (
+        "电梯每月由专业维保单位检修一次,检修期间将提前在单元门口张贴通知。"
+        "如遇电梯困人,请按下电梯内的紧急呼叫按钮,值班人员将在5分钟内到达。"
+        "楼道及消防通道严禁堆放杂物,电动自行车禁止进入楼道充电。"
+        "小区每年11月组织一次消防演练,请业主积极参加。"
+    ),
+}
+
+SAMPLE_QUESTIONS = [
+    ("物业费怎么交", "微信"),
+    ("物业费每平米多少钱", "2.5元"),
+    ("物业费逾期有滞纳金吗", "万分之五"),
+    ("停车费多少", "300元"),
+    ("临时停车怎么收费", "两小时免费"),
+    ("充电桩电费", "0.8元"),
+    ("装修押金多少", "2000元"),
+    ("周末可以装修吗", "节假日禁止"),
+    ("装修押金什么时候退", "30日内"),
+    ("电梯困人怎么办", "紧急呼叫"),
+    ("电动车能在楼道充电吗", "禁止进入楼道充电"),
+    ("消防演练什么时候", "11月"),
+]
+
+
+def legacy_split(text: str, chunk_size: int = 500) -> List[str]:
+    """旧的固定长度切分"""
+    if len(text) <= chunk_size:
+        return [text]
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+def load_corpus(corpus_dir: str) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+    if not corpus_dir:
+        return SAMPLE_DOCS, SAMPLE_QUESTIONS
+    directory = Path(corpus_dir)
+    docs = {path.stem: path.read_text(encoding="utf-8") for path in directory.glob("*.txt")}
+    questions = []
+    for line in (directory / "questions.tsv").read_text(encoding="utf-8").splitlines():
+        if "\t" in line:
+            question, keyword = line.split("\t", 1)
+            questions.append((question.strip(), keyword.strip()))
+    return docs, questions
+
+
+def evaluate(name, docs, questions, splitter, encoder, k):
+    chunks = []
+    for title, text in docs.items():
+        for chunk in splitter(text):
+            chunks.append((title, chunk))
+
+    texts = [f"{title}\n\n{chunk}" for title, chunk in chunks]
+    matrix = encoder.encode(texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    queries = encoder.encode(
+        [question for question, _ in questions],
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+
+    hits = 0
+    context_tokens = 0
+    for (_, keyword), query in zip(questions, queries):
+        top = np.argsort(-(matrix @ query))[:k]
+        hits += any(keyword in chunks[i][1] for i in top)
+        context_tokens += sum(estimate_tokens(chunks[i][1]) for i in top)
+
+    lengths = [len(chunk) for _, chunk in chunks]
+    print(
+        f"{name:10s} 分块数={len(chunks):4d}  平均长度={np.mean(lengths):6.1f}  "
+        f"hit@{k}={hits / len(questions):.2%}  平均上下文token={context_tokens / len(questions):6.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本分块对比")
+    parser.add_argument("--corpus-dir", default="")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    docs, questions = load_corpus(args.corpus_dir)
+    encoder = get_encoder()
+    print(f"文档数={len(docs)}, 问题数={len(questions)}")
+    evaluate("固定500字", docs, questions, legacy_split, encoder, args.k)
+    evaluate("句子分块", docs, questions, iter_chunks, encoder, args.k)
+
+
+if __name__ == "__main__":
+    main()
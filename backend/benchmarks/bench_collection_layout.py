@@ -0,0 +1,143 @@
+"""
+基准测试: 每物业一个集合 vs 共享集合(按 property_id 过滤)
+
+需要一个可用的 Qdrant 实例(QDRANT_URL)。测试会创建以 bench_ 开头的集合,结束后删除。
+
+用法(在 backend 目录下执行):
+    python -m benchmarks.bench_collection_layout --tenants 1000 --points-per-tenant 50 --queries 2000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+import numpy as np
+from qdrant_client.models import Batch, FieldCondition, Filter, MatchValue, PayloadSchemaType
+
+from app.core.config import settings
+from app.db.qdrant import close_qdrant_client, ensure_collection, forget_collection, get_qdrant_client
+
+PER_PROPERTY_PREFIX = "bench_property_"
+SHARED_COLLECTION = "bench_shared"
+
+
+def random_vectors(count: int, dim: int) -> np.ndarray:
+    vectors = np.random.randn(count, dim).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+async def qdrant_memory_mb() -> str:
+    """读取Qdrant常驻内存(依赖服务端 /metrics 暴露 memory_resident_bytes)"""
+    try:
+        async with httpx.AsyncClient(timeout=5) as http:
+            response = await http.get(f"{settings.QDRANT_URL}/metrics")
+        for line in response.text.splitlines():
+            if line.startswith("memory_resident_bytes"):
+                return f"{float(line.split()[-1]) / 1024 / 1024:.0f}MB"
+    except Exception:
+        pass
+    return "n/a"
+
+
+async def load_per_property(tenants: int, points: int, dim: int):
+    client = get_qdrant_client()
+    for tenant in range(tenants):
+        name = f"{PER_PROPERTY_PREFIX}{tenant}"
+        await ensure_collection(name)
+        await client.upsert(
+            collection_name=name,
+            points=Batch(
+                ids=list(range(points)),
+                vectors=random_vectors(points, dim).tolist(),
+                payloads=[{"property_id": tenant} for _ in range(points)],
+            ),
+        )
+
+
+async def load_shared(tenants: int, points: int, dim: int):
+    client = get_qdrant_client()
+    await ensure_collection(
+        SHARED_COLLECTION,
+        payload_indexes={"property_id": PayloadSchemaType.INTEGER},
+    )
+    for tenant in range(tenants):
+        await client.upsert(
+            collection_name=SHARED_COLLECTION,
+            points=Batch(
+                ids=[tenant * points + i for i in range(points)],
+                vectors=random_vectors(points, dim).tolist(),
+                payloads=[{"property_id": tenant} for _ in range(points)],
+            ),
+        )
+
+
+async def measure(search, tenants: int, queries: int, dim: int, concurrency: int):
+    """并发执行查询并返回每次查询的耗时(毫秒)"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    query_vectors = random_vectors(queries, dim)
+
+    async def run(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await search(random.randrange(tenants), query_vectors[i].tolist())
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(run(i) for i in range(queries)))
+    return np.array(latencies)
+
+
+def report(name: str, latencies: np.ndarray, memory: str):
+    print(
+        f"{name:14s} p50={np.percentile(latencies, 50):7.2f}ms  "
+        f"p99={np.percentile(latencies, 99):7.2f}ms  qdrant_rss={memory}"
+    )
+
+
+async def main(args):
+    client = get_qdrant_client()
+    dim = settings.LOCAL_EMBEDDING_DIM
+
+    async def search_per_property(tenant, vector):
+        await client.search(collection_name=f"{PER_PROPERTY_PREFIX}{tenant}", query_vector=vector, limit=5)
+
+    async def search_shared(tenant, vector):
+        await client.search(
+            collection_name=SHARED_COLLECTION,
+            query_vector=vector,
+            query_filter=Filter(must=[FieldCondition(key="property_id", match=MatchValue(value=tenant))]),
+            limit=5,
+        )
+
+    print(f"tenants={args.tenants}, points/tenant={args.points_per_tenant}, queries={args.queries}")
+    baseline = await qdrant_memory_mb()
+    print(f"初始 qdrant_rss={baseline}")
+
+    try:
+        await load_per_property(args.tenants, args.points_per_tenant, dim)
+        latencies = await measure(search_per_property, args.tenants, args.queries, dim, args.concurrency)
+        report("per_property", latencies, await qdrant_memory_mb())
+    finally:
+        for tenant in range(args.tenants):
+            await client.delete_collection(f"{PER_PROPERTY_PREFIX}{tenant}")
+            forget_collection(f"{PER_PROPERTY_PREFIX}{tenant}")
+
+    try:
+        await load_shared(args.tenants, args.points_per_tenant, dim)
+        latencies = await measure(search_shared, args.tenants, args.queries, dim, args.concurrency)
+        report("shared", latencies, await qdrant_memory_mb())
+    finally:
+        await client.delete_collection(SHARED_COLLECTION)
+        forget_collection(SHARED_COLLECTION)
+
+    await close_qdrant_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="向量集合布局基准测试")
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--points-per-tenant", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+"""
+基准测试: 逐块向量化 vs 批量向量化
+
+用法(在 backend 目录下执行):
+    python -m benchmarks.bench_embedding_batch --chars 10000 --batch-sizes 8 16 32 64
+"""
+import argparse
+import time
+
+from app.services.embedding import get_encoder
+from app.services.text_chunker import iter_chunks
+
+
+SAMPLE_PARAGRAPH = (
+    "为维护小区公共秩序,业主应按时缴纳物业服务费。物业费按建筑面积每月每平方米2.5元收取,"
+    "可通过微信、支付宝或前台现金方式缴纳。逾期未缴的,自逾期之日起按日加收万分之五的滞纳金。"
+    "车辆进出小区须登记,地下车位月租费为300元,临时停车前两小时免费。"
+)
+
+
+def build_chunks(total_chars: int):
+    """构造指定长度的测试文档并分块"""
+    repeats = total_chars // len(SAMPLE_PARAGRAPH) + 1
+    text = (SAMPLE_PARAGRAPH * repeats)[:total_chars]
+    chunks = list(iter_chunks(text))
+    return [f"物业管理规定\n\n{chunk}" for chunk in chunks]
+
+
+def bench_per_chunk(encoder, texts):
+    started = time.perf_counter()
+    vectors = [encoder.encode(text).tolist() for text in texts]
+    return time.perf_counter() - started, len(vectors)
+
+
+def bench_batched(encoder, texts, batch_size):
+    started = time.perf_counter()
+    vectors = encoder.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    ).tolist()
+    return time.perf_counter() - started, len(vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量化批处理基准测试")
+    parser.add_argument("--chars", type=int, default=10000, help="测试文档字符数")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    encoder = get_encoder()
+    texts = build_chunks(args.chars)
+    encoder.encode(texts[:2])  # 预热
+
+    print(f"文档长度={args.chars} 字符, 分块数={len(texts)}")
+
+    best = min(bench_per_chunk(encoder, texts)[0] for _ in range(args.rounds))
+    print(f"逐块向量化: {best * 1000:8.1f} ms  ({len(texts) / best:7.1f} 块/秒)")
+
+    for batch_size in args.batch_sizes:
+        elapsed = min(bench_batched(encoder, texts, batch_size)[0] for _ in range(args.rounds))
+        print(
+            f"批量向量化(batch={batch_size:3d}): {elapsed * 1000:8.1f} ms  "
+            f"({len(texts) / elapsed:7.1f} 块/秒, 加速 {best / elapsed:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
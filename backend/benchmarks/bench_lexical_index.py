@@ -0,0 +1,65 @@
+"""
+基准测试: BM25倒排索引的构建和查询耗时
+
+用法(在 backend 目录下执行):
+    python -m benchmarks.bench_lexical_index --chunks 100000 --queries 1000
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from app.services.lexical_index import LexicalIndex
+
+VOCAB = (
+    "物业费 停车费 车位 缴纳 滞纳金 装修 押金 电梯 维修 消防 通道 垃圾 分类 绿化 保洁 门禁 "
+    "快递 水电 燃气 供暖 业主 大会 投诉 报修 公告 通知 规定 合同 财务 安全 监控 巡逻"
+).split()
+
+QUERIES = ["物业费怎么交", "停车费多少", "3-502 漏水报修", "装修押金退还", "2024年供暖通知", "电梯维修时间"]
+
+
+def random_chunk(rng: random.Random) -> str:
+    words = [rng.choice(VOCAB) for _ in range(rng.randint(40, 120))]
+    words.insert(rng.randrange(len(words)), f"{rng.randint(1, 30)}-{rng.randint(101, 2802)}")
+    return "，".join(words) + "。"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="倒排索引基准测试")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    index = LexicalIndex()
+
+    started = time.perf_counter()
+    for i in range(args.chunks):
+        index.add(i, {"document_id": i // 20, "title": "测试文档", "content": random_chunk(rng)})
+    print(f"构建: chunks={args.chunks}, 耗时={time.perf_counter() - started:.1f}s")
+
+    # 预热词项数组缓存
+    for query in QUERIES:
+        index.search(query, 10)
+
+    latencies = []
+    for i in range(args.queries):
+        started = time.perf_counter()
+        index.search(QUERIES[i % len(QUERIES)], 10)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    print(
+        f"查询: p50={np.percentile(latencies, 50):.2f}ms  "
+        f"p99={np.percentile(latencies, 99):.2f}ms"
+    )
+
+    started = time.perf_counter()
+    index.remove_document(0)
+    index.add("new", {"document_id": -1, "title": "新文档", "content": random_chunk(rng)})
+    print(f"增量更新(删除一个文档+新增一个分块): {(time.perf_counter() - started) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+兼容OpenAI接口的本地LLM桩服务,用于离线压测
+
+实现 POST /v1/chat/completions(支持 stream),按配置的延迟返回固定回复。
+
+用法(在 backend 目录下执行):
+    python -m scripts.llm_stub_server --port 8001 --latency-ms 800 --ttft-ms 200
+
+然后设置 OPENAI_BASE_URL=http://127.0.0.1:8001/v1 启动后端。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="LLM Stub")
+
+REPLY = (
+    "您好,我是小管家。物业费可通过微信、支付宝或物业服务中心前台缴纳,"
+    "按季度预交。如有其他问题,欢迎随时咨询。"
+)
+
+config = {"latency_ms": 800.0, "ttft_ms": 200.0, "jitter": 0.2, "error_rate": 0.0}
+
+
+def _delay(ms: float) -> float:
+    return max(0.0, ms * (1 + random.uniform(-config["jitter"], config["jitter"]))) / 1000
+
+
+def _completion_id() -> str:
+    return f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub-model")
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+
+    if random.random() < config["error_rate"]:
+        await asyncio.sleep(_delay(config["ttft_ms"]))
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "stub rate limit", "type": "rate_limit_error"}},
+        )
+
+    if not body.get("stream"):
+        await asyncio.sleep(_delay(config["latency_ms"]))
+        return {
+            "id": _completion_id(),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": REPLY},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(REPLY),
+                "total_tokens": prompt_tokens + len(REPLY),
+            },
+        }
+
+    async def stream():
+        completion_id = _completion_id()
+        created = int(time.time())
+        await asyncio.sleep(_delay(config["ttft_ms"]))
+        per_token = max(0.0, config["latency_ms"] - config["ttft_ms"]) / 1000 / len(REPLY)
+        for char in REPLY:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": char}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(per_token)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI兼容的LLM桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="完整回复耗时")
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="流式首token耗时")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟随机抖动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回429的概率")
+    args = parser.parse_args()
+
+    config.update(
+        latency_ms=args.latency_ms,
+        ttft_ms=args.ttft_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
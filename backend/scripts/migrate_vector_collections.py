@@ -0,0 +1,100 @@
+"""
+将按物业划分的向量集合迁移到共享集合
+
+迁移完成后将 VECTOR_STORAGE_MODE 设置为 shared 即可切换。
+
+用法(在 backend 目录下执行):
+    python -m scripts.migrate_vector_collections [--delete-source] [--batch-size 256]
+"""
+import argparse
+import asyncio
+
+from loguru import logger
+from qdrant_client.models import PointStruct
+
+from app.core.config import settings
+from app.db.qdrant import (
+    close_qdrant_client,
+    ensure_collection,
+    forget_collection,
+    get_qdrant_client,
+)
+from app.services.vector_backends import SHARED_COLLECTION_INDEXES
+
+
+async def list_property_collections():
+    """列出所有按物业划分的集合: [(集合名, 物业ID)]"""
+    client = get_qdrant_client()
+    prefix = f"{settings.VECTOR_COLLECTION_NAME}_"
+    collections = await client.get_collections()
+
+    result = []
+    for col in collections.collections:
+        suffix = col.name[len(prefix):]
+        if col.name.startswith(prefix) and suffix.isdigit():
+            result.append((col.name, int(suffix)))
+    return sorted(result, key=lambda item: item[1])
+
+
+async def migrate_collection(source: str, property_id: int, target: str, batch_size: int) -> int:
+    """迁移单个集合,返回迁移的点数"""
+    client = get_qdrant_client()
+    migrated = 0
+    offset = None
+
+    while True:
+        records, offset = await client.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if records:
+            points = []
+            for record in records:
+                payload = dict(record.payload or {})
+                payload["property_id"] = property_id
+                points.append(PointStruct(id=record.id, vector=record.vector, payload=payload))
+
+            await client.upsert(collection_name=target, points=points)
+            migrated += len(points)
+
+        if offset is None:
+            break
+
+    return migrated
+
+
+async def main(delete_source: bool, batch_size: int):
+    collections = await list_property_collections()
+    if not collections:
+        logger.info("没有需要迁移的集合")
+        return
+
+    # 创建共享集合及 property_id 索引
+    target = settings.VECTOR_COLLECTION_NAME
+    await ensure_collection(target, payload_indexes=SHARED_COLLECTION_INDEXES)
+
+    total = 0
+    for source, property_id in collections:
+        count = await migrate_collection(source, property_id, target, batch_size)
+        total += count
+        logger.info(f"迁移集合: {source} -> {target}, points={count}")
+
+        if delete_source:
+            await get_qdrant_client().delete_collection(source)
+            forget_collection(source)
+            logger.info(f"删除源集合: {source}")
+
+    logger.info(f"✅ 迁移完成: collections={len(collections)}, points={total}")
+    await close_qdrant_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="迁移向量集合到共享集合")
+    parser.add_argument("--delete-source", action="store_true", help="迁移后删除原集合")
+    parser.add_argument("--batch-size", type=int, default=settings.QDRANT_UPSERT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.delete_source, args.batch_size))
@@ -0,0 +1,52 @@
+"""
+测试公共夹具
+"""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.db.database import Base
+from app.models import document, message, payment, property, user  # noqa: F401 注册全部模型
+from app.services.history_buffer import recent_messages
+
+
+@pytest.fixture
+async def session_factory(monkeypatch, tmp_path):
+    """
+    内存SQLite数据库,替换各模块使用的 AsyncSessionLocal
+
+    同时关闭最近消息缓存、使用本地向量后端,测试不依赖Redis和Qdrant。
+    """
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    factory = async_sessionmaker(
+        engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        autoflush=False,
+    )
+    monkeypatch.setattr("app.api.chat.AsyncSessionLocal", factory)
+    monkeypatch.setattr("app.services.ai_service.AsyncSessionLocal", factory)
+    monkeypatch.setattr(settings, "HISTORY_BUFFER_ENABLED", False)
+    monkeypatch.setattr(settings, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(settings, "VECTOR_LOCAL_DIR", str(tmp_path / "vectors"))
+    monkeypatch.setattr(recent_messages, "append", AsyncMock())
+
+    yield factory
+    await engine.dispose()
+
+
+@pytest.fixture
+def current_user():
+    """当前登录用户(接口只读取 id 和 property_id)"""
+    return SimpleNamespace(id=1, property_id=1)
@@ -0,0 +1,115 @@
+"""
+发送消息的事务: 用户消息、AI回复和会话统计一起提交或一起回滚
+"""
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.api import chat
+from app.models.message import Conversation, Message
+from app.services.llm_limiter import LLMOverloadedError
+
+
+class FakeAIService:
+    """按预设返回回复或抛出异常的 AIService"""
+
+    response = None
+    error = None
+
+    def __init__(self, db, property_id, keep_history=False):
+        pass
+
+    async def chat(self, conversation_id, user_message, use_rag=True):
+        if self.error is not None:
+            raise self.error
+        return dict(self.response)
+
+
+@pytest.fixture
+def ai_service(monkeypatch):
+    monkeypatch.setattr(chat, "AIService", FakeAIService)
+    FakeAIService.response = {"content": "您好,已为您登记。", "model": "test", "tokens": 12, "sources": []}
+    FakeAIService.error = None
+    return FakeAIService
+
+
+async def _create_conversation(session_factory, message_count=0) -> int:
+    async with session_factory() as session:
+        conversation = Conversation(
+            user_id=1,
+            property_id=1,
+            title="报修",
+            message_count=message_count,
+            last_message_at=datetime(2024, 1, 1),
+        )
+        session.add(conversation)
+        await session.commit()
+        return conversation.id
+
+
+async def _counts(session_factory):
+    async with session_factory() as session:
+        conversations = await session.scalar(select(func.count()).select_from(Conversation))
+        messages = await session.scalar(select(func.count()).select_from(Message))
+    return conversations, messages
+
+
+async def test_send_commits_turn_and_counters(session_factory, current_user, ai_service):
+    conversation_id = await _create_conversation(session_factory, message_count=2)
+
+    async with session_factory() as db:
+        response = await chat.send_message(
+            chat.ChatMessage(content="电梯坏了", conversation_id=conversation_id), current_user, db
+        )
+
+    assert response.content == "您好,已为您登记。"
+    async with session_factory() as session:
+        conversation = await session.get(Conversation, conversation_id)
+        roles = (await session.execute(
+            select(Message.role).where(Message.conversation_id == conversation_id).order_by(Message.id)
+        )).scalars().all()
+    assert conversation.message_count == 4
+    assert conversation.last_message_at > datetime(2024, 1, 1)
+    assert [role.value for role in roles] == ["user", "assistant"]
+
+
+async def test_new_conversation_created_in_same_transaction(session_factory, current_user, ai_service):
+    async with session_factory() as db:
+        await chat.send_message(chat.ChatMessage(content="物业费怎么交"), current_user, db)
+
+    async with session_factory() as session:
+        conversation = (await session.execute(select(Conversation))).scalar_one()
+    assert conversation.message_count == 2
+    assert await _counts(session_factory) == (1, 2)
+
+
+async def test_ai_failure_leaves_nothing(session_factory, current_user, ai_service):
+    ai_service.error = LLMOverloadedError("排队已满")
+
+    async with session_factory() as db:
+        with pytest.raises(HTTPException) as exc_info:
+            await chat.send_message(chat.ChatMessage(content="物业费怎么交"), current_user, db)
+
+    assert exc_info.value.status_code == 503
+    assert await _counts(session_factory) == (0, 0)
+
+
+async def test_failed_commit_rolls_back_whole_turn(session_factory, current_user, ai_service):
+    conversation_id = await _create_conversation(session_factory, message_count=2)
+    # 回复内容为空违反非空约束,提交失败
+    ai_service.response = {"content": None, "model": "test", "tokens": 0, "sources": []}
+
+    async with session_factory() as db:
+        with pytest.raises(IntegrityError):
+            await chat.send_message(
+                chat.ChatMessage(content="电梯坏了", conversation_id=conversation_id), current_user, db
+            )
+
+    async with session_factory() as session:
+        conversation = await session.get(Conversation, conversation_id)
+    assert conversation.message_count == 2
+    assert conversation.last_message_at == datetime(2024, 1, 1)
+    assert await _counts(session_factory) == (1, 0)
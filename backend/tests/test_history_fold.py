@@ -0,0 +1,146 @@
+"""
+对话历史折叠: 超出提示词预算或读取窗口之前的未摘要消息都折叠进摘要,不会被丢弃
+"""
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.core.config import settings
+from app.models.message import Conversation, Message, MessageRole
+from app.services.ai_service import AIService
+from app.services.llm_providers import Completion
+from app.services.prompt_builder import PromptBuilder
+
+
+async def _create_conversation(session_factory, n_messages, summary=None, summary_message_id=0):
+    """创建会话和 n_messages 条交替的用户/助手消息,返回 (会话ID, 消息ID列表)"""
+    started = datetime(2024, 1, 1)
+    async with session_factory() as session:
+        conversation = Conversation(
+            user_id=1,
+            property_id=1,
+            title="历史",
+            message_count=n_messages,
+            summary=summary,
+            summary_message_id=summary_message_id,
+        )
+        session.add(conversation)
+        await session.flush()
+        messages = [
+            Message(
+                conversation_id=conversation.id,
+                role=MessageRole.USER if i % 2 == 0 else MessageRole.ASSISTANT,
+                content=f"第{i}条消息",
+                created_at=started + timedelta(seconds=i),
+            )
+            for i in range(n_messages)
+        ]
+        session.add_all(messages)
+        await session.commit()
+        return conversation.id, [message.id for message in messages]
+
+
+@pytest.fixture
+def ai(session_factory):
+    service = AIService(None, 1)
+    service._schedule_summary = MagicMock()
+    return service
+
+
+async def test_short_history_is_not_folded(ai, session_factory):
+    conversation_id, _ = await _create_conversation(session_factory, 4)
+
+    await ai._build_messages(conversation_id, "新问题", use_rag=False)
+
+    ai._schedule_summary.assert_not_called()
+
+
+async def test_messages_before_fetch_window_are_folded(ai, session_factory):
+    n_messages = settings.HISTORY_FETCH_LIMIT + 10
+    conversation_id, ids = await _create_conversation(session_factory, n_messages)
+
+    messages, _, _ = await ai._build_messages(conversation_id, "新问题", use_rag=False)
+
+    # 只有最近 HISTORY_FETCH_LIMIT 条进入提示词,之前的消息交给摘要
+    window_start = n_messages - settings.HISTORY_FETCH_LIMIT
+    assert "第0条消息" not in [message["content"] for message in messages]
+    ai._schedule_summary.assert_called_once_with(conversation_id, None, 0, ids[window_start] - 1)
+
+
+async def test_overflow_is_folded_through_last_dropped_turn(ai, session_factory):
+    conversation_id, ids = await _create_conversation(session_factory, 10)
+    ai.prompt_builder = PromptBuilder(history_budget=40)
+
+    messages, _, _ = await ai._build_messages(conversation_id, "新问题", use_rag=False)
+
+    kept = {message["content"] for message in messages}
+    dropped = [message_id for i, message_id in enumerate(ids) if f"第{i}条消息" not in kept]
+    assert dropped and dropped == ids[:len(dropped)]
+    ai._schedule_summary.assert_called_once_with(conversation_id, None, 0, dropped[-1])
+
+
+async def test_unsummarized_history_starts_after_summary(ai, session_factory):
+    conversation_id, ids = await _create_conversation(session_factory, 6)
+    async with session_factory() as session:
+        conversation = await session.get(Conversation, conversation_id)
+        conversation.summary = "业主反映电梯故障"
+        conversation.summary_message_id = ids[3]
+        await session.commit()
+
+    messages, _, _ = await ai._build_messages(conversation_id, "新问题", use_rag=False)
+
+    contents = [message["content"] for message in messages]
+    assert "第3条消息" not in contents
+    assert "第4条消息" in contents and "第5条消息" in contents
+    ai._schedule_summary.assert_not_called()
+
+
+def _summary_completion(content="新的摘要"):
+    return AsyncMock(return_value=Completion(content=content, model="test", provider="test", total_tokens=1))
+
+
+async def test_fold_history_summarizes_up_to_fold_point(ai, session_factory):
+    conversation_id, ids = await _create_conversation(session_factory, 8)
+    ai._complete = _summary_completion()
+
+    await ai._fold_history(conversation_id, None, 0, ids[4])
+
+    prompt = ai._complete.call_args.kwargs["messages"][-1]["content"]
+    assert "第0条消息" in prompt and "第4条消息" in prompt
+    assert "第5条消息" not in prompt
+    async with session_factory() as session:
+        conversation = await session.get(Conversation, conversation_id)
+    assert conversation.summary == "新的摘要"
+    assert conversation.summary_message_id == ids[4]
+
+
+async def test_fold_history_advances_in_batches(ai, session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "HISTORY_FOLD_BATCH", 3)
+    conversation_id, ids = await _create_conversation(session_factory, 8)
+    ai._complete = _summary_completion()
+
+    await ai._fold_history(conversation_id, None, 0, ids[6])
+
+    async with session_factory() as session:
+        conversation = await session.get(Conversation, conversation_id)
+    assert conversation.summary_message_id == ids[2]
+
+
+async def test_fold_history_does_not_overwrite_newer_summary(ai, session_factory):
+    conversation_id, ids = await _create_conversation(
+        session_factory, 8, summary="其他进程的摘要", summary_message_id=0
+    )
+    ai._complete = _summary_completion()
+    async with session_factory() as session:
+        conversation = await session.get(Conversation, conversation_id)
+        conversation.summary_message_id = ids[5]
+        await session.commit()
+
+    # 读取历史时摘要边界还是 0,折叠期间已被其他请求推进
+    await ai._fold_history(conversation_id, None, 0, ids[3])
+
+    async with session_factory() as session:
+        conversation = await session.get(Conversation, conversation_id)
+    assert conversation.summary == "其他进程的摘要"
+    assert conversation.summary_message_id == ids[5]
@@ -0,0 +1,137 @@
+"""
+本地向量索引: 向量文件和 points.jsonl 在写入、覆盖、删除和中断的写入之后保持按行对齐
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app.services.vector_backends import LocalVectorIndex
+
+DIM = 8
+
+
+def _vector(i: int) -> np.ndarray:
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+def _payload(i: int, document_id: int = 1) -> dict:
+    return {"document_id": document_id, "content": f"分块{i}"}
+
+
+def _assert_aligned(index: LocalVectorIndex):
+    """每个点的向量检索出的都是它自己的payload"""
+    points = index.all_points()
+    itemsize = np.dtype(index.dtype).itemsize
+    assert index.vectors_path.stat().st_size == len(points) * DIM * itemsize
+    for point_id, payload in points.items():
+        i = int(point_id.split("-")[1])
+        (score, found), *_ = index.search(_vector(i), limit=1, score_threshold=0.0)
+        assert found == payload
+        assert score == pytest.approx(1.0, abs=0.01)
+
+
+@pytest.fixture(params=[False, True], ids=["float32", "int8"])
+def index(request, tmp_path):
+    return LocalVectorIndex(tmp_path, dim=DIM, quantize=request.param)
+
+
+def test_upsert_and_search(index):
+    index.upsert(
+        [f"p-{i}" for i in range(4)],
+        np.stack([_vector(i) for i in range(4)]),
+        [_payload(i) for i in range(4)],
+    )
+
+    assert len(index.all_points()) == 4
+    _assert_aligned(index)
+
+
+def test_upsert_replaces_existing_points(index):
+    index.upsert(["p-0", "p-1"], np.stack([_vector(0), _vector(1)]), [_payload(0), _payload(1)])
+    index.upsert(["p-1", "p-2"], np.stack([_vector(1), _vector(2)]), [_payload(11), _payload(2)])
+
+    points = index.all_points()
+    assert sorted(points) == ["p-0", "p-1", "p-2"]
+    assert points["p-1"] == _payload(11)
+    _assert_aligned(index)
+
+
+def test_delete_keeps_remaining_rows_aligned(index):
+    index.upsert(
+        [f"p-{i}" for i in range(5)],
+        np.stack([_vector(i) for i in range(5)]),
+        [_payload(i, document_id=1 if i < 2 else 2) for i in range(5)],
+    )
+
+    assert index.delete_ids(["p-3"]) == 1
+    assert index.delete_where("document_id", 1) == 2
+    assert index.delete_ids(["p-3"]) == 0
+
+    assert sorted(index.all_points()) == ["p-2", "p-4"]
+    _assert_aligned(index)
+
+
+def test_update_payloads_keeps_vectors(index):
+    index.upsert(["p-0", "p-1"], np.stack([_vector(0), _vector(1)]), [_payload(0), _payload(1)])
+
+    index.update_payloads({"p-1": _payload(21)})
+
+    assert index.all_points()["p-1"] == _payload(21)
+    _assert_aligned(index)
+
+
+def test_upsert_recovers_from_interrupted_write(index, tmp_path):
+    index.upsert(["p-0", "p-1"], np.stack([_vector(0), _vector(1)]), [_payload(0), _payload(1)])
+
+    # 模拟写入中断: 向量已追加,payload行只写了一半
+    with open(index.vectors_path, "ab") as f:
+        f.write(index._encode(_vector(5)[None, :]).tobytes())
+    with open(index.points_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "p-5", "payload": _payload(5)})[:10])
+
+    # 其他进程(新实例)读取时忽略未写完的尾部
+    reopened = LocalVectorIndex(tmp_path, dim=DIM, quantize=index.quantize)
+    assert sorted(reopened.all_points()) == ["p-0", "p-1"]
+
+    reopened.upsert(["p-2"], _vector(2)[None, :], [_payload(2)])
+
+    assert sorted(reopened.all_points()) == ["p-0", "p-1", "p-2"]
+    _assert_aligned(reopened)
+
+
+def test_interrupted_rewrite_keeps_previous_version(index, tmp_path, monkeypatch):
+    index.upsert(
+        [f"p-{i}" for i in range(4)],
+        np.stack([_vector(i) for i in range(4)]),
+        [_payload(i) for i in range(4)],
+    )
+
+    # 模拟重写时在切换版本前崩溃: 新版本目录已写完,CURRENT 尚未替换
+    real_replace = os.replace
+
+    def crash_on_switch(src, dst):
+        if os.fspath(dst) == os.fspath(index.current_path):
+            raise OSError("模拟崩溃")
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", crash_on_switch)
+    with pytest.raises(OSError):
+        index.delete_ids(["p-1"])
+    monkeypatch.setattr(os, "replace", real_replace)
+
+    # 本进程和其他进程都继续使用旧版本
+    assert sorted(index.all_points()) == ["p-0", "p-1", "p-2", "p-3"]
+    _assert_aligned(index)
+    reopened = LocalVectorIndex(tmp_path, dim=DIM, quantize=index.quantize)
+    assert sorted(reopened.all_points()) == ["p-0", "p-1", "p-2", "p-3"]
+    _assert_aligned(reopened)
+
+    # 之后的重写成功,并清理未完成的版本目录
+    assert reopened.delete_ids(["p-1"]) == 1
+    assert sorted(reopened.all_points()) == ["p-0", "p-2", "p-3"]
+    _assert_aligned(reopened)
+    assert [entry.name for entry in tmp_path.iterdir() if entry.is_dir()] == [reopened.current_path.read_text()]
@@ -0,0 +1,126 @@
+"""
+会话列表和消息历史的游标分页: 时间相同的行按ID排序,翻页不重复、不遗漏
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import chat
+from app.models.message import Conversation, Message, MessageRole
+
+BASE_TIME = datetime(2024, 1, 1, 12, 0, 0)
+
+
+async def _create_conversations(session_factory, offsets, user_id=1):
+    """按最后消息时间偏移(秒)创建会话,返回ID列表"""
+    async with session_factory() as session:
+        conversations = [
+            Conversation(
+                user_id=user_id,
+                property_id=1,
+                title=f"会话{i}",
+                message_count=0,
+                last_message_at=BASE_TIME + timedelta(seconds=offset),
+            )
+            for i, offset in enumerate(offsets)
+        ]
+        session.add_all(conversations)
+        await session.commit()
+        return [conversation.id for conversation in conversations]
+
+
+async def _list_all_conversations(session_factory, current_user, limit):
+    pages = []
+    before_id = None
+    while True:
+        async with session_factory() as db:
+            page = await chat.get_conversations(
+                before_id=before_id, limit=limit, current_user=current_user, db=db
+            )
+        if not page:
+            return pages
+        pages.append([item.id for item in page])
+        if len(page) < limit:
+            return pages
+        before_id = page[-1].id
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 5, 10])
+async def test_conversation_pages_cover_ties_once(session_factory, current_user, limit):
+    # 三个会话的最后消息时间相同,且恰好跨越页边界
+    ids = await _create_conversations(session_factory, [0, 10, 10, 10, 20])
+    await _create_conversations(session_factory, [30], user_id=2)
+
+    pages = await _list_all_conversations(session_factory, current_user, limit)
+
+    listed = [conversation_id for page in pages for conversation_id in page]
+    expected = [ids[4], ids[3], ids[2], ids[1], ids[0]]
+    assert listed == expected
+    assert all(len(page) <= limit for page in pages)
+
+
+async def test_conversation_cursor_of_other_user_is_rejected(session_factory, current_user):
+    other_id, = await _create_conversations(session_factory, [0], user_id=2)
+
+    async with session_factory() as db:
+        with pytest.raises(HTTPException) as exc_info:
+            await chat.get_conversations(
+                before_id=other_id, limit=20, current_user=current_user, db=db
+            )
+    assert exc_info.value.status_code == 404
+
+
+async def _create_messages(session_factory, conversation_id, offsets):
+    async with session_factory() as session:
+        messages = [
+            Message(
+                conversation_id=conversation_id,
+                role=MessageRole.USER if i % 2 == 0 else MessageRole.ASSISTANT,
+                content=f"消息{i}",
+                created_at=BASE_TIME + timedelta(seconds=offset),
+            )
+            for i, offset in enumerate(offsets)
+        ]
+        session.add_all(messages)
+        await session.commit()
+        return [message.id for message in messages]
+
+
+async def test_message_pages_and_has_more(session_factory, current_user):
+    conversation_id, = await _create_conversations(session_factory, [0])
+    # 用户消息和回复在同一事务中写入时 created_at 可能相同
+    ids = await _create_messages(session_factory, conversation_id, [0, 0, 5, 5, 9])
+
+    async with session_factory() as db:
+        first = await chat.get_conversation(
+            conversation_id, before_id=None, limit=2, current_user=current_user, db=db
+        )
+    assert [message.id for message in first.messages] == ids[3:]
+    assert first.has_more
+
+    async with session_factory() as db:
+        second = await chat.get_conversation(
+            conversation_id, before_id=first.messages[0].id, limit=2, current_user=current_user, db=db
+        )
+    assert [message.id for message in second.messages] == ids[1:3]
+    assert second.has_more
+
+    async with session_factory() as db:
+        last = await chat.get_conversation(
+            conversation_id, before_id=second.messages[0].id, limit=2, current_user=current_user, db=db
+        )
+    assert [message.id for message in last.messages] == ids[:1]
+    assert not last.has_more
+
+
+async def test_message_page_exactly_at_limit_has_no_more(session_factory, current_user):
+    conversation_id, = await _create_conversations(session_factory, [0])
+    ids = await _create_messages(session_factory, conversation_id, [0, 1, 2])
+
+    async with session_factory() as db:
+        page = await chat.get_conversation(
+            conversation_id, before_id=None, limit=3, current_user=current_user, db=db
+        )
+    assert [message.id for message in page.messages] == ids
+    assert not page.has_more
@@ -0,0 +1,41 @@
+"""
+文本分块: 没有标点的超长文本也不超过单块token上限
+"""
+import pytest
+
+from app.core.config import settings
+from app.services.text_chunker import estimate_tokens, iter_chunks
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "物业服务中心负责小区公共区域的日常维护管理" * 40,
+        "业主应当按时缴纳物业服务费" * 30 + "。" + "electricity maintenance schedule " * 40,
+        ("地下车库照明系统改造工程" * 20 + "\n\n") * 3,
+    ],
+    ids=["cjk", "mixed", "paragraphs"],
+)
+def test_unpunctuated_text_respects_token_cap(text):
+    chunks = list(iter_chunks(text))
+
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= settings.CHUNK_MAX_TOKENS for chunk in chunks)
+    assert all(len(chunk) <= settings.CHUNK_SIZE for chunk in chunks)
+
+
+def test_hard_split_keeps_all_text():
+    text = "门禁系统升级期间请使用临时通行证" * 50
+
+    chunks = list(iter_chunks(text, overlap=0))
+
+    assert "".join(chunks) == text
+    assert all(estimate_tokens(chunk) <= settings.CHUNK_MAX_TOKENS for chunk in chunks)
+
+
+def test_token_cap_can_be_disabled():
+    text = "消防通道禁止停放车辆" * 20
+
+    chunks = list(iter_chunks(text, chunk_size=1000, max_tokens=0))
+
+    assert chunks == [text]